@@ -0,0 +1,133 @@
+"""Lock contention benchmark for LimitEngine.calculate_limits.
+
+Run from backend/:
+
+    python -m dynamic_spend_control.benchmark --workers 1,2,4,8,16,32 --shards 1,64 --output bench.json
+
+Hammers one LimitEngine from a thread pool with a seeded stream of limit
+calculations over --users users, once per (shards, workers) pair. shards=1
+is the old single global lock. The transaction-service usage lookup is
+emulated with --usage-latency-ms (taken outside the shard lock), and
+--state-latency-us (off by default) adds a sleep inside the lock to stand in
+for heavier per-user state updates. Both are time.sleep calls, which release
+the GIL, so any speedup they show comes from overlapping sleeps rather than
+from the engine itself; every run is therefore repeated with no emulated
+latency and reported under "unemulated" next to the "emulated" numbers.
+Reports calls/sec, latency percentiles, speedup over one worker and the
+fraction of shard lock acquisitions that had to wait.
+"""
+import json
+import time
+import random
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Tuple
+import numpy as np
+from fraud_scoring.benchmark import summarize, environment
+from .limit_engine import LimitEngine
+
+BASE_LIMITS = {'daily': 5000, 'transaction': 1000}
+LOCATIONS = ['US', 'IN', 'GB', 'SG', 'global']
+
+
+def generate_calls(n: int, users: int, seed: int) -> List[Tuple[Dict, Dict]]:
+    rng = random.Random(seed)
+    calls = []
+    for _ in range(n):
+        daily = rng.uniform(1000, 10000)
+        calls.append((
+            {'daily': daily, 'transaction': daily / 5, 'weekly': daily * 7},
+            {'user_id': f'USER{rng.randrange(users):07d}',
+             'final_risk_score': rng.betavariate(2, 5),
+             'location': rng.choice(LOCATIONS)}
+        ))
+    return calls
+
+
+def make_engine(shards: int, usage_latency_ms: float, state_latency_us: float) -> LimitEngine:
+    engine = LimitEngine(base_limits=BASE_LIMITS, decay_rate=0.1, shards=shards)
+
+    def usage(user_id: str) -> float:
+        if usage_latency_ms:
+            time.sleep(usage_latency_ms / 1000.0)
+        return 0.2
+
+    adjust = engine._calculate_adjustments
+
+    def adjustments(*args):
+        if state_latency_us:
+            time.sleep(state_latency_us / 1e6)
+        return adjust(*args)
+
+    engine._calculate_usage = usage
+    engine._calculate_adjustments = adjustments
+    return engine
+
+
+def run(engine: LimitEngine, calls: List[Tuple[Dict, Dict]], workers: int) -> Dict[str, Any]:
+    market = engine.market_conditions
+
+    def worker(chunk: List[Tuple[Dict, Dict]]) -> np.ndarray:
+        latencies = np.empty(len(chunk), dtype=np.int64)
+        for i, (limits, risk) in enumerate(chunk):
+            t0 = time.perf_counter_ns()
+            engine.calculate_limits(limits, risk, market)
+            latencies[i] = time.perf_counter_ns() - t0
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        start = time.perf_counter()
+        parts = list(pool.map(worker, [calls[i::workers] for i in range(workers)]))
+        wall = time.perf_counter() - start
+    stats = summarize(np.concatenate(parts), len(calls), wall)
+    stats.update(engine.get_contention_stats())
+    return stats
+
+
+def main(argv=None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Benchmark LimitEngine lock contention")
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--workers', default='1,2,4,8,16,32')
+    parser.add_argument('--shards', default='1,64')
+    parser.add_argument('--usage-latency-ms', type=float, default=1.0)
+    parser.add_argument('--state-latency-us', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.ERROR)  # PolicyRules complains about its missing rules file on every watch tick
+    calls = generate_calls(args.calls, args.users, args.seed)
+    modes = {'unemulated': (0.0, 0.0)}
+    if args.usage_latency_ms or args.state_latency_us:
+        modes['emulated'] = (args.usage_latency_ms, args.state_latency_us)
+    results: Dict[str, Any] = {}
+    for shards in [int(s) for s in args.shards.split(',')]:
+        baselines: Dict[str, float] = {}
+        for workers in [int(w) for w in args.workers.split(',')]:
+            row = {}
+            for mode, (usage_ms, state_us) in modes.items():
+                stats = run(make_engine(shards, usage_ms, state_us), calls, workers)
+                baselines.setdefault(mode, stats['items_per_sec'])
+                stats['speedup'] = round(stats['items_per_sec'] / baselines[mode], 2)
+                row[mode] = stats
+            results[f'shards={shards},workers={workers}'] = row
+
+    report = {
+        'schema': 'fortifi.dynamic_spend_control.benchmark/2',
+        'params': vars(args),
+        'environment': environment(),
+        'results': results
+    }
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(payload)
+    else:
+        print(payload)
+    return report
+
+
+if __name__ == "__main__":
+    main()
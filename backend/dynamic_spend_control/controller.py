@@ -4,6 +4,9 @@ import time
 import queue
 import threading
 import hashlib
+import itertools
+from contextlib import contextmanager
+from collections import defaultdict, deque
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor
@@ -14,14 +17,16 @@ from .risk_evaluator import RiskEvaluator
 from .limit_engine import LimitEngine
 from .limit_sync import LimitSync
 from .limit_logger import LimitLogger
+from .policy_rules import PolicyRules
 
 class SpendController:
     def __init__(self):
         self.logger = StructuredLogger(name="SpendController")
         self._init_queues()
         self._init_components()
-        self._start_system_services()
+        # Breakers must exist before the monitor and workers start reading them
         self._load_circuit_breakers()
+        self._start_system_services()
 
     def _init_queues(self):
         """Initialize processing queues with monitoring"""
@@ -29,15 +34,21 @@ class SpendController:
         self.high_priority_queue = queue.PriorityQueue(maxsize=1000)
         self.emergency_queue = queue.Queue(maxsize=100)
         self.queue_metrics = {
+            'total_failed': 0,
             'total_processed': 0,
             'avg_processing_time': 0.0,
             'last_processed': None
         }
+        # Sequence number breaks priority ties, so transaction dicts are never compared
+        self._sequence = itertools.count()
+        self.metrics_lock = threading.Lock()
+        self.batch_sizes = deque(maxlen=1024)
+        self.stage_latency = defaultdict(lambda: deque(maxlen=1024))
 
     def _init_components(self):
         """Initialize subsystem components with dependency injection"""
         self.profile_fetcher = UserProfileFetcher(
-            cache_size=config.get('profile_cache_size', 1000),
+            cache_bytes=config.get('profile_cache_bytes', 64 * 1024 * 1024),
             cache_ttl=config.get('profile_cache_ttl', 300)
         )
         self.risk_evaluator = RiskEvaluator(
@@ -64,6 +75,7 @@ class SpendController:
             max_workers=config.get('controller_workers', 32),
             thread_name_prefix='SpendWorker'
         )
+        self._start_dispatcher()
         
         # Emergency processing thread
         self.emergency_processor = threading.Thread(
@@ -79,6 +91,21 @@ class SpendController:
         )
         self.monitor.start()
 
+    def _start_dispatcher(self):
+        """Drain transaction_queue in micro-batches onto the worker pool"""
+        self.batch_size = config.get('dispatch_batch_size', 64)
+        self.batch_window = config.get('dispatch_batch_window', 0.005)
+        # Bounds batches handed to the pool; the rest wait in the priority queue, not in the executor's FIFO
+        self.dispatch_slots = threading.BoundedSemaphore(
+            config.get('dispatch_max_in_flight', self.workers._max_workers * 2)
+        )
+        self.dispatch_lock = threading.Lock()
+        self.active_users = set()
+        self.pending_by_user = {}
+        self.dispatch_stop = threading.Event()
+        self.dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self.dispatcher.start()
+
     def _load_circuit_breakers(self):
         """Initialize circuit breakers for fault tolerance"""
         self.circuit_breakers = {
@@ -93,23 +120,153 @@ class SpendController:
             if self._is_emergency_transaction(transaction):
                 self.emergency_queue.put_nowait(transaction)
             else:
-                self.transaction_queue.put_nowait((priority, transaction))
-            self.logger.debug(f"Queued transaction {transaction.get('id')}")
+                self.transaction_queue.put_nowait(
+                    (priority, next(self._sequence), time.monotonic(), transaction)
+                )
         except queue.Full:
             self.logger.error("Transaction queue capacity exceeded")
             self._trigger_circuit_breaker('queue_overflow')
 
+    def _is_emergency_transaction(self, transaction: Dict) -> bool:
+        """Explicitly flagged transactions and compromise reports skip the priority queue"""
+        emergency_types = config.get('emergency_transaction_types', ['card_compromised', 'account_takeover'])
+        return bool(transaction.get('emergency')) or transaction.get('type') in emergency_types
+
     def _process_emergency_queue(self):
         """Dedicated emergency processing pipeline"""
         while True:
             try:
                 tx = self.emergency_queue.get(timeout=1)
-                start_time = time.monotonic()
+            except queue.Empty:
+                continue
+            user_id = tx.get('user_id')
+            with self.dispatch_lock:
+                if user_id in self.active_users:
+                    # A worker owns this user; run the emergency next, ahead of the user's queued work
+                    self.pending_by_user.setdefault(user_id, []).insert(0, (time.monotonic(), tx))
+                    continue
+                self.active_users.add(user_id)
+            start_time = time.monotonic()
+            try:
                 self._process_transaction(tx, emergency=True)
-                processing_time = time.monotonic() - start_time
-                self._update_metrics(processing_time)
+            finally:
+                self._update_metrics(time.monotonic() - start_time)
+                self._release_user(user_id)
+
+    def _release_user(self, user_id: str):
+        """Give up ownership of a user, handing anything queued for them meanwhile to a worker"""
+        with self.dispatch_lock:
+            items = self.pending_by_user.pop(user_id, None)
+            if not items:
+                self.active_users.discard(user_id)
+                return
+        self.dispatch_slots.acquire()
+        self.workers.submit(self._run_user_batch, user_id, items)
+
+    def _dispatch_loop(self):
+        """Pull micro-batches in priority order and hand each user's work to one worker"""
+        while not self.dispatch_stop.is_set() or not self.transaction_queue.empty():
+            try:
+                batch = [self.transaction_queue.get(timeout=0.5)]
             except queue.Empty:
                 continue
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.transaction_queue.get(timeout=remaining) if remaining > 0
+                                 else self.transaction_queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.metrics_lock:
+                self.batch_sizes.append(len(batch))
+
+            by_user = {}
+            for _, _, enqueued_at, tx in batch:
+                by_user.setdefault(tx.get('user_id'), []).append((enqueued_at, tx))
+            for user_id, items in by_user.items():
+                with self.dispatch_lock:
+                    if user_id in self.active_users:
+                        # A worker already owns this user; it picks these up when its batch is done
+                        self.pending_by_user.setdefault(user_id, []).extend(items)
+                        continue
+                    self.active_users.add(user_id)
+                self.dispatch_slots.acquire()
+                self.workers.submit(self._run_user_batch, user_id, items)
+
+    def _run_user_batch(self, user_id: str, items: List[Tuple[float, Dict]]):
+        """Process one user's transactions in order; only one worker runs a given user at a time"""
+        try:
+            while items:
+                for enqueued_at, tx in items:
+                    start_time = time.monotonic()
+                    self._record_latency('queue_wait', start_time - enqueued_at)
+                    try:
+                        self._process_transaction(tx, emergency=self._is_emergency_transaction(tx))
+                    except Exception as e:
+                        self.logger.error(f"Worker failed on {tx.get('id')}: {str(e)}")
+                    processing_time = time.monotonic() - start_time
+                    self._record_latency('total', processing_time)
+                    self._update_metrics(processing_time)
+                with self.dispatch_lock:
+                    items = self.pending_by_user.pop(user_id, None)
+                    if not items:
+                        self.active_users.discard(user_id)
+        finally:
+            self.dispatch_slots.release()
+
+    @contextmanager
+    def _stage(self, name: str):
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self._record_latency(name, time.monotonic() - start_time)
+
+    def _record_latency(self, stage: str, seconds: float):
+        with self.metrics_lock:
+            self.stage_latency[stage].append(seconds)
+
+    def _update_metrics(self, processing_time: float):
+        with self.metrics_lock:
+            n = self.queue_metrics['total_processed'] + 1
+            avg = self.queue_metrics['avg_processing_time']
+            self.queue_metrics.update({
+                'total_processed': n,
+                'avg_processing_time': avg + (processing_time - avg) / n,
+                'last_processed': datetime.utcnow().isoformat()
+            })
+
+    def get_dispatch_metrics(self) -> Dict:
+        """Queue depth, micro-batch sizes and per-stage latency (ms) over the recent window"""
+        with self.metrics_lock:
+            batches = list(self.batch_sizes)
+            samples = {stage: sorted(values) for stage, values in self.stage_latency.items()}
+            metrics = dict(self.queue_metrics)
+        with self.dispatch_lock:
+            active, backlog = len(self.active_users), sum(len(v) for v in self.pending_by_user.values())
+        metrics.update({
+            'queue_depth': self.transaction_queue.qsize(),
+            'emergency_queue_depth': self.emergency_queue.qsize(),
+            'active_users': active,
+            'per_user_backlog': backlog,
+            'batch_size': {
+                'avg': sum(batches) / len(batches) if batches else 0.0,
+                'max': max(batches, default=0),
+                'last': batches[-1] if batches else 0
+            },
+            'stage_latency_ms': {
+                stage: {
+                    'count': len(values),
+                    'avg': 1000 * sum(values) / len(values),
+                    'p50': 1000 * values[len(values) // 2],
+                    'p95': 1000 * values[min(len(values) - 1, int(len(values) * 0.95))],
+                    'max': 1000 * values[-1]
+                }
+                for stage, values in samples.items() if values
+            }
+        })
+        return metrics
 
     def _process_transaction(self, transaction: Dict, emergency: bool = False):
         """Core transaction processing logic"""
@@ -118,18 +275,23 @@ class SpendController:
         
         try:
             # Stage 1: Fetch user profile
-            profile = self._get_user_profile(user_id)
+            with self._stage('profile'):
+                profile = self._get_user_profile(user_id)
             
             # Stage 2: Risk evaluation
-            risk_assessment = self._evaluate_risk(profile, transaction)
+            with self._stage('risk'):
+                risk_assessment = self._evaluate_risk(profile, transaction)
             
             # Stage 3: Limit calculation
-            limit_update = self._calculate_limits(profile, risk_assessment)
+            with self._stage('limits'):
+                limit_update = self._calculate_limits(profile, risk_assessment)
             
             # Stage 4: Synchronization
             if limit_update:
-                sync_result = self._sync_limits(user_id, limit_update)
-                self._log_limit_change(user_id, limit_update, sync_result)
+                with self._stage('sync'):
+                    sync_result = self._sync_limits(user_id, limit_update)
+                with self._stage('log'):
+                    self._log_limit_change(user_id, limit_update, sync_result)
                 
                 if emergency:
                     self._execute_emergency_protocols(user_id, limit_update)
@@ -169,10 +331,11 @@ class SpendController:
     def _calculate_limits(self, profile: Dict, risk: Dict) -> Optional[Dict]:
         """Limit calculation with degradation handling"""
         try:
-            return self.limit_engine.calculate(
-                current_limits=profile['limits'],
-                risk_assessment=risk,
-                market_conditions=self._get_market_conditions()
+            user_id = profile.get('user_id', risk.get('user_id'))
+            return self.limit_engine.calculate_limits(
+                current_limits=None,  # read under the engine's shard lock
+                risk_assessment={**risk, 'user_id': user_id},
+                market_conditions=self.limit_engine.market_conditions
             )
         except Exception as e:
             self.logger.error(f"Limit calculation failed: {str(e)}")
@@ -206,12 +369,12 @@ class SpendController:
 
     def _generate_log_signature(self, user_id: str, limits: Dict) -> str:
         """Generate HMAC signature for audit log integrity"""
-        secret = config.get('log_secret', os.urandom(32))
-        return hashlib.blake2b(
-            json.dumps(limits).encode(),
-            key=secret,
-            salt=user_id.encode()
-        ).hexdigest()
+        secret = config.get('log_secret') or os.urandom(32)
+        if isinstance(secret, str):
+            secret = secret.encode()
+        # blake2b caps salt at 16 bytes, so the user id goes into the signed payload instead
+        payload = json.dumps({'user_id': user_id, 'limits': limits}, sort_keys=True).encode()
+        return hashlib.blake2b(payload, key=secret[:64]).hexdigest()
 
     def _monitor_system_health(self):
         """Comprehensive system health monitoring"""
@@ -228,9 +391,88 @@ class SpendController:
                 state.update({'tripped': False, 'failures': 0})
                 self.logger.info(f"Reset circuit breaker for {service}")
 
+    def _update_circuit_breaker(self, service: str):
+        """Count a service failure and trip the breaker at the configured threshold"""
+        state = self.circuit_breakers[service]
+        state['failures'] += 1
+        state['last_failure'] = datetime.now()
+        if not state['tripped'] and state['failures'] >= config.get('circuit_breaker_threshold', 5):
+            state['tripped'] = True
+            self.logger.critical(f"Circuit breaker tripped for {service}")
+
+    def _trigger_circuit_breaker(self, name: str):
+        """Trip a breaker immediately (e.g. queue overflow); reset by the health monitor"""
+        state = self.circuit_breakers.setdefault(name, {'failures': 0, 'last_failure': None, 'tripped': False})
+        state.update({'failures': state['failures'] + 1, 'last_failure': datetime.now(), 'tripped': True})
+        self.logger.critical(f"Circuit breaker triggered: {name}")
+
+    def _handle_processing_failure(self, user_id: str):
+        with self.metrics_lock:
+            self.queue_metrics['total_failed'] += 1
+        self.logger.warning(f"Transaction processing failed for user {user_id}")
+
+    def _fallback_risk_assessment(self, transaction: Dict) -> Dict:
+        """Conservative score used while the risk service is unavailable"""
+        score = config.get('fallback_risk_score', 0.7)
+        return {
+            'user_id': transaction.get('user_id'),
+            'location': transaction.get('location', 'global'),
+            'final_risk_score': score,
+            'rule_score': score,
+            'model_score': None,
+            'fallback': True
+        }
+
+    def _execute_emergency_protocols(self, user_id: str, limits: Dict):
+        """Emergency limit changes are escalated; the sync itself already went out with the change"""
+        self.logger.critical(f"Emergency limit change applied for {user_id}: {limits}")
+        self.logger.metric("emergency_limit_changes", 1)
+
+    def _adjust_worker_pool(self):
+        """ThreadPoolExecutor cannot be resized; warn with the data needed to size controller_workers"""
+        metrics = self.get_dispatch_metrics()
+        wait = metrics['stage_latency_ms'].get('queue_wait', {})
+        if metrics['queue_depth'] > self.batch_size * 10 and wait.get('p95', 0) > config.get('queue_wait_alert_ms', 1000):
+            self.logger.warning(
+                f"Dispatch backlog: depth {metrics['queue_depth']}, queue wait p95 {wait['p95']:.0f}ms "
+                f"with {self.workers._max_workers} workers"
+            )
+
+    def _report_system_status(self):
+        metrics = self.get_dispatch_metrics()
+        self.logger.metric("spend_queue_depth", metrics['queue_depth'])
+        self.logger.metric("spend_batch_size_avg", metrics['batch_size']['avg'])
+        self.logger.metric("spend_processed_total", metrics['total_processed'])
+        self.logger.metric("spend_failed_total", metrics['total_failed'])
+        for stage, latency in metrics['stage_latency_ms'].items():
+            self.logger.metric(f"spend_{stage}_p95", latency['p95'], "ms")
+
+    def _dump_queue_state(self):
+        """Persist anything still queued at shutdown so it can be replayed"""
+        leftover = []
+        for q in (self.emergency_queue, self.transaction_queue):
+            while True:
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+                leftover.append(item[-1] if isinstance(item, tuple) else item)
+        if not leftover:
+            return
+        dump_path = config.get('queue_dump_path', '/var/fortifi/spend_queue_dump.json')
+        try:
+            with open(dump_path, 'w') as f:
+                json.dump(leftover, f, default=str)
+            self.logger.warning(f"Dumped {len(leftover)} unprocessed transactions to {dump_path}")
+        except OSError as e:
+            self.logger.error(f"Failed to dump {len(leftover)} queued transactions: {str(e)}")
+
     def shutdown(self):
         """Orderly system shutdown procedure"""
         self.logger.info("Initiating controlled shutdown...")
+        # Dispatcher drains what is already queued before the pool stops accepting work
+        self.dispatch_stop.set()
+        self.dispatcher.join()
         self.workers.shutdown(wait=True)
         self.limit_logger.flush()
         self._dump_queue_state()
@@ -251,5 +493,6 @@ if __name__ == "__main__":
         controller.process_transaction(tx)
     
     time.sleep(5)
+    print(json.dumps(controller.get_dispatch_metrics(), indent=2))
     controller.shutdown()
     print("Controller shutdown successfully.")
\ No newline at end of file
@@ -3,58 +3,140 @@ import json
 import math
 import time
 import threading
-from datetime import datetime, timedelta
+from array import array
+from datetime import timedelta
 from typing import Dict, Optional, List, Tuple
-from collections import defaultdict, deque
 from utils.logger import StructuredLogger
 from utils.config import config
 from .policy_rules import PolicyRules
 
+class HistoryRing:
+    """Fixed-size per-user history of (timestamp, risk_score, usage) rows in one flat array of doubles"""
+    __slots__ = ('capacity', 'data', 'head', 'size')
+    FIELDS = ('timestamp', 'risk_score', 'usage')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.data = array('d', bytes(8 * len(self.FIELDS) * capacity))
+        self.head = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, timestamp: float, risk_score: float, usage: float):
+        i = self.head * 3
+        self.data[i] = timestamp
+        self.data[i + 1] = risk_score
+        self.data[i + 2] = usage
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def recent(self, field: str, n: int) -> List[float]:
+        """Last n values of one field, oldest first"""
+        offset = self.FIELDS.index(field)
+        n = min(n, self.size)
+        return [self.data[((self.head - n + k) % self.capacity) * 3 + offset] for k in range(n)]
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+
+    def to_list(self) -> List[Dict]:
+        rows = zip(*(self.recent(field, self.size) for field in self.FIELDS))
+        return [dict(zip(self.FIELDS, row)) for row in rows]
+
+
+class _StateShard:
+    __slots__ = ('lock', 'states', 'acquisitions', 'contended')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states: Dict[str, Dict] = {}
+        self.acquisitions = 0
+        self.contended = 0
+
+
 class LimitEngine:
-    def __init__(self, base_limits: Dict, decay_rate: float):
+    """
+    Adaptive spend limits with per-user state split over lock-striped shards.
+
+    A user's state lives in shard hash(user_id) % shards and is only touched
+    while that shard's lock is held, so workers handling unrelated users do not
+    wait on each other. Usage lookups happen before the lock is taken.
+    """
+
+    def __init__(self, base_limits: Dict, decay_rate: float, shards: Optional[int] = None):
         self.logger = StructuredLogger(name="LimitEngine")
         self.base_limits = base_limits
         self.decay_rate = decay_rate
-        self.user_states = defaultdict(self._default_user_state)
-        self.market_conditions = self._get_initial_market_conditions()
+        self.history_window = config.get('history_window', 30)
+        self.shards = [_StateShard() for _ in range(shards or config.get('limit_engine_shards', 64))]
+        self.market_conditions = self._fetch_market_conditions()
         self.policy_rules = PolicyRules()
-        self.lock = threading.Lock()
         self._start_market_monitor()
         self._start_state_janitor()
 
-    def calculate_limits(self, current_limits: Dict, risk_assessment: Dict, 
+    def _shard(self, user_id: str) -> _StateShard:
+        return self.shards[hash(user_id) % len(self.shards)]
+
+    def _acquire(self, user_id: str) -> _StateShard:
+        shard = self._shard(user_id)
+        if not shard.lock.acquire(blocking=False):
+            shard.lock.acquire()
+            shard.contended += 1
+        shard.acquisitions += 1
+        return shard
+
+    def calculate_limits(self, current_limits: Optional[Dict], risk_assessment: Dict, 
                         market_conditions: Dict) -> Optional[Dict]:
-        """Calculate new spending limits using adaptive algorithms"""
-        with self.lock:
-            user_id = risk_assessment.get('user_id', 'unknown')
+        """Calculate new spending limits using adaptive algorithms.
+
+        With current_limits=None the user's limits in force are read under the
+        shard lock, so concurrent calls for one user cannot lose an update.
+        """
+        user_id = risk_assessment.get('user_id', 'unknown')
+        try:
+            usage = self._calculate_usage(user_id)
+        except Exception as e:
+            self.logger.error(f"Usage lookup failed for {user_id}: {str(e)}")
+            return None
+
+        shard = self._acquire(user_id)
+        try:
+            # Get current state
+            state = shard.states.get(user_id)
+            if state is None:
+                state = shard.states[user_id] = self._default_user_state()
+            if current_limits is None:
+                current_limits = state['current_limits']
             
-            try:
-                # Get current state
-                state = self.user_states[user_id]
-                
-                # Calculate limit adjustments
-                adjustments = self._calculate_adjustments(
-                    current_limits,
-                    risk_assessment,
-                    state,
-                    market_conditions
-                )
-                
-                # Apply policy constraints
-                new_limits = self._apply_policy_constraints(
-                    adjustments,
-                    user_id,
-                    risk_assessment.get('location', 'global')
-                )
-                
-                # Update state history
-                self._update_user_state(user_id, new_limits, risk_assessment)
-                
-                return new_limits
-                
-            except Exception as e:
-                self.logger.error(f"Limit calculation failed for {user_id}: {str(e)}")
-                return None
+            # Calculate limit adjustments
+            adjustments = self._calculate_adjustments(
+                current_limits,
+                risk_assessment,
+                state,
+                market_conditions
+            )
+            
+            # Apply policy constraints
+            new_limits = self._apply_policy_constraints(
+                adjustments,
+                user_id,
+                risk_assessment.get('location', 'global')
+            )
+            
+            # Update state history
+            self._update_user_state(state, new_limits, risk_assessment, usage)
+            
+            return new_limits
+            
+        except Exception as e:
+            self.logger.error(f"Limit calculation failed for {user_id}: {str(e)}")
+            return None
+        finally:
+            shard.lock.release()
 
     def _calculate_adjustments(self, current: Dict, risk: Dict, 
                               state: Dict, market: Dict) -> Dict:
@@ -116,12 +198,12 @@ class LimitEngine:
         ]
         return math.prod(factors) ** (1/3)
 
-    def _calculate_decay_factor(self, history: deque) -> float:
+    def _calculate_decay_factor(self, history: HistoryRing) -> float:
         """Calculate limit decay based on usage patterns"""
         if len(history) < 3:
             return 0.0
             
-        recent_usage = sum(h['usage'] for h in list(history)[-3:]) / 3
+        recent_usage = sum(history.recent('usage', 3)) / 3
         return min(1.0, recent_usage * self.decay_rate)
 
     def _apply_policy_constraints(self, limits: Dict, user_id: str, 
@@ -135,23 +217,16 @@ class LimitEngine:
             'weekly': min(limits['weekly'], constraints['max_weekly'])
         }
 
-    def _update_user_state(self, user_id: str, new_limits: Dict, risk: Dict):
-        """Update user's limit state and history"""
-        state = self.user_states[user_id]
+    def _update_user_state(self, state: Dict, new_limits: Dict, risk: Dict, usage: float):
+        """Update user's limit state and history; caller holds the user's shard lock"""
+        previous = state['current_limits']
+        now = time.time()
         state['current_limits'] = new_limits
-        state['history'].append({
-            'timestamp': datetime.utcnow().isoformat(),
-            'risk_score': risk['final_risk_score'],
-            'market_conditions': self.market_conditions,
-            'usage': self._calculate_usage(user_id)
-        })
-        
-        # Maintain history window
-        if len(state['history']) > config.get('history_window', 30):
-            state['history'].popleft()
+        state['history'].append(now, risk['final_risk_score'], usage)
+        state['last_updated'] = now
             
         # Update behavior counters
-        if new_limits['daily'] > state['current_limits'].get('daily', 0):
+        if new_limits['daily'] > previous.get('daily', 0):
             state['consecutive_approvals'] += 1
             state['recent_declines'] = 0
         else:
@@ -192,34 +267,62 @@ class LimitEngine:
 
     def _clean_inactive_states(self):
         """Remove user states without recent activity"""
-        cutoff = datetime.utcnow() - timedelta(days=30)
-        with self.lock:
-            inactive = [uid for uid, state in self.user_states.items()
-                       if state['last_updated'] < cutoff]
-            for uid in inactive:
-                del self.user_states[uid]
+        cutoff = time.time() - timedelta(days=30).total_seconds()
+        for shard in self.shards:
+            with shard.lock:
+                inactive = [uid for uid, state in shard.states.items()
+                           if state['last_updated'] < cutoff]
+                for uid in inactive:
+                    del shard.states[uid]
 
     def _default_user_state(self) -> Dict:
         """Default state for new users"""
         return {
             'current_limits': self.base_limits.copy(),
-            'history': deque(maxlen=30),
+            'history': HistoryRing(self.history_window),
             'consecutive_approvals': 0,
             'recent_declines': 0,
-            'last_updated': datetime.utcnow()
+            'last_updated': time.time()
         }
 
     def get_user_state(self, user_id: str) -> Optional[Dict]:
-        """Retrieve current state for monitoring/debugging"""
-        with self.lock:
-            return self.user_states.get(user_id)
+        """Snapshot of a user's state for monitoring/debugging"""
+        shard = self._shard(user_id)
+        with shard.lock:
+            state = shard.states.get(user_id)
+            if state is None:
+                return None
+            return {**state, 'current_limits': dict(state['current_limits']),
+                    'history': state['history'].to_list()}
+
+    def get_current_limits(self, user_id: str) -> Dict:
+        """Limits currently in force for a user (base limits if the engine has not seen them)"""
+        shard = self._shard(user_id)
+        with shard.lock:
+            state = shard.states.get(user_id)
+            limits = dict(state['current_limits'] if state is not None else self.base_limits)
+        limits.setdefault('weekly', self.base_limits['daily'] * 7)
+        return limits
 
     def reset_user_limits(self, user_id: str):
         """Reset limits to base values (admin function)"""
-        with self.lock:
-            if user_id in self.user_states:
-                self.user_states[user_id]['current_limits'] = self.base_limits.copy()
-                self.user_states[user_id]['history'].clear()
+        shard = self._shard(user_id)
+        with shard.lock:
+            if user_id in shard.states:
+                shard.states[user_id]['current_limits'] = self.base_limits.copy()
+                shard.states[user_id]['history'].clear()
+
+    def get_contention_stats(self) -> Dict:
+        """Shard lock acquisitions and how many of them had to wait"""
+        acquisitions = sum(shard.acquisitions for shard in self.shards)
+        contended = sum(shard.contended for shard in self.shards)
+        return {
+            'shards': len(self.shards),
+            'users': sum(len(shard.states) for shard in self.shards),
+            'acquisitions': acquisitions,
+            'contended': contended,
+            'contention_ratio': contended / acquisitions if acquisitions else 0.0
+        }
 
 if __name__ == "__main__":
     engine = LimitEngine(
@@ -244,4 +347,5 @@ if __name__ == "__main__":
     # Test reset
     engine.reset_user_limits('test_user')
     print("After reset:", engine.get_user_state('test_user'))
-    print("Market conditions:", engine.market_conditions)   
\ No newline at end of file
+    print("Market conditions:", engine.market_conditions)
+    print("Contention:", engine.get_contention_stats())   
\ No newline at end of file
@@ -5,23 +5,47 @@ import zlib
 import time
 import queue
 import threading
+import struct
 import hashlib
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict, List, Optional
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from utils.logger import StructuredLogger
 from utils.config import config
 
+# Each record: payload length, then iv (12) | tag (16) | AES-GCM ciphertext of zlib(json)
+RECORD_HEADER = struct.Struct('<I')
+
 class LimitLogger:
+    """
+    Encrypted, indexed audit log of limit changes with a group-commit writer.
+
+    A single writer thread drains up to limit_log_batch_size entries, or
+    whatever arrives within limit_log_batch_ms, and appends them to the open
+    log file and index.csv in one buffered write each. limit_log_fsync_interval
+    is the durability/latency knob: 0 fsyncs after every batch, a positive
+    value fsyncs at most that often (seconds), and None never fsyncs and
+    leaves write-back to the OS. flush() always forces a sync.
+    """
+
     def __init__(self, log_dir: str, retention_days: int):
         self.logger = StructuredLogger(name="LimitLogger")
         self.log_dir = Path(log_dir)
         self.retention_days = retention_days
         self.encryption_key = self._derive_encryption_key()
+        self.aead = AESGCM(self.encryption_key)
         self.log_queue = queue.Queue(maxsize=10000)
-        self.active_log_file = None
+        self.batch_size = config.get('limit_log_batch_size', 256)
+        self.batch_window = config.get('limit_log_batch_ms', 10) / 1000.0
+        self.fsync_interval = config.get('limit_log_fsync_interval', 0)
+        self.write_lock = threading.Lock()
+        self.log_file = None
+        self.index_file = None
+        self.last_fsync = time.monotonic()
+        self.unsynced = False
+        self.stats = {'entries': 0, 'batches': 0, 'fsyncs': 0, 'dropped': 0, 'failed': 0}
+        self.stats_lock = threading.Lock()
         self._init_logging_infra()
         self._start_log_processor()
         self._start_retention_enforcer()
@@ -39,8 +63,9 @@ class LimitLogger:
     def _init_logging_infra(self):
         """Initialize logging infrastructure with security checks"""
         self.log_dir.mkdir(exist_ok=True, mode=0o750)
-        self.current_log_path = self._get_current_log_path()
         self._rotate_log_file()
+        self.index_file = open(self.log_dir / 'index.csv', 'a', newline='')
+        self.index_writer = csv.writer(self.index_file)
         
         # Security verification
         if not os.access(self.log_dir, os.W_OK):
@@ -51,64 +76,103 @@ class LimitLogger:
         try:
             self.log_queue.put_nowait(log_entry)
         except queue.Full:
+            with self.stats_lock:
+                self.stats['dropped'] += 1
             self.logger.error("Limit log queue full - entry dropped")
 
     def _start_log_processor(self):
-        """Background thread for log processing"""
+        """Background group-commit writer"""
         def processor_loop():
+            idle_timeout = min(1.0, self.fsync_interval) if self.fsync_interval else 1.0
             while True:
                 try:
-                    entry = self.log_queue.get(timeout=1)
-                    self._process_log_entry(entry)
+                    batch = [self.log_queue.get(timeout=idle_timeout)]
                 except queue.Empty:
+                    with self.write_lock:
+                        self._sync()
                     self._check_log_rotation()
                     continue
+                deadline = time.monotonic() + self.batch_window
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        batch.append(self.log_queue.get(timeout=remaining) if remaining > 0
+                                     else self.log_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    with self.stats_lock:
+                        self.stats['failed'] += len(batch)
+                    self.logger.error(f"Failed to write batch of {len(batch)} log entries: {str(e)}")
+                finally:
+                    for _ in batch:
+                        self.log_queue.task_done()
+                self._check_log_rotation()
 
         threading.Thread(target=processor_loop, daemon=True).start()
 
-    def _process_log_entry(self, entry: Dict):
-        """Process and write log entry with integrity checks"""
-        try:
-            encrypted_entry = self._encrypt_entry(entry)
-            self._write_to_log(encrypted_entry)
-            self._update_index(entry)
-        except Exception as e:
-            self.logger.error(f"Failed to process log entry: {str(e)}")
+    def _write_batch(self, batch: List[Dict]):
+        """Encrypt a batch, append records and index rows in one write each, then sync per the durability knob"""
+        # Rotation only happens on this thread, so the file name is stable for the whole batch
+        log_name = self.current_log_path.name
+        records, rows = [], []
+        for entry in batch:
+            try:
+                serialized = json.dumps(entry).encode()
+                records.append(self._encrypt_entry(serialized))
+                rows.append(self._index_row(entry, log_name, hashlib.sha256(serialized).hexdigest()))
+            except Exception as e:
+                with self.stats_lock:
+                    self.stats['failed'] += 1
+                self.logger.error(f"Failed to process log entry: {str(e)}")
+        if not records:
+            return
 
-    def _encrypt_entry(self, entry: Dict) -> bytes:
-        """Encrypt log entry with authenticated encryption"""
-        iv = os.urandom(12)
-        cipher = Cipher(algorithms.AES(self.encryption_key), modes.GCM(iv), backend=default_backend())
-        encryptor = cipher.encryptor()
+        with self.write_lock:
+            self.log_file.write(b''.join(records))
+            self.log_file.flush()
+            self.index_writer.writerows(rows)
+            self.index_file.flush()
+            self.unsynced = True
+            self._sync(force=self.fsync_interval == 0)
+        with self.stats_lock:
+            self.stats['entries'] += len(records)
+            self.stats['batches'] += 1
 
-        serialized = json.dumps(entry).encode()
-        compressed = zlib.compress(serialized)
-        encrypted = encryptor.update(compressed) + encryptor.finalize()
-        
-        return iv + encryptor.tag + encrypted
-
-    def _write_to_log(self, data: bytes):
-        """Atomic write to current log file"""
-        with open(self.current_log_path, 'ab') as f:
-            f.write(data)
-            f.flush()
-            os.fsync(f.fileno())
+    def _encrypt_entry(self, serialized: bytes) -> bytes:
+        """Encrypt a serialized log entry with authenticated encryption; returns a length-prefixed record"""
+        iv = os.urandom(12)
+        sealed = self.aead.encrypt(iv, zlib.compress(serialized), None)
+        payload = iv + sealed[-16:] + sealed[:-16]
+        return RECORD_HEADER.pack(len(payload)) + payload
 
-    def _update_index(self, entry: Dict):
-        """Maintain searchable index for quick audits"""
-        index_path = self.log_dir / 'index.csv'
-        index_fields = [
+    def _index_row(self, entry: Dict, log_name: str, entry_hash: str) -> List:
+        """Searchable index fields for quick audits"""
+        return [
             entry['timestamp'],
             entry['user_id'],
             entry['new_limits']['daily'],
             entry['new_limits']['transaction'],
-            self.current_log_path.name,
-            hashlib.sha256(json.dumps(entry).encode()).hexdigest()
+            log_name,
+            entry_hash
         ]
-        
-        with open(index_path, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(index_fields)
+
+    def _sync(self, force: bool = False):
+        """fsync both files if there is unsynced data and the durability knob allows it; caller holds write_lock"""
+        if not self.unsynced:
+            return
+        now = time.monotonic()
+        if not force:
+            if self.fsync_interval is None or now - self.last_fsync < self.fsync_interval:
+                return
+        os.fsync(self.log_file.fileno())
+        os.fsync(self.index_file.fileno())
+        self.last_fsync = now
+        self.unsynced = False
+        with self.stats_lock:
+            self.stats['fsyncs'] += 1
 
     def _get_current_log_path(self) -> Path:
         """Generate timestamped log file path"""
@@ -116,15 +180,19 @@ class LimitLogger:
 
     def _check_log_rotation(self):
         """Rotate log file if exceeds size limit"""
-        if self.current_log_path.stat().st_size > config.get('max_log_size', 104857600):  # 100MB
+        if self.log_file.tell() > config.get('max_log_size', 104857600):  # 100MB
             self._rotate_log_file()
 
     def _rotate_log_file(self):
-        """Rotate to new log file with atomic operation"""
-        new_path = self._get_current_log_path()
-        self.current_log_path = new_path
-        self.current_log_path.touch(exist_ok=True)
-        os.chmod(self.current_log_path, 0o640)
+        """Sync and close the current log file, then switch to a new one"""
+        with self.write_lock:
+            if self.log_file:
+                self._sync(force=True)
+                self.log_file.close()
+            new_path = self._get_current_log_path()
+            self.current_log_path = new_path
+            self.log_file = open(new_path, 'ab')
+            os.chmod(new_path, 0o640)
         self.logger.info(f"Rotated to new log file: {new_path.name}")
 
     def _start_retention_enforcer(self):
@@ -144,11 +212,24 @@ class LimitLogger:
                 log_file.unlink()
                 self.logger.info(f"Deleted old log file: {log_file.name}")
 
-    def flush(self):
-        """Ensure all queued entries are written"""
-        while not self.log_queue.empty():
-            time.sleep(0.1)
-        os.sync()
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait for queued entries to be written, then fsync regardless of the durability knob"""
+        deadline = time.monotonic() + timeout
+        while self.log_queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self.write_lock:
+            self._sync(force=True)
+        return self.log_queue.unfinished_tasks == 0
+
+    def get_stats(self) -> Dict:
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats.update({
+            'queued': self.log_queue.qsize(),
+            'avg_batch_size': stats['entries'] / stats['batches'] if stats['batches'] else 0.0,
+            'entries_per_fsync': stats['entries'] / stats['fsyncs'] if stats['fsyncs'] else 0.0
+        })
+        return stats
 
     def search_logs(self, query: Dict) -> List[Dict]:
         """Search logs using indexed criteria"""
@@ -186,21 +267,15 @@ class LimitLogger:
         try:
             with open(self.log_dir / log_file, 'rb') as f:
                 while True:
-                    iv = f.read(12)
-                    tag = f.read(16)
-                    data = f.read(4096)
-                    
-                    if not iv or not tag or not data:
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
                         break
-                        
-                    cipher = Cipher(algorithms.AES(self.encryption_key), modes.GCM(iv, tag), backend=default_backend())
-                    decryptor = cipher.decryptor()
-                    decrypted = decryptor.update(data) + decryptor.finalize()
-                    decompressed = zlib.decompress(decrypted)
-                    entry = json.loads(decompressed)
+                    payload = f.read(RECORD_HEADER.unpack(header)[0])
+                    iv, tag, data = payload[:12], payload[12:28], payload[28:]
+                    decompressed = zlib.decompress(self.aead.decrypt(iv, data + tag, None))
                     
-                    if hashlib.sha256(json.dumps(entry).encode()).hexdigest() == entry_hash:
-                        return entry
+                    if hashlib.sha256(decompressed).hexdigest() == entry_hash:
+                        return json.loads(decompressed)
         except Exception as e:
             self.logger.error(f"Failed to retrieve log entry: {str(e)}")
             return None
@@ -1,5 +1,6 @@
 import os
 import json
+import hashlib
 import time
 import threading
 import requests
@@ -0,0 +1,218 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+
+def approximate_size(value: Any) -> int:
+    """Serialized size plus a fixed per-entry overhead; cheap enough for the write path."""
+    return len(json.dumps(value, default=str, separators=(',', ':'))) + 200
+
+
+class _Entry:
+    __slots__ = ('key', 'value', 'size', 'expires', 'referenced', 'protected')
+
+    def __init__(self, key: str, value: Any, size: int, expires: float):
+        self.key = key
+        self.value = value
+        self.size = size
+        self.expires = expires
+        self.referenced = False
+        self.protected = False
+
+
+class _Shard:
+    __slots__ = ('lock', 'entries', 'probation', 'protected', 'probation_bytes', 'protected_bytes',
+                 'wheel', 'wheel_pos', 'hits', 'misses', 'evictions', 'expirations', 'rejected')
+
+    def __init__(self, wheel_slots: int, now_tick: int):
+        self.lock = threading.Lock()
+        self.entries: Dict[str, _Entry] = {}
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.probation_bytes = 0
+        self.protected_bytes = 0
+        self.wheel: List[List[_Entry]] = [[] for _ in range(wheel_slots)]
+        self.wheel_pos = now_tick
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected = 0
+
+
+class ProfileCache:
+    """
+    Sharded, segmented LRU cache with TTL and a byte budget.
+
+    Keys hash to one of `shards` independent shards. get() takes no lock: it
+    reads the shard dict and sets the entry's referenced bit. Recency is
+    applied lazily under the shard lock when space is needed. New entries
+    start in a probation segment, and referenced ones are promoted into a
+    protected segment (protected_ratio of the shard budget) instead of being
+    evicted. Expired entries are dropped by a per-shard timing wheel that is
+    advanced on writes and by expire(), so cleanup costs O(expired) rather than
+    a walk over the whole cache. Hit/miss counters are bumped without the lock
+    and can undercount slightly under heavy contention.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, shards: int = 16, protected_ratio: float = 0.8,
+                 wheel_tick: float = 1.0, wheel_slots: int = 512,
+                 sizeof: Callable[[Any], int] = approximate_size):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shard_budget = max_bytes // shards
+        self.protected_budget = int(self.shard_budget * protected_ratio)
+        self.wheel_tick = wheel_tick
+        self.wheel_slots = wheel_slots
+        self.sizeof = sizeof
+        now_tick = self._tick(time.monotonic())
+        self.shards = [_Shard(wheel_slots, now_tick) for _ in range(shards)]
+
+    def _tick(self, t: float) -> int:
+        return int(t // self.wheel_tick)
+
+    def _shard(self, key: str) -> _Shard:
+        return self.shards[hash(key) % len(self.shards)]
+
+    def get(self, key: str) -> Optional[Any]:
+        shard = self._shard(key)
+        entry = shard.entries.get(key)
+        if entry is None or entry.expires <= time.monotonic():
+            shard.misses += 1
+            return None
+        entry.referenced = True
+        shard.hits += 1
+        return entry.value
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Insert or replace; returns False if the value alone exceeds a shard's budget."""
+        size = self.sizeof(value)
+        now = time.monotonic()
+        shard = self._shard(key)
+        with shard.lock:
+            old = shard.entries.get(key)
+            if old is not None:
+                self._unlink(shard, old)
+            if size > self.shard_budget:
+                shard.rejected += 1
+                return False
+            entry = _Entry(key, value, size, now + (self.ttl if ttl is None else ttl))
+            shard.entries[key] = entry
+            if old is not None and old.protected:
+                entry.protected = True
+                shard.protected[key] = entry
+                shard.protected_bytes += size
+            else:
+                shard.probation[key] = entry
+                shard.probation_bytes += size
+            # Bucket for the first tick after expiry, so the entry is always due when its slot comes up
+            shard.wheel[(self._tick(entry.expires) + 1) % self.wheel_slots].append(entry)
+            self._advance(shard, now)
+            self._evict(shard)
+        return True
+
+    def delete(self, key: str):
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is not None:
+                self._unlink(shard, entry)
+
+    def _unlink(self, shard: _Shard, entry: _Entry):
+        del shard.entries[entry.key]
+        if entry.protected:
+            del shard.protected[entry.key]
+            shard.protected_bytes -= entry.size
+        else:
+            del shard.probation[entry.key]
+            shard.probation_bytes -= entry.size
+
+    def _advance(self, shard: _Shard, now: float):
+        """Run the timing wheel up to now; each slot holds entries that expire on that tick (or a later rotation)."""
+        current = self._tick(now)
+        start = max(shard.wheel_pos + 1, current - self.wheel_slots + 1)
+        for tick in range(start, current + 1):
+            slot = tick % self.wheel_slots
+            survivors = []
+            for entry in shard.wheel[slot]:
+                if shard.entries.get(entry.key) is not entry:
+                    continue  # replaced, deleted or evicted since it was scheduled
+                if entry.expires <= now:
+                    self._unlink(shard, entry)
+                    shard.expirations += 1
+                else:
+                    survivors.append(entry)
+            shard.wheel[slot] = survivors
+        shard.wheel_pos = max(shard.wheel_pos, current)
+
+    def _evict(self, shard: _Shard):
+        while shard.protected_bytes > self.protected_budget:
+            key, entry = shard.protected.popitem(last=False)
+            if entry.referenced:
+                entry.referenced = False
+                shard.protected[key] = entry  # second chance within the protected segment
+                continue
+            entry.protected = False
+            shard.protected_bytes -= entry.size
+            shard.probation[key] = entry
+            shard.probation_bytes += entry.size
+
+        while shard.probation_bytes + shard.protected_bytes > self.shard_budget and shard.probation:
+            key, entry = shard.probation.popitem(last=False)
+            shard.probation_bytes -= entry.size
+            if entry.referenced and entry.size <= self.protected_budget:
+                entry.referenced = False
+                entry.protected = True
+                shard.protected[key] = entry
+                shard.protected_bytes += entry.size
+                while shard.protected_bytes > self.protected_budget:
+                    demoted_key, demoted = shard.protected.popitem(last=False)
+                    demoted.protected = False
+                    demoted.referenced = False
+                    shard.protected_bytes -= demoted.size
+                    shard.probation[demoted_key] = demoted
+                    shard.probation_bytes += demoted.size
+                continue
+            del shard.entries[key]
+            shard.evictions += 1
+
+    def expire(self) -> int:
+        """Advance every shard's wheel; returns how many entries expired."""
+        now = time.monotonic()
+        before = sum(shard.expirations for shard in self.shards)
+        for shard in self.shards:
+            with shard.lock:
+                self._advance(shard, now)
+        return sum(shard.expirations for shard in self.shards) - before
+
+    def clear(self):
+        for shard in self.shards:
+            with shard.lock:
+                shard.entries.clear()
+                shard.probation.clear()
+                shard.protected.clear()
+                shard.probation_bytes = shard.protected_bytes = 0
+                shard.wheel = [[] for _ in range(self.wheel_slots)]
+
+    def __len__(self) -> int:
+        return sum(len(shard.entries) for shard in self.shards)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'rejected': 0,
+                 'entries': 0, 'bytes': 0, 'protected_bytes': 0}
+        for shard in self.shards:
+            with shard.lock:
+                for name in ('hits', 'misses', 'evictions', 'expirations', 'rejected'):
+                    stats[name] += getattr(shard, name)
+                stats['entries'] += len(shard.entries)
+                stats['bytes'] += shard.probation_bytes + shard.protected_bytes
+                stats['protected_bytes'] += shard.protected_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'hit_ratio': stats['hits'] / lookups if lookups else 0.0,
+            'max_bytes': self.max_bytes,
+            'shards': len(self.shards)
+        })
+        return stats
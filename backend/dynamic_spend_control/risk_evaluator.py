@@ -0,0 +1,74 @@
+import os
+from typing import Dict, Optional
+from utils.logger import StructuredLogger
+from utils.config import config
+from .policy_rules import PolicyRules
+
+try:
+    import onnxruntime
+except ImportError:  # model scoring is optional; rules still apply
+    onnxruntime = None
+
+class RiskEvaluator:
+    """
+    Per-transaction risk for limit calculation: a rule score from the user's
+    profile, the transaction and the policy rules, blended with an ONNX model
+    score when onnxruntime and the model file are available.
+    """
+
+    def __init__(self, model_path: str, rule_engine: Optional[PolicyRules] = None):
+        self.logger = StructuredLogger(name="RiskEvaluator")
+        self.rule_engine = rule_engine or PolicyRules()
+        self.model_weight = config.get('risk_model_weight', 0.5)
+        self.session = self._load_model(model_path)
+
+    def _load_model(self, model_path: str):
+        if onnxruntime is None or not os.path.exists(model_path):
+            self.logger.warning(f"Risk model unavailable at {model_path} - using rule scoring only")
+            return None
+        try:
+            return onnxruntime.InferenceSession(model_path)
+        except Exception as e:
+            self.logger.error(f"Failed to load risk model: {str(e)}")
+            return None
+
+    def evaluate(self, profile: Dict, transaction: Dict, use_ai: bool = True) -> Dict:
+        """Score a transaction against the user's profile; 0 is safe, 1 is high risk"""
+        factors = self._rule_factors(profile, transaction)
+        rule_score = min(1.0, sum(factors.values()))
+        model_score = self._model_score(profile, transaction) if use_ai and self.session else None
+        final = rule_score if model_score is None else \
+            (1 - self.model_weight) * rule_score + self.model_weight * model_score
+        return {
+            'user_id': transaction.get('user_id', profile.get('user_id')),
+            'location': transaction.get('location', 'global'),
+            'rule_score': rule_score,
+            'model_score': model_score,
+            'final_risk_score': min(1.0, max(0.0, final)),
+            'factors': factors
+        }
+
+    def _rule_factors(self, profile: Dict, transaction: Dict) -> Dict[str, float]:
+        amount = float(transaction.get('amount', 0.0))
+        daily_average = float(profile.get('spending', {}).get('daily_average', 0.0)) or 1.0
+        location_risk = self.rule_engine.get_location_risk(transaction.get('location', 'global'))
+        return {
+            'profile': 0.5 * profile.get('composite_risk', 0.5),
+            'amount': 0.2 * min(1.0, amount / (daily_average * 10)),
+            'category': 0.2 if transaction.get('category') in self.rule_engine.list_high_risk_categories() else 0.0,
+            'location': 0.1 * (0.5 if location_risk is None else location_risk)
+        }
+
+    def _model_score(self, profile: Dict, transaction: Dict) -> Optional[float]:
+        try:
+            import numpy as np
+            features = np.array([[
+                float(transaction.get('amount', 0.0)),
+                profile.get('composite_risk', 0.5),
+                profile.get('spending_velocity', 0.0)
+            ]], dtype=np.float32)
+            name = self.session.get_inputs()[0].name
+            return float(np.ravel(self.session.run(None, {name: features})[0])[-1])
+        except Exception as e:
+            self.logger.error(f"Risk model scoring failed: {str(e)}")
+            return None
@@ -5,52 +5,130 @@ import threading
 import hashlib
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List, Tuple
-from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 from utils.logger import StructuredLogger
 from utils.config import config
 import requests
+from requests.adapters import HTTPAdapter
+from .profile_cache import ProfileCache
+
+SERVICE_ENDPOINTS = {'behavior': 'current', 'fraud': 'latest', 'spending': 'patterns'}
 
 class UserProfileFetcher:
-    def __init__(self, cache_size: int = 1000, cache_ttl: int = 300):
+    def __init__(self, cache_bytes: int = 64 * 1024 * 1024, cache_ttl: int = 300, stale_ttl: Optional[int] = None):
         self.logger = StructuredLogger(name="UserProfileFetcher")
-        self.cache = OrderedDict()
-        self.cache_size = cache_size
         self.cache_ttl = cache_ttl
+        # Expired profiles are still served for stale_ttl seconds while a background refresh runs
+        self.stale_ttl = config.get('profile_stale_ttl', cache_ttl) if stale_ttl is None else stale_ttl
+        self.cache = ProfileCache(
+            max_bytes=cache_bytes,
+            ttl=cache_ttl + self.stale_ttl,
+            shards=config.get('profile_cache_shards', 16)
+        )
+        self.fetch_deadline = config.get('profile_fetch_deadline', 3.0)
+        # Profiles partly built from defaults are cached only briefly and never served stale
+        self.degraded_ttl = config.get('profile_degraded_ttl', 10)
         self.lock = threading.Lock()
+        self.inflight: Dict[str, Future] = {}
+        self.refreshing = set()
         self.services = {
             'behavior': config.get('behavior_service', 'http://behavior-service/v1/profile'),
             'fraud': config.get('fraud_service', 'http://fraud-service/v1/score'),
             'spending': config.get('spending_service', 'http://spending-service/v1/patterns')
         }
+        self.session = self._create_http_session()
+        self.fetch_pool = ThreadPoolExecutor(
+            max_workers=config.get('profile_fetch_workers', 32),
+            thread_name_prefix='ProfileFetch'
+        )
+        # Separate pool so refreshes waiting on service calls cannot starve the calls themselves
+        self.refresh_pool = ThreadPoolExecutor(
+            max_workers=config.get('profile_refresh_workers', 4),
+            thread_name_prefix='ProfileRefresh'
+        )
         self._start_cache_janitor()
         self._warmup_cache()
 
+    def _create_http_session(self) -> requests.Session:
+        """Keep-alive session shared by all service fetches"""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=len(self.services),
+            pool_maxsize=config.get('profile_http_pool_size', 32)
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
     def get_full_profile(self, user_id: str) -> Dict:
         """Fetch complete user profile with fallback strategies"""
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            profile, fresh_until = cached
+            if time.monotonic() > fresh_until:
+                self._refresh_in_background(user_id)
+            return profile
+        return self._load_profile(user_id)
+
+    def _load_profile(self, user_id: str) -> Dict:
+        """Single-flight load: concurrent misses for one user share a single fetch"""
         with self.lock:
-            # Check cache first
-            if cached := self._get_cached_profile(user_id):
-                self.logger.debug(f"Cache hit for {user_id}")
-                return cached
-
-        # Parallel fetch from services
-        behavior_data = self._fetch_with_retry(
-            service='behavior',
-            user_id=user_id,
-            endpoint='current'
-        )
-        
-        fraud_data = self._fetch_with_retry(
-            service='fraud',
-            user_id=user_id,
-            endpoint='latest'
-        )
-        
-        spending_data = self._fetch_with_retry(
-            service='spending',
-            user_id=user_id,
-            endpoint='patterns'
-        )
+            future = self.inflight.get(user_id)
+            leader = future is None
+            if leader:
+                future = self.inflight[user_id] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            profile = self._fetch_profile(user_id)
+            if len(profile['metadata']['sources_used']) == len(SERVICE_ENDPOINTS):
+                self.cache.put(user_id, (profile, time.monotonic() + self.cache_ttl))
+            elif self.cache.get(user_id) is not None:
+                pass  # a failed background refresh keeps serving the complete, stale profile
+            elif self.degraded_ttl > 0:
+                self.cache.put(user_id, (profile, time.monotonic() + self.degraded_ttl), ttl=self.degraded_ttl)
+            future.set_result(profile)
+            return profile
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(user_id, None)
+
+    def _refresh_in_background(self, user_id: str):
+        with self.lock:
+            if user_id in self.refreshing or user_id in self.inflight:
+                return
+            self.refreshing.add(user_id)
+
+        def refresh():
+            try:
+                self._load_profile(user_id)
+            except Exception as e:
+                self.logger.warning(f"Background refresh failed for {user_id}: {str(e)}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(user_id)
+
+        self.refresh_pool.submit(refresh)
+
+    def _fetch_profile(self, user_id: str) -> Dict:
+        """Query all services concurrently; any that miss the shared deadline fall back to defaults"""
+        deadline = time.monotonic() + self.fetch_deadline
+        futures = {
+            service: self.fetch_pool.submit(self._fetch_with_retry, service, user_id, endpoint, deadline)
+            for service, endpoint in SERVICE_ENDPOINTS.items()
+        }
+        results = {}
+        for service, future in futures.items():
+            try:
+                results[service] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeout:
+                self.logger.warning(f"{service} service missed the {self.fetch_deadline}s deadline for {user_id}")
+                results[service] = None
+        behavior_data, fraud_data, spending_data = results['behavior'], results['fraud'], results['spending']
 
         # Build composite profile
         profile = {
@@ -74,24 +152,26 @@ class UserProfileFetcher:
             profile['spending']
         )
 
-        # Update cache
-        with self.lock:
-            self._update_cache(user_id, profile)
-
         return profile
 
-    def _fetch_with_retry(self, service: str, user_id: str, endpoint: str) -> Optional[Dict]:
-        """Robust service fetching with circuit breaker pattern"""
+    def _fetch_with_retry(self, service: str, user_id: str, endpoint: str,
+                          deadline: Optional[float] = None) -> Optional[Dict]:
+        """Service fetch with bounded retries; never runs past the caller's deadline"""
         url = f"{self.services[service]}/{user_id}/{endpoint}"
         retries = config.get('fetch_retries', 3)
         backoff = config.get('fetch_backoff', 1.5)
+        timeout = config.get('fetch_timeout', 2)
+        deadline = deadline or time.monotonic() + self.fetch_deadline
         
         for attempt in range(retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
             try:
-                response = requests.get(
+                response = self.session.get(
                     url,
                     headers=self._auth_headers(),
-                    timeout=config.get('fetch_timeout', 2)
+                    timeout=min(timeout, remaining)
                 )
                 response.raise_for_status()
                 return response.json()
@@ -99,11 +179,13 @@ class UserProfileFetcher:
                 self.logger.warning(
                     f"Attempt {attempt+1} failed for {service} service: {str(e)}"
                 )
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if status is not None and status < 500 and status != 429:
+                    break  # client errors will not succeed on retry
                 if attempt < retries:
-                    time.sleep(backoff ** attempt)
-                else:
-                    self.logger.error(f"Final failure fetching {service} data for {user_id}")
-                    return None
+                    time.sleep(min(backoff ** attempt, max(0.0, deadline - time.monotonic())))
+        self.logger.error(f"Final failure fetching {service} data for {user_id}")
+        return None
 
     def _calculate_composite_risk(self, profile: Dict) -> float:
         """Combine multiple risk factors into 0-1 score"""
@@ -153,56 +235,52 @@ class UserProfileFetcher:
         }
 
     # Cache management
-    def _get_cached_profile(self, user_id: str) -> Optional[Dict]:
-        """Retrieve cached profile with TTL check"""
-        entry = self.cache.get(user_id)
-        if not entry:
-            return None
-            
-        if datetime.utcnow() > entry['expires']:
-            del self.cache[user_id]
-            return None
-            
-        # Move to end to mark recently used
-        self.cache.move_to_end(user_id)
-        return entry['profile']
-
-    def _update_cache(self, user_id: str, profile: Dict):
-        """Update cache with LRU eviction policy"""
-        if user_id in self.cache:
-            self.cache.move_to_end(user_id)
-        else:
-            self.cache[user_id] = {
-                'profile': profile,
-                'expires': datetime.utcnow() + timedelta(seconds=self.cache_ttl)
-            }
-            
-        # Evict if over size limit
-        while len(self.cache) > self.cache_size:
-            self.cache.popitem(last=False)
-
     def _start_cache_janitor(self):
-        """Background thread for cache maintenance"""
+        """Background thread that advances the cache's expiry wheels"""
         def janitor_loop():
             while True:
-                self._clean_expired_entries()
+                self.cache.expire()
                 time.sleep(60)
 
         threading.Thread(target=janitor_loop, daemon=True).start()
 
-    def _clean_expired_entries(self):
-        """Remove expired cache entries"""
+    def get_cache_stats(self) -> Dict:
+        stats = self.cache.get_stats()
         with self.lock:
-            now = datetime.utcnow()
-            expired = [k for k, v in self.cache.items() if v['expires'] < now]
-            for k in expired:
-                del self.cache[k]
+            stats.update({'inflight': len(self.inflight), 'refreshing': len(self.refreshing)})
+        return stats
 
     def _warmup_cache(self):
-        """Pre-cache high priority users at startup"""
+        """Pre-cache high priority users at startup through a bounded, rate-limited pool"""
         warm_users = config.get('warmup_users', [])
-        for user_id in warm_users:
-            threading.Thread(target=self.get_full_profile, args=(user_id,)).start()
+        if not warm_users:
+            return
+        concurrency = config.get('warmup_concurrency', 8)
+        interval = 1.0 / config.get('warmup_rate', 50)
+
+        def warmup_loop():
+            slots = threading.BoundedSemaphore(concurrency)
+            pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ProfileWarmup')
+            next_at = time.monotonic()
+            for user_id in warm_users:
+                if self.cache.get(user_id) is not None:
+                    continue
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_at = max(next_at, time.monotonic()) + interval
+                slots.acquire()
+                pool.submit(self._warm_user, user_id).add_done_callback(lambda _: slots.release())
+            pool.shutdown(wait=True)
+            self.logger.info(f"Profile cache warmup finished for {len(warm_users)} users")
+
+        threading.Thread(target=warmup_loop, daemon=True).start()
+
+    def _warm_user(self, user_id: str):
+        try:
+            self._load_profile(user_id)
+        except Exception as e:
+            self.logger.warning(f"Warmup fetch failed for {user_id}: {str(e)}")
 
     # Default profiles
     def _default_behavior_profile(self) -> Dict:
@@ -227,7 +305,7 @@ class UserProfileFetcher:
         }
 
 if __name__ == "__main__":
-    fetcher = UserProfileFetcher(cache_size=100, cache_ttl=30)
+    fetcher = UserProfileFetcher(cache_bytes=1024 * 1024, cache_ttl=30)
     
     # Test profile fetch
     profile = fetcher.get_full_profile("test_user_001")
@@ -238,7 +316,8 @@ if __name__ == "__main__":
     profile_cached = fetcher.get_full_profile("test_user_001")
     print("Cache hit:", profile == profile_cached)
     
-    # Test cache expiration
+    # Test stale-while-revalidate: expired profile is served while a refresh runs
     time.sleep(31)
-    profile_expired = fetcher.get_full_profile("test_user_001")
-    print("Cache miss after expiration:", "expired" not in profile_expired['metadata']['sources_used'])
+    profile_stale = fetcher.get_full_profile("test_user_001")
+    print("Served stale after expiration:", profile_stale is profile)
+    print("Cache stats:", fetcher.get_cache_stats())
@@ -1,27 +1,235 @@
 import smtplib
 import json
+import heapq
+import itertools
 import requests
 import threading
 import queue
 import time
-from typing import Dict, Any, List, Optional
+from collections import deque
+from typing import Dict, Any, List, Optional, Callable, Union
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from requests.adapters import HTTPAdapter
 from utils.logger import StructuredLogger
 from utils.config import config
 
+class AlertChannel:
+    """Bounded per-channel queue drained by its own worker pool.
+
+    Failed sends go to a bounded retry heap with exponential backoff; when
+    either the queue or the retry heap is full, alerts are dropped and
+    counted rather than blocking the caller or other channels. A handler
+    returns one bool for an all-or-nothing batch (e.g. a bulk POST) or a
+    list with one bool per alert, in which case only the failed alerts are
+    retried.
+    """
+
+    def __init__(self, name: str, handler: Callable[[List[Dict[str, Any]]], Union[bool, List[bool]]],
+                 logger: StructuredLogger, workers: int = 2, queue_size: int = 10000,
+                 batch_size: int = 1, flush_interval: float = 0.5, max_retries: int = 3,
+                 retry_backoff: float = 1.0, retry_queue_size: int = 10000):
+        self.name = name
+        self.handler = handler
+        self.logger = logger
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_queue_size = retry_queue_size
+        self.retry_heap = []
+        self.retry_lock = threading.Lock()
+        self._seq = itertools.count()
+        self.stats = {'sent': 0, 'failed': 0, 'retried': 0, 'dropped': 0}
+        self.stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.stop_event = threading.Event()
+        self.workers = [
+            threading.Thread(target=self._worker_loop, name=f"Alert-{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, alert: Dict[str, Any]) -> bool:
+        try:
+            self.queue.put_nowait((alert, 0))
+            return True
+        except queue.Full:
+            self._count('dropped')
+            self.logger.warning(f"{self.name} alert queue full, dropping alert for tx {alert.get('transaction_id')}")
+            return False
+
+    def _count(self, key: str, n: int = 1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def _pop_due_retries(self, limit: int) -> List[tuple]:
+        now = time.monotonic()
+        items = []
+        with self.retry_lock:
+            while self.retry_heap and self.retry_heap[0][0] <= now and len(items) < limit:
+                _, _, alert, attempts = heapq.heappop(self.retry_heap)
+                items.append((alert, attempts))
+        return items
+
+    def _next_batch(self) -> List[tuple]:
+        batch = self._pop_due_retries(self.batch_size)
+        if batch:
+            return batch
+        try:
+            batch.append(self.queue.get(timeout=min(self.flush_interval, 1.0)))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _schedule_retries(self, batch: List[tuple]):
+        with self.retry_lock:
+            for alert, attempts in batch:
+                if attempts + 1 > self.max_retries:
+                    self._count('failed')
+                    self.logger.error(f"{self.name} alert for tx {alert.get('transaction_id')} failed after {attempts + 1} attempts")
+                elif len(self.retry_heap) >= self.retry_queue_size:
+                    self._count('dropped')
+                    self.logger.warning(f"{self.name} retry queue full, dropping alert for tx {alert.get('transaction_id')}")
+                else:
+                    due = time.monotonic() + self.retry_backoff * (2 ** attempts)
+                    heapq.heappush(self.retry_heap, (due, next(self._seq), alert, attempts + 1))
+                    self._count('retried')
+
+    def _worker_loop(self):
+        while not self.stop_event.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            with self.stats_lock:
+                self.in_flight += 1
+            try:
+                self._deliver(batch)
+            finally:
+                with self.stats_lock:
+                    self.in_flight -= 1
+
+    def _deliver(self, batch: List[tuple]):
+        try:
+            results = self.handler([alert for alert, _ in batch])
+        except Exception as e:
+            self.logger.error(f"{self.name} alert handler error: {e}")
+            results = False
+        if isinstance(results, bool):
+            results = [results] * len(batch)
+        failed = [item for item, ok in zip(batch, results) if not ok]
+        if len(batch) > len(failed):
+            self._count('sent', len(batch) - len(failed))
+        if failed:
+            self._schedule_retries(failed)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self.queue.qsize()
+        stats['retry_depth'] = len(self.retry_heap)
+        return stats
+
+    def pending(self) -> int:
+        with self.stats_lock:
+            in_flight = self.in_flight
+        with self.retry_lock:
+            retries = len(self.retry_heap)
+        return self.queue.qsize() + retries + in_flight
+
+    def drain(self, timeout: float) -> bool:
+        """Wait until queued and retrying alerts have been delivered or given up on."""
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self.pending() == 0
+
+    def shutdown(self, timeout: float = 2.0) -> int:
+        """Stop the workers; returns how many queued or retrying alerts were dropped."""
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.join(timeout=timeout)
+        dropped = 0
+        while True:
+            try:
+                self.queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                break
+        with self.retry_lock:
+            dropped += len(self.retry_heap)
+            self.retry_heap.clear()
+        if dropped:
+            self._count('dropped', dropped)
+            self.logger.warning(f"{self.name} channel shut down with {dropped} undelivered alerts")
+        return dropped
+
 class AlertDispatcher:
     def __init__(self):
         self.logger = StructuredLogger(name="AlertDispatcher")
-        self.alert_queue = queue.Queue()
+        self.channel_settings = self._load_channel_settings()
+        self.alert_queue = queue.Queue(maxsize=self.channel_settings['router_queue_size'])
         self.email_settings = self._load_email_settings()
         self.webhook_settings = self._load_webhook_settings()
         self.sms_settings = self._load_sms_settings()
         self.siem_settings = self._load_siem_settings()
-        self.alert_history = []
+        self.alert_history = deque(maxlen=self.channel_settings['history_size'])
+        self.http_session = self._create_http_session()
+        self.smtp_local = threading.local()
+        # Every worker's connection, so shutdown can quit them from the calling thread
+        self.smtp_servers = set()
+        self.smtp_lock = threading.Lock()
+        self.channels = self._init_channels()
+        self.stop_event = threading.Event()
         self.dispatch_thread = threading.Thread(target=self._dispatch_loop, daemon=True)
         self.dispatch_thread.start()
 
+    def _load_channel_settings(self) -> Dict[str, Any]:
+        defaults = {
+            'router_queue_size': 50000,
+            'history_size': 10000,
+            'http_pool_size': 20,
+            'email': {'workers': 2, 'queue_size': 5000, 'max_retries': 3},
+            'webhook': {'workers': 4, 'queue_size': 10000, 'max_retries': 3},
+            'sms': {'workers': 2, 'queue_size': 5000, 'max_retries': 3},
+            'siem': {'workers': 2, 'queue_size': 20000, 'max_retries': 5, 'batch_size': 200, 'flush_interval': 1.0}
+        }
+        overrides = config.get('alerting', {}).get('channels', {})
+        return {k: ({**v, **overrides.get(k, {})} if isinstance(v, dict) else overrides.get(k, v))
+                for k, v in defaults.items()}
+
+    def _create_http_session(self) -> requests.Session:
+        """Keep-alive session shared by webhook, SMS and SIEM workers"""
+        session = requests.Session()
+        pool_size = self.channel_settings['http_pool_size']
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _init_channels(self) -> Dict[str, AlertChannel]:
+        handlers = {
+            'email': self._send_email_batch,
+            'webhook': self._send_webhook_batch,
+            'sms': self._send_sms_batch,
+            'siem': self._send_siem_batch
+        }
+        return {
+            name: AlertChannel(name, handler, self.logger, **self.channel_settings[name])
+            for name, handler in handlers.items()
+        }
+
     def _load_email_settings(self) -> Dict[str, Any]:
         return config.get('alerting', {}).get('email', {
             'smtp_server': 'smtp.example.com',
@@ -51,14 +259,20 @@ class AlertDispatcher:
             'api_key': 'siemapikey'
         })
 
-    def send_alert(self, alert: Dict[str, Any]):
-        """Public method to queue an alert for dispatch."""
-        self.alert_queue.put(alert)
+    def send_alert(self, alert: Dict[str, Any]) -> bool:
+        """Public method to queue an alert for dispatch. Never blocks; returns False if shed."""
+        try:
+            self.alert_queue.put_nowait(alert)
+        except queue.Full:
+            self.logger.warning(f"Alert queue full, dropping alert for tx {alert.get('transaction_id')}")
+            self.logger.metric("alerts_dropped", 1)
+            return False
         self.logger.info(f"Alert queued: {alert.get('alert_type', 'unknown')} for tx {alert.get('transaction_id')}")
+        return True
 
     def _dispatch_loop(self):
-        """Background thread for dispatching alerts."""
-        while True:
+        """Background thread routing alerts to per-channel queues."""
+        while not self.stop_event.is_set():
             try:
                 alert = self.alert_queue.get(timeout=1)
                 self._dispatch_alert(alert)
@@ -69,7 +283,7 @@ class AlertDispatcher:
                 self.logger.error(f"Alert dispatch failed: {e}")
 
     def _dispatch_alert(self, alert: Dict[str, Any]):
-        """Dispatch alert to all configured channels."""
+        """Route alert to all applicable channels without waiting on delivery."""
         alert_type = alert.get('alert_type', 'generic')
         tx_id = alert.get('transaction_id', 'unknown')
         risk_level = alert.get('risk_level', 'unknown')
@@ -77,22 +291,57 @@ class AlertDispatcher:
 
         # Email
         if risk_level in ['critical', 'high']:
-            self._send_email_alert(alert)
+            self.channels['email'].submit(alert)
         # Webhook
         if risk_level in ['critical', 'high', 'medium']:
-            self._send_webhook_alert(alert)
+            self.channels['webhook'].submit(alert)
         # SMS
         if risk_level == 'critical':
-            self._send_sms_alert(alert)
+            self.channels['sms'].submit(alert)
         # SIEM
-        self._send_siem_alert(alert)
+        self.channels['siem'].submit(alert)
 
         self.alert_history.append({
             'timestamp': time.time(),
             'alert': alert
         })
 
-    def _send_email_alert(self, alert: Dict[str, Any]):
+    def _get_smtp(self) -> smtplib.SMTP:
+        """Per-worker SMTP connection, reused across alerts and re-established if dropped"""
+        server = getattr(self.smtp_local, 'server', None)
+        if server is not None:
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close_smtp()
+        server = smtplib.SMTP(self.email_settings['smtp_server'], self.email_settings['smtp_port'], timeout=10)
+        server.starttls()
+        server.login(self.email_settings['username'], self.email_settings['password'])
+        self.smtp_local.server = server
+        with self.smtp_lock:
+            self.smtp_servers.add(server)
+        return server
+
+    def _close_smtp(self):
+        server = getattr(self.smtp_local, 'server', None)
+        self.smtp_local.server = None
+        if server is not None:
+            self._quit_smtp(server)
+
+    def _quit_smtp(self, server: smtplib.SMTP):
+        with self.smtp_lock:
+            self.smtp_servers.discard(server)
+        try:
+            server.quit()
+        except Exception:
+            pass
+
+    def _send_email_batch(self, alerts: List[Dict[str, Any]]) -> List[bool]:
+        return [self._send_email_alert(alert) for alert in alerts]
+
+    def _send_email_alert(self, alert: Dict[str, Any]) -> bool:
         try:
             msg = MIMEMultipart()
             msg['From'] = self.email_settings['from_addr']
@@ -108,21 +357,24 @@ class AlertDispatcher:
             Details: {json.dumps(alert, indent=2)}
             """
             msg.attach(MIMEText(body, 'plain'))
-            with smtplib.SMTP(self.email_settings['smtp_server'], self.email_settings['smtp_port']) as server:
-                server.starttls()
-                server.login(self.email_settings['username'], self.email_settings['password'])
-                server.sendmail(
-                    self.email_settings['from_addr'],
-                    self.email_settings['to_addrs'],
-                    msg.as_string()
-                )
+            self._get_smtp().sendmail(
+                self.email_settings['from_addr'],
+                self.email_settings['to_addrs'],
+                msg.as_string()
+            )
             self.logger.info(f"Email alert sent for tx {alert.get('transaction_id')}")
+            return True
         except Exception as e:
+            self._close_smtp()
             self.logger.error(f"Failed to send email alert: {e}")
+            return False
+
+    def _send_webhook_batch(self, alerts: List[Dict[str, Any]]) -> List[bool]:
+        return [self._send_webhook_alert(alert) for alert in alerts]
 
-    def _send_webhook_alert(self, alert: Dict[str, Any]):
+    def _send_webhook_alert(self, alert: Dict[str, Any]) -> bool:
         try:
-            response = requests.post(
+            response = self.http_session.post(
                 self.webhook_settings['url'],
                 headers=self.webhook_settings['headers'],
                 json=alert,
@@ -130,12 +382,16 @@ class AlertDispatcher:
             )
             if response.status_code == 200:
                 self.logger.info(f"Webhook alert sent for tx {alert.get('transaction_id')}")
-            else:
-                self.logger.warning(f"Webhook alert failed: {response.status_code} {response.text}")
+                return True
+            self.logger.warning(f"Webhook alert failed: {response.status_code} {response.text}")
         except Exception as e:
             self.logger.error(f"Failed to send webhook alert: {e}")
+        return False
 
-    def _send_sms_alert(self, alert: Dict[str, Any]):
+    def _send_sms_batch(self, alerts: List[Dict[str, Any]]) -> List[bool]:
+        return [self._send_sms_alert(alert) for alert in alerts]
+
+    def _send_sms_alert(self, alert: Dict[str, Any]) -> bool:
         try:
             message = f"CRITICAL FRAUD ALERT: TX {alert.get('transaction_id')} Risk: {alert.get('risk_level')}"
             payload = {
@@ -144,51 +400,79 @@ class AlertDispatcher:
                 'from': self.sms_settings['from_number'],
                 'text': message
             }
-            response = requests.post(
+            response = self.http_session.post(
                 self.sms_settings['provider_url'],
                 json=payload,
                 timeout=5
             )
             if response.status_code == 200:
                 self.logger.info(f"SMS alert sent for tx {alert.get('transaction_id')}")
-            else:
-                self.logger.warning(f"SMS alert failed: {response.status_code} {response.text}")
+                return True
+            self.logger.warning(f"SMS alert failed: {response.status_code} {response.text}")
         except Exception as e:
             self.logger.error(f"Failed to send SMS alert: {e}")
+        return False
 
-    def _send_siem_alert(self, alert: Dict[str, Any]):
+    def _send_siem_batch(self, alerts: List[Dict[str, Any]]) -> bool:
+        """Ship a batch of alerts to the SIEM as one bulk payload."""
         try:
+            now = int(time.time())
             payload = {
-                'event_type': 'fraud_alert',
-                'timestamp': int(time.time()),
-                'data': alert
+                'event_type': 'fraud_alert_batch',
+                'timestamp': now,
+                'events': [
+                    {'event_type': 'fraud_alert', 'timestamp': now, 'data': alert}
+                    for alert in alerts
+                ]
             }
-            response = requests.post(
+            response = self.http_session.post(
                 self.siem_settings['endpoint'],
                 headers={'Authorization': f"Bearer {self.siem_settings['api_key']}"},
                 json=payload,
                 timeout=5
             )
             if response.status_code == 200:
-                self.logger.info(f"SIEM alert sent for tx {alert.get('transaction_id')}")
-            else:
-                self.logger.warning(f"SIEM alert failed: {response.status_code} {response.text}")
+                self.logger.info(f"SIEM batch of {len(alerts)} alerts sent")
+                return True
+            self.logger.warning(f"SIEM batch failed: {response.status_code} {response.text}")
         except Exception as e:
-            self.logger.error(f"Failed to send SIEM alert: {e}")
+            self.logger.error(f"Failed to send SIEM batch: {e}")
+        return False
 
     def get_alert_history(self, limit: int = 100) -> List[Dict[str, Any]]:
         """Return the most recent alert dispatches."""
-        return self.alert_history[-limit:]
+        return list(self.alert_history)[-limit:]
 
     def resend_alert(self, alert: Dict[str, Any]):
         """Manual re-dispatch of an alert."""
         self.logger.info(f"Manually resending alert for tx {alert.get('transaction_id')}")
         self._dispatch_alert(alert)
 
-    def shutdown(self):
-        """Graceful shutdown for dispatcher."""
+    def get_channel_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-channel delivery counters and queue depths."""
+        return {name: channel.get_stats() for name, channel in self.channels.items()}
+
+    def shutdown(self, timeout: float = 10.0):
+        """Deliver what is queued within timeout, then stop; undelivered alerts are counted and logged."""
         self.logger.info("Shutting down AlertDispatcher...")
+        deadline = time.monotonic() + timeout
+        while self.alert_queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.stop_event.set()
         self.dispatch_thread.join(timeout=2)
+        dropped = self.alert_queue.qsize()
+        for channel in self.channels.values():
+            channel.drain(max(0.0, deadline - time.monotonic()))
+        for channel in self.channels.values():
+            dropped += channel.shutdown()
+        if dropped:
+            self.logger.warning(f"AlertDispatcher shut down with {dropped} undelivered alert deliveries")
+            self.logger.metric("alerts_dropped", dropped)
+        with self.smtp_lock:
+            servers = list(self.smtp_servers)
+        for server in servers:
+            self._quit_smtp(server)
+        self.http_session.close()
 
 if __name__ == "__main__":
     dispatcher = AlertDispatcher()
@@ -203,4 +487,5 @@ if __name__ == "__main__":
     dispatcher.send_alert(test_alert)
     time.sleep(2)
     print("Alert history:", dispatcher.get_alert_history())
+    print("Channel stats:", dispatcher.get_channel_stats())
     dispatcher.shutdown()
\ No newline at end of file
@@ -0,0 +1,225 @@
+"""Reproducible throughput/latency benchmark for the fraud scoring hot path.
+
+Run from backend/:
+
+    python -m fraud_scoring.benchmark --transactions 20000 --output bench.json
+
+Drives FraudScorer.calculate_score (and calculate_scores in batches),
+RiskThresholdEngine.evaluate_risk and FeedbackTrainer.predict/predict_batch
+with a seeded synthetic stream. Everything runs offline: the scorer uses its
+bundled dummy models and the trainer is fitted on synthetic feedback in a
+temporary directory.
+
+Single-row FeedbackTrainer.predict costs tens of milliseconds (the random
+forest dispatches to its n_jobs=2 worker pool on every call), so only the
+first --trainer-predict-calls rows go through it; predict_batch still covers
+all --transactions rows. peak_rss_mb is the whole benchmark process's high
+water mark so far, not the memory of the suite it is reported with.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Callable
+from utils.config import config
+
+COUNTRIES = ['IN', 'US', 'GB', 'SG', 'NG', 'RU', 'BR', 'CN']
+RISKY_BINS = ['4111', '5110', '3714']
+
+
+def generate_transactions(n: int, users: int = 10000, merchants: int = 2000,
+                          risky_ratio: float = 0.05, retry_ratio: float = 0.0,
+                          seed: int = 42) -> List[Dict[str, Any]]:
+    """Synthetic authorization stream. The same seed always yields the same stream."""
+    rng = random.Random(seed)
+    base = datetime(2024, 1, 1)
+    txs: List[Dict[str, Any]] = []
+    for i in range(n):
+        if txs and rng.random() < retry_ratio:
+            txs.append(dict(rng.choice(txs)))  # retried authorization, same tx_id
+            continue
+        risky = rng.random() < risky_ratio
+        user = rng.randrange(users)
+        txs.append({
+            'tx_id': f'BTX{seed}_{i}',
+            'amount': round(rng.lognormvariate(4.5 if not risky else 7.5, 1.2), 2),
+            'user_id': f'USER{user:07d}',
+            'merchant': f'MERC{rng.randrange(merchants):05d}',
+            'merchant_id': f'HIGH_RISK_{rng.randrange(50)}' if risky else f'MERC{rng.randrange(merchants):05d}',
+            'timestamp': (base + timedelta(seconds=rng.randrange(86400 * 30))).isoformat(),
+            'location_history': [rng.choice(COUNTRIES) for _ in range(rng.randrange(0, 4))],
+            'device_fingerprint': f'DEV{user % 5000:05d}',
+            'user_behavior': {'anomaly_score': rng.betavariate(2, 5 if not risky else 1.5)},
+            'ip_address': f'{rng.choice([10, 192, 8, 51, 103])}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}',
+            'card_bin': rng.choice(RISKY_BINS) if risky else str(rng.randrange(400000, 560000)),
+            'country_code': rng.choice(COUNTRIES),
+            'is_cross_border': rng.random() < 0.1
+        })
+    return txs
+
+
+def summarize(latencies_ns: np.ndarray, items: int, wall_s: float) -> Dict[str, Any]:
+    lat_us = latencies_ns / 1000.0
+    p50, p95, p99 = np.percentile(lat_us, [50, 95, 99])
+    return {
+        'calls': int(len(lat_us)),
+        'items': int(items),
+        'p50_us': round(float(p50), 2),
+        'p95_us': round(float(p95), 2),
+        'p99_us': round(float(p99), 2),
+        'max_us': round(float(lat_us.max()), 2),
+        'mean_us': round(float(lat_us.mean()), 2),
+        'items_per_sec': round(items / wall_s, 1) if wall_s > 0 else None,
+        # Process-wide high water mark, cumulative across every suite run so far
+        'process_peak_rss_mb': peak_rss_mb()
+    }
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return round(rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024, 1)
+
+
+def timed(calls: List[Callable[[], Any]], items: int = None, warmup: int = 100,
+          reset: Callable[[], Any] = None) -> Dict[str, Any]:
+    for fn in calls[:warmup]:
+        fn()
+    if reset:
+        reset()  # e.g. drop cache entries created by the warmup
+    latencies = np.empty(len(calls), dtype=np.int64)
+    start = time.perf_counter()
+    for i, fn in enumerate(calls):
+        t0 = time.perf_counter_ns()
+        fn()
+        latencies[i] = time.perf_counter_ns() - t0
+    wall = time.perf_counter() - start
+    return summarize(latencies, len(calls) if items is None else items, wall)
+
+
+def bench_scorer(txs: List[Dict[str, Any]], batch_size: int) -> Dict[str, Any]:
+    from fraud_scoring.scorer import FraudScorer
+    results = {}
+    scorer = FraudScorer()
+    results['scorer.calculate_score'] = timed([lambda tx=tx: scorer.calculate_score(tx) for tx in txs],
+                                              reset=scorer.score_cache.clear)
+    scorer.feature_store.shutdown()
+
+    scorer = FraudScorer()
+    batches = [txs[i:i + batch_size] for i in range(0, len(txs), batch_size)]
+    stats = timed([lambda b=b: scorer.calculate_scores(b) for b in batches], items=len(txs), warmup=2,
+                  reset=scorer.score_cache.clear)
+    stats['batch_size'] = batch_size
+    results['scorer.calculate_scores'] = stats
+    scorer.feature_store.shutdown()
+    return results
+
+
+def bench_thresholds(txs: List[Dict[str, Any]], seed: int) -> Dict[str, Any]:
+    from fraud_scoring.risk_thresholds import RiskThresholdEngine
+    engine = RiskThresholdEngine()
+    rng = np.random.default_rng(seed)
+    scores = rng.beta(2, 6, size=len(txs))
+    return {'thresholds.evaluate_risk': timed([
+        lambda s=float(s), tx=tx: engine.evaluate_risk(s, tx) for s, tx in zip(scores, txs)
+    ])}
+
+
+def bench_trainer(n: int, batch_size: int, seed: int, workdir: str, single_calls: int) -> Dict[str, Any]:
+    fraud_config = config.setdefault('fraud_scoring', {})
+    fraud_config.update({
+        'model_type': 'sklearn',
+        'feedback_data_path': os.path.join(workdir, 'feedback.csv'),
+        'feedback_store_path': os.path.join(workdir, 'feedback_store'),
+        'model_save_path': os.path.join(workdir, 'model.pkl'),
+        'training_interval': 10 ** 9
+    })
+    from fraud_scoring.feedback_trainer import FeedbackTrainer
+    trainer = FeedbackTrainer()
+    rng = np.random.default_rng(seed)
+    width = len(trainer.feature_columns)
+    X_train = rng.random((2000, width))
+    y_train = (X_train[:, 0] + X_train[:, -1] > 1.0).astype(int)
+    trainer._publish_model(trainer._train_new_model(X_train, y_train), X_train, y_train)
+
+    X = rng.random((n, width))
+    rows = [dict(zip(trainer.feature_columns, row)) for row in X.tolist()]
+    results = {'trainer.predict': timed([lambda r=r: trainer.predict(r) for r in rows[:single_calls]], warmup=10)}
+    batches = [X[i:i + batch_size] for i in range(0, n, batch_size)]
+    stats = timed([lambda b=b: trainer.predict_batch(b) for b in batches], items=n, warmup=2)
+    stats['batch_size'] = batch_size
+    results['trainer.predict_batch'] = stats
+    return results
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        'git_commit': commit or None,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def main(argv=None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Benchmark the fraud scoring hot path")
+    parser.add_argument('--transactions', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--merchants', type=int, default=2000)
+    parser.add_argument('--risky-ratio', type=float, default=0.05)
+    parser.add_argument('--retry-ratio', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--trainer-predict-calls', type=int, default=200,
+                        help="Rows scored one at a time through FeedbackTrainer.predict")
+    parser.add_argument('--only', choices=['scorer', 'thresholds', 'trainer'], action='append')
+    parser.add_argument('--output', help="Write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    suites = args.only or ['scorer', 'thresholds', 'trainer']
+    txs = generate_transactions(args.transactions, args.users, args.merchants,
+                                args.risky_ratio, args.retry_ratio, args.seed)
+    results: Dict[str, Any] = {}
+    if 'scorer' in suites:
+        results.update(bench_scorer(txs, args.batch_size))
+    if 'thresholds' in suites:
+        results.update(bench_thresholds(txs, args.seed))
+    if 'trainer' in suites:
+        with tempfile.TemporaryDirectory(prefix='fortifi_bench_') as workdir:
+            results.update(bench_trainer(args.transactions, args.batch_size, args.seed, workdir,
+                                         args.trainer_predict_calls))
+
+    report = {
+        'schema': 'fortifi.fraud_scoring.benchmark/2',
+        'params': vars(args),
+        'environment': environment(),
+        'results': results
+    }
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(payload)
+    else:
+        print(payload)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import os
+import csv
+import time
+import threading
+import ipaddress
+from typing import Dict, Optional, Tuple
+from utils.logger import StructuredLogger
+
+
+class FeatureSnapshot:
+    """Immutable set of risk lookup tables. Never mutated after construction."""
+
+    def __init__(self, merchant_risk: Dict[str, float], user_history: Dict[str, float],
+                 bin_risk: Dict[str, float], ip_risk: Dict[str, float], version: str = 'default',
+                 bin_exact: Optional[Dict[str, float]] = None):
+        self.version = version
+        self.loaded_at = time.time()
+        self.merchant_risk = dict(merchant_risk)
+        self.user_history = dict(user_history)
+        # Whole-BIN entries, checked before the prefix tables
+        self.bin_exact = {str(k).strip(): float(v) for k, v in (bin_exact or {}).items()}
+        # Longest-prefix match tables: one hash map per prefix length, probed longest first
+        self.bin_tables = self._build_bin_tables(bin_risk)
+        self.bin_lengths = sorted(self.bin_tables, reverse=True)
+        self.ip_tables = self._build_ip_tables(ip_risk)
+        self.ip_lengths = {v: sorted(tables, reverse=True) for v, tables in self.ip_tables.items()}
+
+    @staticmethod
+    def _build_bin_tables(bin_risk: Dict[str, float]) -> Dict[int, Dict[str, float]]:
+        tables: Dict[int, Dict[str, float]] = {}
+        for prefix, score in bin_risk.items():
+            prefix = str(prefix).strip()
+            if prefix:
+                tables.setdefault(len(prefix), {})[prefix] = float(score)
+        return tables
+
+    @staticmethod
+    def _build_ip_tables(ip_risk: Dict[str, float]) -> Dict[int, Dict[int, Dict[int, float]]]:
+        tables: Dict[int, Dict[int, Dict[int, float]]] = {4: {}, 6: {}}
+        for cidr, score in ip_risk.items():
+            network = ipaddress.ip_network(str(cidr).strip(), strict=False)
+            tables[network.version].setdefault(network.prefixlen, {})[int(network.network_address)] = float(score)
+        return tables
+
+    def merchant(self, merchant_id: str) -> Optional[float]:
+        return self.merchant_risk.get(merchant_id)
+
+    def user(self, user_id: str) -> Optional[float]:
+        return self.user_history.get(user_id)
+
+    def bin(self, card_bin: str) -> Optional[float]:
+        score = self.bin_exact.get(card_bin)
+        if score is not None:
+            return score
+        for length in self.bin_lengths:
+            if len(card_bin) >= length:
+                score = self.bin_tables[length].get(card_bin[:length])
+                if score is not None:
+                    return score
+        return None
+
+    def ip(self, ip_address: str) -> Optional[float]:
+        try:
+            addr = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+        value = int(addr)
+        bits = addr.max_prefixlen
+        tables = self.ip_tables[addr.version]
+        for prefixlen in self.ip_lengths[addr.version]:
+            mask = ((1 << prefixlen) - 1) << (bits - prefixlen)
+            score = tables[prefixlen].get(value & mask)
+            if score is not None:
+                return score
+        return None
+
+    def size(self) -> Dict[str, int]:
+        return {
+            'merchant': len(self.merchant_risk),
+            'user': len(self.user_history),
+            'bin': sum(len(t) for t in self.bin_tables.values()) + len(self.bin_exact),
+            'ip': sum(len(t) for v in self.ip_tables.values() for t in v.values())
+        }
+
+
+class FeatureStore:
+    """Serves merchant, user, BIN and IP-prefix risk from in-memory snapshots.
+
+    Tables are CSV files (key,score) in table_dir. A background thread rebuilds
+    a snapshot when any file changes and publishes it with a single reference
+    swap, so lookups never take a lock or wait on a reload.
+
+    Rows in bin_risk.csv are prefixes (longest match wins). Default BIN
+    entries match only the exact BIN, like the hardcoded set they seed, and a
+    loaded row for the same key replaces them.
+    """
+
+    TABLE_FILES = {
+        'merchant_risk': 'merchant_risk.csv',
+        'user_history': 'user_history.csv',
+        'bin_risk': 'bin_risk.csv',
+        'ip_risk': 'ip_risk.csv'
+    }
+
+    def __init__(self, table_dir: Optional[str] = None, reload_interval: float = 30.0,
+                 defaults: Optional[Dict[str, Dict[str, float]]] = None):
+        self.logger = StructuredLogger(name="FeatureStore")
+        self.table_dir = table_dir
+        self.reload_interval = reload_interval
+        self.defaults = defaults or {}
+        self.snapshot = self._build_snapshot({}, version='default')
+        self._mtimes: Tuple = ()
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.reload_thread = None
+        if table_dir:
+            self.reload()
+            if reload_interval > 0:
+                self.reload_thread = threading.Thread(target=self._reload_loop, daemon=True)
+                self.reload_thread.start()
+
+    def merchant_risk(self, merchant_id: str) -> Optional[float]:
+        return self.snapshot.merchant(merchant_id)
+
+    def user_history(self, user_id: str) -> Optional[float]:
+        return self.snapshot.user(user_id)
+
+    def bin_risk(self, card_bin: str) -> Optional[float]:
+        return self.snapshot.bin(card_bin)
+
+    def ip_risk(self, ip_address: str) -> Optional[float]:
+        return self.snapshot.ip(ip_address)
+
+    def reload(self, force: bool = False) -> bool:
+        """Rebuild and publish a snapshot if the table files changed. Returns True on swap."""
+        with self._reload_lock:
+            mtimes = self._current_mtimes()
+            if not force and mtimes == self._mtimes:
+                return False
+            try:
+                tables = {name: self._read_table(filename) for name, filename in self.TABLE_FILES.items()}
+                snapshot = self._build_snapshot(tables, version=str(max((m for _, m in mtimes), default=0)))
+            except Exception as e:
+                self.logger.error(f"Feature table reload failed, keeping snapshot {self.snapshot.version}: {e}")
+                return False
+            self.snapshot = snapshot
+            self._mtimes = mtimes
+            self.logger.info(f"Feature store snapshot {snapshot.version} published", extra=snapshot.size())
+            return True
+
+    def shutdown(self):
+        self._stop.set()
+        if self.reload_thread:
+            self.reload_thread.join(timeout=2)
+
+    def _reload_loop(self):
+        while not self._stop.wait(self.reload_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                self.logger.error(f"Feature store reload loop error: {e}")
+
+    def _build_snapshot(self, tables: Dict[str, Dict[str, float]], version: str) -> FeatureSnapshot:
+        merged = {name: {**self.defaults.get(name, {}), **tables.get(name, {})} for name in self.TABLE_FILES}
+        loaded_bins = tables.get('bin_risk', {})
+        return FeatureSnapshot(
+            merchant_risk=merged['merchant_risk'],
+            user_history=merged['user_history'],
+            bin_risk=loaded_bins,
+            ip_risk=merged['ip_risk'],
+            version=version,
+            bin_exact={k: v for k, v in self.defaults.get('bin_risk', {}).items() if k not in loaded_bins}
+        )
+
+    def _current_mtimes(self) -> Tuple:
+        mtimes = []
+        for filename in self.TABLE_FILES.values():
+            path = os.path.join(self.table_dir, filename)
+            if os.path.exists(path):
+                mtimes.append((filename, os.path.getmtime(path)))
+        return tuple(mtimes)
+
+    def _read_table(self, filename: str) -> Dict[str, float]:
+        path = os.path.join(self.table_dir, filename)
+        if not os.path.exists(path):
+            return {}
+        table = {}
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 2 or row[0].startswith('#'):
+                    continue
+                try:
+                    table[row[0].strip()] = float(row[1])
+                except ValueError:
+                    continue  # header or malformed row
+        return table
@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import threading
+import numpy as np
+from datetime import datetime, date
+from typing import Dict, Any, List, Optional, Tuple, Iterator
+
+
+class FeedbackStore:
+    """Day-partitioned columnar store for labelled feedback.
+
+    Each append writes one immutable part per day under ``day=YYYY-MM-DD/``:
+    a column-major float32 feature matrix plus label, timestamp, tx id and
+    meta arrays, all plain ``.npy`` files. Readers memory-map the parts, so
+    selecting a subset of feature columns or a time slice never parses the
+    full history. Parts carry a global, increasing sequence number, which
+    doubles as the incremental-training cursor. A part becomes visible only
+    once its ``.done`` marker is renamed into place.
+
+    Once a day has closed, compact() merges its parts into a single part
+    named after the sequence range it covers (``part-FIRST-LAST``). The
+    ``.done`` manifest lists each original part's sequence number and row
+    count, so reads after a cursor can still slice out only the newer rows.
+    Parts covered by a compacted range are ignored until they are deleted, so
+    a crash mid-compaction never shows rows twice.
+    """
+
+    PART_RE = re.compile(r'^part-(\d{10})(?:-(\d{10}))?\.done$')
+    COMPACT_FILES = ('features', 'label', 'ts', 'tx', 'meta')
+
+    def __init__(self, root_dir: str, feature_columns: List[str]):
+        self.root_dir = root_dir
+        self.feature_columns = list(feature_columns)
+        self.column_index = {c: i for i, c in enumerate(self.feature_columns)}
+        self.lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+        self.next_seq = self._max_seq() + 1
+        self.compacted_before: Optional[date] = None
+
+    def append(self, feedbacks: List[Dict[str, Any]]) -> List[int]:
+        """Persist a batch of feedback dicts; returns the part numbers written."""
+        by_day: Dict[str, List[Dict[str, Any]]] = {}
+        for fb in feedbacks:
+            day = self._parse_ts(fb['timestamp']).date().isoformat()
+            by_day.setdefault(day, []).append(fb)
+        written = []
+        with self.lock:
+            for day, rows in sorted(by_day.items()):
+                seq = self.next_seq
+                self.next_seq += 1
+                self._write_part(day, seq, rows)
+                written.append(seq)
+        if self.compacted_before != date.today():
+            self.compact()
+        return written
+
+    def _write_part(self, day: str, seq: int, rows: List[Dict[str, Any]]):
+        part_dir = os.path.join(self.root_dir, f"day={day}")
+        os.makedirs(part_dir, exist_ok=True)
+        prefix = os.path.join(part_dir, f"part-{seq:010d}")
+        features = np.asfortranarray(
+            [[float(fb['features'].get(c, 0.0)) for c in self.feature_columns] for fb in rows],
+            dtype=np.float32
+        ).reshape(len(rows), len(self.feature_columns))
+        np.save(f"{prefix}.features.npy", features)
+        np.save(f"{prefix}.label.npy", np.array([fb['label'] for fb in rows], dtype=np.int8))
+        np.save(f"{prefix}.ts.npy", np.array([self._parse_ts(fb['timestamp']) for fb in rows], dtype='datetime64[us]'))
+        np.save(f"{prefix}.tx.npy", np.array([str(fb['transaction_id']) for fb in rows]))
+        np.save(f"{prefix}.meta.npy", np.array([json.dumps(fb.get('meta') or {}, default=str) for fb in rows]))
+        self._commit_part(prefix, {'rows': len(rows), 'columns': self.feature_columns, 'segments': [[seq, len(rows)]]})
+
+    @staticmethod
+    def _commit_part(prefix: str, manifest: Dict[str, Any]):
+        with open(f"{prefix}.done.tmp", 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{prefix}.done.tmp", f"{prefix}.done")
+
+    def _day_parts(self, part_dir: str) -> List[Tuple[int, int, str]]:
+        """(first_seq, last_seq, prefix) of a day's live parts, minus any covered by a compacted part."""
+        parts = []
+        for name in os.listdir(part_dir):
+            m = self.PART_RE.match(name)
+            if m:
+                first = int(m.group(1))
+                parts.append((first, int(m.group(2) or first), os.path.join(part_dir, name[:-len('.done')])))
+        return [p for p in parts
+                if not any(o is not p and o[0] <= p[0] and p[1] <= o[1] for o in parts)]
+
+    def _parts(self, start: Optional[date] = None, end: Optional[date] = None,
+               after_seq: int = 0) -> Iterator[Tuple[int, str, str]]:
+        """Yield (seq, day, prefix) of committed parts in sequence order; seq is a part's last sequence."""
+        found = []
+        for entry in os.listdir(self.root_dir):
+            if not entry.startswith('day='):
+                continue
+            day = entry[4:]
+            d = date.fromisoformat(day)
+            if (start and d < start) or (end and d > end):
+                continue
+            for _, last, prefix in self._day_parts(os.path.join(self.root_dir, entry)):
+                if last > after_seq:
+                    found.append((last, day, prefix))
+        return iter(sorted(found))
+
+    def compact(self, before: Optional[date] = None) -> int:
+        """Merge each day before ``before`` (default today) into one part; returns the days compacted."""
+        before = before or date.today()
+        compacted = 0
+        with self.lock:
+            for entry in sorted(os.listdir(self.root_dir)):
+                if not entry.startswith('day=') or date.fromisoformat(entry[4:]) >= before:
+                    continue
+                part_dir = os.path.join(self.root_dir, entry)
+                parts = sorted(self._day_parts(part_dir))
+                if len(parts) > 1:
+                    self._compact_day(part_dir, parts)
+                    compacted += 1
+                self._remove_covered(part_dir)
+            self.compacted_before = before
+        return compacted
+
+    def _compact_day(self, part_dir: str, parts: List[Tuple[int, int, str]]):
+        segments = []
+        for _, _, prefix in parts:
+            with open(f"{prefix}.done") as f:
+                manifest = json.load(f)
+            segments += manifest.get('segments') or [[int(os.path.basename(prefix)[5:15]), manifest['rows']]]
+        prefix = os.path.join(part_dir, f"part-{parts[0][0]:010d}-{parts[-1][1]:010d}")
+        for name in self.COMPACT_FILES:
+            merged = np.concatenate([np.load(f"{p}.{name}.npy") for _, _, p in parts])
+            np.save(f"{prefix}.{name}.npy", np.asfortranarray(merged) if name == 'features' else merged)
+        self._commit_part(prefix, {'rows': sum(n for _, n in segments), 'columns': self.feature_columns,
+                                   'segments': segments})
+
+    def _remove_covered(self, part_dir: str):
+        """Delete parts superseded by a compacted part, marker first so they stay hidden if interrupted."""
+        live = {prefix for _, _, prefix in self._day_parts(part_dir)}
+        for name in os.listdir(part_dir):
+            m = self.PART_RE.match(name)
+            prefix = os.path.join(part_dir, name[:-len('.done')]) if m else None
+            if prefix is None or prefix in live:
+                continue
+            os.remove(f"{prefix}.done")
+            for column in self.COMPACT_FILES:
+                try:
+                    os.remove(f"{prefix}.{column}.npy")
+                except FileNotFoundError:
+                    pass
+
+    def _rows_after(self, prefix: str, after_seq: int) -> Optional[slice]:
+        """Row slice of a compacted part holding sequences after ``after_seq``; None means all rows."""
+        first = int(os.path.basename(prefix)[5:15])
+        if first > after_seq:
+            return None
+        with open(f"{prefix}.done") as f:
+            segments = json.load(f)['segments']
+        skip = sum(rows for seq, rows in segments if seq <= after_seq)
+        return slice(skip, None)
+
+    def _max_seq(self) -> int:
+        return max((seq for seq, _, _ in self._parts()), default=0)
+
+    def read(self, columns: Optional[List[str]] = None, start: Optional[datetime] = None,
+             end: Optional[datetime] = None, after_seq: int = 0) -> Tuple[np.ndarray, np.ndarray, int]:
+        """Return (X, y, last_seq) for committed parts after ``after_seq``.
+
+        ``columns`` prunes features; ``start``/``end`` slice by feedback
+        timestamp and skip whole day partitions outside the range.
+        """
+        idx = [self.column_index[c] for c in (columns or self.feature_columns)]
+        xs, ys, last_seq = [], [], after_seq
+        with self.lock:  # compaction deletes parts; hold it while they are listed and mapped
+            parts = [(seq, prefix, np.load(f"{prefix}.features.npy", mmap_mode='r'),
+                      np.load(f"{prefix}.label.npy", mmap_mode='r'),
+                      np.load(f"{prefix}.ts.npy", mmap_mode='r') if start or end else None,
+                      self._rows_after(prefix, after_seq) if after_seq else None)
+                     for seq, _, prefix in self._parts(start.date() if start else None,
+                                                       end.date() if end else None, after_seq)]
+        for seq, prefix, features, labels, ts, rows in parts:
+            if rows is not None:
+                features, labels = features[rows], labels[rows]
+                ts = ts[rows] if ts is not None else None
+            if ts is not None:
+                mask = np.ones(len(ts), dtype=bool)
+                if start:
+                    mask &= ts >= np.datetime64(start, 'us')
+                if end:
+                    mask &= ts <= np.datetime64(end, 'us')
+                xs.append(features[:, idx][mask])
+                ys.append(labels[mask])
+            else:
+                xs.append(features[:, idx])
+                ys.append(np.asarray(labels))
+            last_seq = seq
+        if not xs:
+            return np.empty((0, len(idx)), dtype=np.float32), np.empty(0, dtype=np.int8), last_seq
+        return np.concatenate(xs), np.concatenate(ys), last_seq
+
+    def count(self) -> int:
+        total = 0
+        with self.lock:
+            for _, _, prefix in self._parts():
+                with open(f"{prefix}.done") as f:
+                    total += json.load(f)['rows']
+        return total
+
+    def tail(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Most recent ``limit`` feedback records, oldest first."""
+        with self.lock:
+            return self._tail(limit)
+
+    def _tail(self, limit: int) -> List[Dict[str, Any]]:
+        records: List[Dict[str, Any]] = []
+        for _, _, prefix in sorted(self._parts(), reverse=True):
+            features = np.load(f"{prefix}.features.npy", mmap_mode='r')
+            labels = np.load(f"{prefix}.label.npy")
+            ts = np.load(f"{prefix}.ts.npy")
+            tx = np.load(f"{prefix}.tx.npy")
+            meta = np.load(f"{prefix}.meta.npy")
+            for i in range(len(labels) - 1, -1, -1):
+                records.append({
+                    'transaction_id': str(tx[i]),
+                    'features': dict(zip(self.feature_columns, features[i].tolist())),
+                    'label': int(labels[i]),
+                    'meta': json.loads(str(meta[i])),
+                    'timestamp': ts[i].astype(datetime).isoformat()
+                })
+                if len(records) >= limit:
+                    return records[::-1]
+        return records[::-1]
+
+    def import_csv(self, csv_path: str, chunksize: int = 100000) -> int:
+        """One-off migration of the legacy append-only feedback CSV."""
+        import pandas as pd
+        imported = 0
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            feedbacks = [{
+                'transaction_id': row['transaction_id'],
+                'features': {c: row[c] for c in self.feature_columns if c in row},
+                'label': int(row['label']),
+                'timestamp': row['timestamp']
+            } for row in chunk.to_dict('records')]
+            self.append(feedbacks)
+            imported += len(feedbacks)
+        return imported
+
+    @staticmethod
+    def _parse_ts(value: Any) -> datetime:
+        if isinstance(value, datetime):
+            return value.replace(tzinfo=None)
+        return datetime.fromisoformat(str(value)).replace(tzinfo=None)
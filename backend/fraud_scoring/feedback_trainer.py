@@ -1,29 +1,53 @@
 import os
+import copy
 import time
 import json
 import threading
 import queue
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional, Tuple
 import numpy as np
-import pandas as pd
 from utils.logger import StructuredLogger
 from utils.config import config
+from .feedback_store import FeedbackStore
 
 class FeedbackTrainer:
     def __init__(self):
         self.logger = StructuredLogger(name="FeedbackTrainer")
         self.feedback_queue = queue.Queue()
         self.training_data_path = config.get('fraud_scoring', {}).get('feedback_data_path', '/var/fortifi/feedback_training.csv')
+        self.feedback_store_path = config.get('fraud_scoring', {}).get('feedback_store_path', '/var/fortifi/feedback_store')
+        self.training_window_days = config.get('fraud_scoring', {}).get('training_window_days')
         self.model_save_path = config.get('fraud_scoring', {}).get('model_save_path', '/var/fortifi/models/fraud_model_latest.pkl')
         self.model_type = config.get('fraud_scoring', {}).get('model_type', 'xgboost')
-        self.training_thread = threading.Thread(target=self._training_loop, daemon=True)
-        self.training_thread.start()
+        self.training_mode = config.get('fraud_scoring', {}).get('training_mode', 'full')
+        self.incremental_rounds = int(config.get('fraud_scoring', {}).get('incremental_rounds', 20))
+        self.min_incremental_rows = int(config.get('fraud_scoring', {}).get('min_incremental_rows', 100))
+        self.checkpoint_path = f"{self.model_save_path}.cursor.json"
         self.training_interval = int(config.get('fraud_scoring', {}).get('training_interval', 3600))
         self.last_training_time = datetime.min
         self.model = self._load_initial_model()
+        self.model_version = 0
+        self.validation_rows = int(config.get('fraud_scoring', {}).get('validation_rows', 5000))
+        self.min_validation_auc = config.get('fraud_scoring', {}).get('min_validation_auc')
+        # Incremental mode: newest rows held out for validation, trained on with the next batch
+        self.carried_holdout: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self.training_lock = threading.Lock()
         self.feature_columns = self._get_feature_columns()
-        self.feedback_history = []
+        self.feedback_store = self._init_feedback_store()
+        self.training_cursor = self._load_checkpoint()
+        # Start last so the loop never sees a half-initialised trainer
+        self.training_thread = threading.Thread(target=self._training_loop, daemon=True)
+        self.training_thread.start()
+
+    def _init_feedback_store(self) -> FeedbackStore:
+        store = FeedbackStore(self.feedback_store_path, self.feature_columns)
+        # training_data_path is the legacy CSV; migrate it once into the columnar store
+        if os.path.exists(self.training_data_path) and store.count() == 0:
+            imported = store.import_csv(self.training_data_path)
+            os.replace(self.training_data_path, f"{self.training_data_path}.migrated")
+            self.logger.info(f"Migrated {imported} feedback rows from {self.training_data_path} to {self.feedback_store_path}")
+        return store
 
     def submit_feedback(self, transaction_id: str, features: Dict[str, float], label: int, meta: Optional[Dict[str, Any]] = None):
         """Queue feedback for training."""
@@ -56,66 +80,226 @@ class FeedbackTrainer:
         while not self.feedback_queue.empty():
             feedback = self.feedback_queue.get()
             feedbacks.append(feedback)
-            self.feedback_history.append(feedback)
             self.feedback_queue.task_done()
         if feedbacks:
-            self._append_feedback_to_file(feedbacks)
-
-    def _append_feedback_to_file(self, feedbacks: List[Dict[str, Any]]):
-        """Append feedback to CSV for batch retraining."""
-        rows = []
-        for fb in feedbacks:
-            row = {**fb['features'], 'label': fb['label'], 'transaction_id': fb['transaction_id'], 'timestamp': fb['timestamp']}
-            rows.append(row)
-        df = pd.DataFrame(rows)
-        if not os.path.exists(self.training_data_path):
-            df.to_csv(self.training_data_path, index=False)
-        else:
-            df.to_csv(self.training_data_path, mode='a', header=False, index=False)
-        self.logger.info(f"Appended {len(rows)} feedback rows to {self.training_data_path}")
+            self._append_feedback_to_store(feedbacks)
+
+    def _append_feedback_to_store(self, feedbacks: List[Dict[str, Any]]):
+        """Append feedback to the columnar store for batch retraining."""
+        parts = self.feedback_store.append(feedbacks)
+        self.logger.info(f"Appended {len(feedbacks)} feedback rows to {self.feedback_store_path} (parts {parts})")
 
     def _retrain_model(self):
-        """Retrain the model using all available feedback data."""
-        if not os.path.exists(self.training_data_path):
-            self.logger.warning(f"No training data found at {self.training_data_path}")
+        """Retrain the model using the configured training mode."""
+        with self.training_lock:
+            if self.training_mode == 'incremental':
+                self._retrain_incremental()
+            else:
+                self._retrain_full()
+
+    def _retrain_full(self):
+        """Retrain the model from scratch on the configured training window."""
+        start = None
+        if self.training_window_days:
+            start = datetime.now() - timedelta(days=float(self.training_window_days))
+        X, y, last_part = self.feedback_store.read(self.feature_columns, start=start)
+        if len(X) < 100:
+            self.logger.info(f"Insufficient feedback rows ({len(X)}) for retraining. Skipping.")
             return
-        df = pd.read_csv(self.training_data_path)
-        if len(df) < 100:
-            self.logger.info(f"Insufficient feedback rows ({len(df)}) for retraining. Skipping.")
+        X_fit, y_fit, X_val, y_val = self._split_holdout(X, y)
+        self.logger.info(f"Retraining model on {len(X_fit)} samples, validating on {len(X_val)}...")
+        candidate = self._train_new_model(X_fit, y_fit)
+        if candidate is None:
+            self.logger.warning(f"Unknown model type: {self.model_type}. Skipping retrain.")
             return
-        X = df[self.feature_columns].values
-        y = df['label'].values
-        self.logger.info(f"Retraining model on {len(X)} samples...")
-        if self.model_type == 'xgboost':
-            self._train_xgboost(X, y)
-        elif self.model_type == 'lightgbm':
-            self._train_lightgbm(X, y)
-        elif self.model_type == 'sklearn':
-            self._train_sklearn_rf(X, y)
+        if not self._publish_model(candidate, X_val, y_val):
+            return
+        self._save_checkpoint({'part': last_part, 'rows': len(X)})
+        self.logger.info(f"Model retrained and saved to {self.model_save_path}")
+
+    def _retrain_incremental(self):
+        """Update the model with feedback appended since the last checkpoint only."""
+        X, y, last_part = self.feedback_store.read(self.feature_columns, after_seq=self.training_cursor.get('part', 0))
+        if len(X) < self.min_incremental_rows:
+            self.logger.info(f"Insufficient new feedback rows ({len(X)}) for incremental update. Skipping.")
+            return
+        y = y.astype(int)
+        if len(np.unique(y)) < 2:
+            # Keep the cursor where it is so these rows are retried with the next batch
+            self.logger.info("New feedback contains a single class. Deferring incremental update.")
+            return
+        X_fit, y_fit, X_val, y_val = self._split_holdout(X, y)
+        if self.carried_holdout is not None:
+            X_fit = np.concatenate([self.carried_holdout[0], X_fit])
+            y_fit = np.concatenate([self.carried_holdout[1], y_fit])
+        if len(np.unique(y_fit)) < 2:
+            self.logger.info("Training rows left after the validation holdout contain a single class. Deferring.")
+            return
+        live_model = self.model
+        if not self._is_fitted(live_model):
+            self.logger.info(f"No fitted model yet, bootstrapping on {len(X_fit)} new samples...")
+            candidate = self._train_new_model(X_fit, y_fit)
         else:
+            self.logger.info(f"Incrementally updating model with {len(X_fit)} new samples...")
+            # Update a private copy; the serving model is never mutated in place
+            staged = copy.deepcopy(live_model)
+            if self.model_type == 'xgboost':
+                candidate = self._update_xgboost(staged, X_fit, y_fit)
+            elif self.model_type == 'lightgbm':
+                candidate = self._update_lightgbm(staged, X_fit, y_fit)
+            elif self.model_type == 'sklearn':
+                candidate = self._update_sklearn_rf(staged, X_fit, y_fit)
+            elif self.model_type == 'sgd':
+                candidate = self._update_sgd(staged, X_fit, y_fit)
+            else:
+                candidate = None
+        if candidate is None:
             self.logger.warning(f"Unknown model type: {self.model_type}. Skipping retrain.")
             return
-        self._save_model()
-        self.logger.info(f"Model retrained and saved to {self.model_save_path}")
+        if not self._publish_model(candidate, X_val, y_val):
+            return
+        # The cursor moves past the holdout rows, so keep them to train on with the next batch
+        self.carried_holdout = (X_val, y_val)
+        self._save_checkpoint({'part': last_part, 'rows': self.training_cursor.get('rows', 0) + len(X)})
+        self.logger.info(f"Model incrementally updated and saved to {self.model_save_path}")
+
+    def _train_new_model(self, X, y):
+        if self.model_type == 'xgboost':
+            return self._train_xgboost(X, y)
+        elif self.model_type == 'lightgbm':
+            return self._train_lightgbm(X, y)
+        elif self.model_type == 'sklearn':
+            return self._train_sklearn_rf(X, y)
+        elif self.model_type == 'sgd':
+            return self._train_sgd(X, y)
+        return None
+
+    def _split_holdout(self, X, y) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Split off the newest rows (at most validation_rows, and at most a fifth of X) for validation."""
+        holdout = min(self.validation_rows, len(X) // 5)
+        split = len(X) - holdout
+        return X[:split], y[:split], X[split:], y[split:]
+
+    def _validate_model(self, model, X, y) -> bool:
+        """Sanity-check a staged model on held-out rows it was not fitted on before serving it."""
+        if not self._is_fitted(model):
+            self.logger.error("Staged model is not fitted; keeping current model.")
+            return False
+        if len(X) == 0:
+            self.logger.warning("No held-out rows to validate the staged model on; publishing unchecked.")
+            return True
+        sample = slice(max(0, len(X) - self.validation_rows), len(X))
+        try:
+            proba = np.asarray(model.predict_proba(X[sample]))
+        except Exception as e:
+            self.logger.error(f"Staged model failed validation predict: {e}")
+            return False
+        if proba.shape != (len(X[sample]), 2) or not np.all(np.isfinite(proba)) \
+                or proba.min() < 0 or proba.max() > 1:
+            self.logger.error(f"Staged model produced invalid probabilities {proba.shape}; keeping current model.")
+            return False
+        if self.min_validation_auc and len(np.unique(y[sample])) == 2:
+            from sklearn.metrics import roc_auc_score
+            auc = roc_auc_score(y[sample], proba[:, 1])
+            if auc < self.min_validation_auc:
+                self.logger.warning(f"Staged model AUC {auc:.4f} below {self.min_validation_auc}; keeping current model.")
+                return False
+        return True
+
+    def _publish_model(self, candidate, X, y) -> bool:
+        """Validate, persist and atomically swap in a staged model."""
+        if not self._validate_model(candidate, X, y):
+            return False
+        self._save_model(candidate)
+        # Single reference assignment: readers see either the old or the new model
+        self.model = candidate
+        self.model_version += 1
+        return True
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        if os.path.exists(self.checkpoint_path):
+            try:
+                with open(self.checkpoint_path) as f:
+                    return json.load(f)
+            except Exception as e:
+                self.logger.warning(f"Unreadable training checkpoint, starting from scratch: {e}")
+        return {'part': 0, 'rows': 0}
+
+    def _save_checkpoint(self, cursor: Dict[str, Any]):
+        cursor = {**cursor, 'updated_at': datetime.now().isoformat()}
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(cursor, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self.training_cursor = cursor
+
+    @staticmethod
+    def _is_fitted(model) -> bool:
+        from sklearn.utils.validation import check_is_fitted
+        from sklearn.exceptions import NotFittedError
+        try:
+            check_is_fitted(model)
+            return True
+        except (NotFittedError, TypeError):
+            return False
 
     def _train_xgboost(self, X, y):
         import xgboost as xgb
-        self.model = xgb.XGBClassifier(n_estimators=100, max_depth=5, learning_rate=0.1, n_jobs=2)
-        self.model.fit(X, y)
+        model = xgb.XGBClassifier(n_estimators=100, max_depth=5, learning_rate=0.1, n_jobs=2)
+        model.fit(X, y)
+        return model
 
     def _train_lightgbm(self, X, y):
         import lightgbm as lgb
-        self.model = lgb.LGBMClassifier(n_estimators=100, max_depth=5, learning_rate=0.1, n_jobs=2)
-        self.model.fit(X, y)
+        model = lgb.LGBMClassifier(n_estimators=100, max_depth=5, learning_rate=0.1, n_jobs=2)
+        model.fit(X, y)
+        return model
 
     def _train_sklearn_rf(self, X, y):
         from sklearn.ensemble import RandomForestClassifier
-        self.model = RandomForestClassifier(n_estimators=100, max_depth=5, n_jobs=2)
-        self.model.fit(X, y)
+        model = RandomForestClassifier(n_estimators=100, max_depth=5, n_jobs=2)
+        model.fit(X, y)
+        return model
+
+    def _train_sgd(self, X, y):
+        from sklearn.linear_model import SGDClassifier
+        model = SGDClassifier(loss='log_loss', alpha=1e-4)
+        model.partial_fit(X, y, classes=np.array([0, 1]))
+        return model
+
+    def _update_xgboost(self, base, X, y):
+        # Continue boosting from the current booster instead of starting over
+        import xgboost as xgb
+        params = base.get_params()
+        params['n_estimators'] = self.incremental_rounds
+        model = xgb.XGBClassifier(**params)
+        model.fit(X, y, xgb_model=base.get_booster())
+        return model
+
+    def _update_lightgbm(self, base, X, y):
+        import lightgbm as lgb
+        params = base.get_params()
+        params['n_estimators'] = self.incremental_rounds
+        model = lgb.LGBMClassifier(**params)
+        model.fit(X, y, init_model=base.booster_)
+        return model
+
+    def _update_sklearn_rf(self, base, X, y):
+        # warm_start keeps the existing trees and fits only the added ones on new rows
+        base.set_params(warm_start=True, n_estimators=base.n_estimators + self.incremental_rounds)
+        base.fit(X, y)
+        return base
+
+    def _update_sgd(self, base, X, y):
+        base.partial_fit(X, y)
+        return base
 
-    def _save_model(self):
+    def _save_model(self, model=None):
         import joblib
-        joblib.dump(self.model, self.model_save_path)
+        # Write then rename so a crash never leaves a truncated model file
+        tmp_path = f"{self.model_save_path}.tmp"
+        joblib.dump(self.model if model is None else model, tmp_path)
+        os.replace(tmp_path, self.model_save_path)
 
     def _load_initial_model(self):
         import joblib
@@ -142,7 +326,7 @@ class FeedbackTrainer:
         ]
 
     def get_feedback_history(self, limit: int = 100) -> List[Dict[str, Any]]:
-        return self.feedback_history[-limit:]
+        return self.feedback_store.tail(limit)
 
     def manual_retrain(self):
         """Manual trigger for retraining."""
@@ -151,8 +335,24 @@ class FeedbackTrainer:
 
     def predict(self, features: Dict[str, float]) -> float:
         """Predict fraud probability for a feature vector."""
-        X = np.array([features[col] for col in self.feature_columns]).reshape(1, -1)
-        return float(self.model.predict_proba(X)[0][1])
+        return float(self.predict_batch([features])[0])
+
+    def predict_batch(self, features) -> np.ndarray:
+        """Predict fraud probabilities for a (n, len(feature_columns)) matrix or a list of feature dicts."""
+        width = len(self.feature_columns)
+        if isinstance(features, np.ndarray):
+            if features.ndim == 1 and features.shape[0] == width:
+                X = features.reshape(1, width)
+            elif features.ndim == 2 and features.shape[1] == width:
+                X = features
+            else:
+                raise ValueError(f"Expected {width} feature values or an (n, {width}) matrix, got shape {features.shape}")
+        else:
+            X = np.array([[fb[col] for col in self.feature_columns] for fb in features], dtype=np.float64)
+            X = X.reshape(-1, width)
+        # Read the reference once so a concurrent publish cannot switch models mid-call
+        model = self.model
+        return model.predict_proba(X)[:, 1]
 
     def shutdown(self):
         """Graceful shutdown for trainer."""
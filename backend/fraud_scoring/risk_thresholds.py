@@ -1,21 +1,30 @@
+import os
 import math
 import time
 import json
+import threading
 import numpy as np
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
-from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
 from utils.logger import StructuredLogger
 from utils.config import config
+from .score_sketch import WindowedScoreSketch
+from .velocity_tracker import VelocityTracker
 
 class RiskThresholdEngine:
     def __init__(self):
         self.logger = StructuredLogger(name="RiskThresholds")
         self.base_thresholds = self._load_base_thresholds()
-        self.historical_scores = deque(maxlen=1000)
+        self.score_windows = self._init_score_windows()
+        self.primary_window = next(iter(self.score_windows))
+        self.fleet_sketches: Dict[str, Dict[str, WindowedScoreSketch]] = {}
         self.adjustment_factors = {'critical': 1.0, 'high': 1.0, 'medium': 1.0}
         self.last_adjustment_time = datetime.min
+        self.window_stats = self._compute_window_stats()
         self.velocity_window = timedelta(minutes=5)
+        self.velocity_limits = self._load_velocity_limits()
+        self.velocity_tracker = self._init_velocity_tracker()
+        self.snapshot_thread: Optional[threading.Thread] = None
         self.geo_risk_db = self._load_geo_risk_data()
         self.merchant_blacklist = self._load_merchant_blacklist()
         self.hysteresis_ranges = {
@@ -83,7 +92,7 @@ class RiskThresholdEngine:
             adjustment *= 1.25
             
         # Velocity check
-        if self._high_velocity(tx['user_id']):
+        if self._high_velocity(tx['user_id'], tx['amount']):
             adjustment *= 1.3
             
         # Holiday adjustment
@@ -136,21 +145,69 @@ class RiskThresholdEngine:
             
         return sorted(list(set(actions)))
 
+    def _init_score_windows(self) -> Dict[str, WindowedScoreSketch]:
+        windows = config.get('fraud_scoring', {}).get('threshold_windows', {
+            'short': 300,
+            'long': 3600
+        })
+        return {name: WindowedScoreSketch(window_seconds=seconds) for name, seconds in windows.items()}
+
+    def export_score_sketches(self) -> Dict[str, Dict[str, Any]]:
+        """Serialized per-window sketches for exchange with other workers"""
+        return {name: sketch.to_dict() for name, sketch in self.score_windows.items()}
+
+    def merge_fleet_sketches(self, worker_id: str, sketches: Dict[str, Dict[str, Any]]):
+        """Replace the latest sketches received from another worker"""
+        self.fleet_sketches[worker_id] = {
+            name: WindowedScoreSketch.from_dict(data)
+            for name, data in sketches.items() if name in self.score_windows
+        }
+
+    def _window_histogram(self, window: str) -> np.ndarray:
+        sketches = [self.score_windows[window]]
+        sketches += [remote[window] for remote in list(self.fleet_sketches.values()) if window in remote]
+        return WindowedScoreSketch.combined_histogram(sketches)
+
+    def get_score_percentiles(self, window: str,
+                              quantiles: Tuple[float, ...] = (0.5, 0.95, 0.99)) -> Dict[str, float]:
+        """Fleet-wide score percentiles for a window"""
+        return self._percentiles(self._window_histogram(window), quantiles)
+
+    @staticmethod
+    def _percentiles(hist: np.ndarray, quantiles: Tuple[float, ...] = (0.5, 0.95, 0.99)) -> Dict[str, float]:
+        values = WindowedScoreSketch.quantiles_from_histogram(hist, list(quantiles))
+        return {f"p{int(q * 100)}": round(v, 4) for q, v in zip(quantiles, values)}
+
     def _update_system_state(self, score: float, tx: Dict):
         """Update internal state for adaptive thresholding"""
-        self.historical_scores.append(score)
-        
-        # Update thresholds every 5 minutes
+        for sketch in self.score_windows.values():
+            sketch.add(score)
+
+    def _update_dynamic_factors(self):
+        """Refresh adjustment factors and the reported window stats from the score sketches every 5 minutes"""
         if datetime.now() - self.last_adjustment_time > timedelta(minutes=5):
-            self._adjust_thresholds()
+            hist = self._window_histogram(self.primary_window)
+            self._adjust_thresholds(hist)
+            self.window_stats = self._compute_window_stats(hist)
             self.last_adjustment_time = datetime.now()
+            self._save_velocity_snapshot_async()
+
+    def _compute_window_stats(self, hist: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """Primary-window stats reported in system_state; cached so evaluate_risk never walks the sketches"""
+        if hist is None:
+            hist = self._window_histogram(self.primary_window)
+        return {
+            'historical_score_count': self.score_windows[self.primary_window].count(),
+            'score_percentiles': self._percentiles(hist)
+        }
 
-    def _adjust_thresholds(self):
+    def _adjust_thresholds(self, hist: Optional[np.ndarray] = None):
         """Adaptive threshold adjustment based on recent activity"""
-        recent_scores = list(self.historical_scores)[-100:]
+        if hist is None:
+            hist = self._window_histogram(self.primary_window)
         
-        if len(recent_scores) >= 50:
-            fraud_rate = sum(1 for s in recent_scores if s > 0.7) / len(recent_scores)
+        if hist.sum() >= 50:
+            fraud_rate = WindowedScoreSketch.fraction_above_from_histogram(hist, 0.7)
             
             # Adjust thresholds based on fraud rate
             self.adjustment_factors['critical'] = 0.95 + (fraud_rate * 0.5)
@@ -190,9 +247,66 @@ class RiskThresholdEngine:
     def _get_geo_adjustment(self, country_code: str) -> float:
         return self.geo_risk_db.get(country_code, 1.0)
 
-    def _high_velocity(self, user_id: str) -> bool:
-        """Check transaction velocity via external service"""
-        return False  # Implementation would query velocity service
+    def _load_velocity_limits(self) -> Dict[str, Dict[str, float]]:
+        return config.get('fraud_scoring', {}).get('velocity_limits', {
+            '1m': {'window': 60, 'count': 5, 'amount': 5000},
+            '5m': {'window': self.velocity_window.total_seconds(), 'count': 10, 'amount': 20000},
+            '1h': {'window': 3600, 'count': 30, 'amount': 50000}
+        })
+
+    def _init_velocity_tracker(self) -> VelocityTracker:
+        tracker = VelocityTracker(
+            windows={name: limit['window'] for name, limit in self.velocity_limits.items()},
+            max_users=int(config.get('fraud_scoring', {}).get('velocity_max_users', 1000000))
+        )
+        snapshot_path = config.get('fraud_scoring', {}).get('velocity_snapshot_path')
+        if snapshot_path and os.path.exists(snapshot_path):
+            try:
+                restored = tracker.restore(snapshot_path)
+                self.logger.info(f"Restored velocity counters for {restored} users")
+            except Exception as e:
+                self.logger.warning(f"Velocity snapshot restore failed: {e}")
+        return tracker
+
+    def save_velocity_snapshot(self, path: Optional[str] = None):
+        """Persist velocity counters so they survive restarts"""
+        path = path or config.get('fraud_scoring', {}).get('velocity_snapshot_path')
+        if path:
+            self.velocity_tracker.snapshot(path)
+
+    def _save_velocity_snapshot_async(self):
+        """Periodic save off the evaluation path; skipped while the previous one is still writing"""
+        if not config.get('fraud_scoring', {}).get('velocity_snapshot_path'):
+            return
+        if self.snapshot_thread is not None and self.snapshot_thread.is_alive():
+            return
+
+        def save():
+            try:
+                self.save_velocity_snapshot()
+            except Exception as e:
+                self.logger.warning(f"Velocity snapshot save failed: {e}")
+
+        self.snapshot_thread = threading.Thread(target=save, daemon=True)
+        self.snapshot_thread.start()
+
+    def shutdown(self, timeout: float = 10.0):
+        """Write a final velocity snapshot so counters survive the restart"""
+        if self.snapshot_thread is not None:
+            self.snapshot_thread.join(timeout=timeout)
+        try:
+            self.save_velocity_snapshot()
+        except Exception as e:
+            self.logger.error(f"Final velocity snapshot failed: {e}")
+
+    def _high_velocity(self, user_id: str, amount: float) -> bool:
+        """Record the transaction and check every velocity window against its limits"""
+        totals = self.velocity_tracker.record(user_id, float(amount))
+        for name, (count, total_amount) in totals.items():
+            limit = self.velocity_limits[name]
+            if count > limit['count'] or total_amount > limit['amount']:
+                return True
+        return False
 
     def _is_holiday_period(self) -> bool:
         """Check against holiday calendar"""
@@ -215,7 +329,8 @@ class RiskThresholdEngine:
             },
             'timestamp': datetime.now().isoformat(),
             'system_state': {
-                'historical_score_count': len(self.historical_scores),
+                # Refreshed with the adjustment factors, so at most 5 minutes old
+                **self.window_stats,
                 'last_adjustment': self.last_adjustment_time.isoformat(),
                 'current_factors': self.adjustment_factors
             }
@@ -237,4 +352,5 @@ if __name__ == "__main__":
     print("Medium Risk:", engine.evaluate_risk(0.70, test_transaction))
     print("Low Risk:", engine.evaluate_risk(0.30, test_transaction))
     print("Invalid Risk:", engine.evaluate_risk(1.5, test_transaction))
-    print("Invalid Transaction:", engine.evaluate_risk(0.85, {}))   
\ No newline at end of file
+    print("Invalid Transaction:", engine.evaluate_risk(0.85, {}))
+    engine.shutdown()   
\ No newline at end of file
@@ -0,0 +1,72 @@
+import time
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+
+class ScoreCache:
+    """Size-bounded LRU cache of scoring results with per-entry TTL."""
+
+    def __init__(self, max_size: int = 100000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    @staticmethod
+    def make_key(tx: Dict[str, Any]) -> str:
+        """Process-stable key: tx_id when present, else a digest of the canonical transaction."""
+        if tx.get('tx_id'):
+            return str(tx['tx_id'])
+        canonical = json.dumps(tx, sort_keys=True, default=str, separators=(',', ':'))
+        return 'sha256:' + hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self.entries[key]
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return dict(value)
+
+    def put(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (expires_at, dict(value))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def purge_expired(self) -> int:
+        """Drop expired entries; returns how many were removed."""
+        now = time.monotonic()
+        with self.lock:
+            expired = [k for k, (expires_at, _) in self.entries.items() if expires_at <= now]
+            for k in expired:
+                del self.entries[k]
+            self.stats['expirations'] += len(expired)
+        return len(expired)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {**self.stats, 'size': len(self.entries), 'max_size': self.max_size}
@@ -0,0 +1,123 @@
+import time
+import threading
+import numpy as np
+from typing import Dict, Any, Optional, List
+
+
+class WindowedScoreSketch:
+    """Mergeable quantile sketch of [0, 1] risk scores over a sliding time window.
+
+    Scores are bounded, so each time bucket is a fixed-resolution histogram:
+    memory is n_buckets * bins counters regardless of traffic, quantile error is
+    at most 1 / bins, and sketches from different workers merge by adding
+    counters. Buckets are aligned to wall-clock epochs so workers agree on them.
+    """
+
+    def __init__(self, window_seconds: float = 3600, n_buckets: int = 12, bins: int = 1000):
+        self.window_seconds = window_seconds
+        self.n_buckets = n_buckets
+        self.bins = bins
+        self.bucket_seconds = window_seconds / n_buckets
+        self.counts = np.zeros((n_buckets, bins), dtype=np.int64)
+        self.epochs = np.full(n_buckets, -1, dtype=np.int64)
+        self.lock = threading.Lock()
+
+    def _epoch(self, now: Optional[float] = None) -> int:
+        return int((time.time() if now is None else now) // self.bucket_seconds)
+
+    def _bin(self, score: float) -> int:
+        return min(max(int(score * self.bins), 0), self.bins - 1)
+
+    def _slot(self, epoch: int) -> int:
+        slot = epoch % self.n_buckets
+        if self.epochs[slot] != epoch:
+            self.counts[slot].fill(0)
+            self.epochs[slot] = epoch
+        return slot
+
+    def add(self, score: float, now: Optional[float] = None):
+        epoch = self._epoch(now)
+        with self.lock:
+            self.counts[self._slot(epoch), self._bin(score)] += 1
+
+    def histogram(self, now: Optional[float] = None) -> np.ndarray:
+        """Aggregate bin counts across the live buckets of the window."""
+        current = self._epoch(now)
+        with self.lock:
+            live = (self.epochs > current - self.n_buckets) & (self.epochs <= current)
+            return self.counts[live].sum(axis=0)
+
+    def merge(self, other: 'WindowedScoreSketch'):
+        """Fold another worker's sketch into this one. Geometry must match."""
+        if (other.bins, other.n_buckets, other.bucket_seconds) != (self.bins, self.n_buckets, self.bucket_seconds):
+            raise ValueError("Cannot merge sketches with different geometry")
+        with other.lock:
+            epochs = other.epochs.copy()
+            counts = other.counts.copy()
+        self._merge_buckets(epochs, counts)
+
+    def _merge_buckets(self, epochs: np.ndarray, counts: np.ndarray):
+        with self.lock:
+            for epoch, row in zip(epochs, counts):
+                if epoch < 0:
+                    continue
+                slot = epoch % self.n_buckets
+                if self.epochs[slot] > epoch:
+                    continue  # other side is older than what we already hold
+                self.counts[self._slot(int(epoch))] += row
+
+    @staticmethod
+    def combined_histogram(sketches: List['WindowedScoreSketch'], now: Optional[float] = None) -> np.ndarray:
+        return np.sum([s.histogram(now) for s in sketches], axis=0)
+
+    def count(self, now: Optional[float] = None) -> int:
+        return int(self.histogram(now).sum())
+
+    @staticmethod
+    def quantiles_from_histogram(hist: np.ndarray, qs: List[float]) -> List[float]:
+        total = hist.sum()
+        if total == 0:
+            return [0.0 for _ in qs]
+        cumulative = np.cumsum(hist)
+        idx = np.searchsorted(cumulative, np.asarray(qs) * total, side='left')
+        idx = np.minimum(idx, len(hist) - 1)
+        # Report the bin midpoint
+        return [float((i + 0.5) / len(hist)) for i in idx]
+
+    @staticmethod
+    def fraction_above_from_histogram(hist: np.ndarray, threshold: float) -> float:
+        total = hist.sum()
+        if total == 0:
+            return 0.0
+        first = min(int(threshold * len(hist)) + 1, len(hist))
+        return float(hist[first:].sum() / total)
+
+    def quantiles(self, qs: List[float], now: Optional[float] = None) -> List[float]:
+        return self.quantiles_from_histogram(self.histogram(now), qs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Sparse, JSON-safe form for shipping to other workers."""
+        with self.lock:
+            buckets = []
+            for epoch, row in zip(self.epochs, self.counts):
+                if epoch < 0:
+                    continue
+                nz = np.flatnonzero(row)
+                buckets.append([int(epoch), nz.tolist(), row[nz].tolist()])
+        return {
+            'window_seconds': self.window_seconds,
+            'n_buckets': self.n_buckets,
+            'bins': self.bins,
+            'buckets': buckets
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'WindowedScoreSketch':
+        sketch = cls(data['window_seconds'], data['n_buckets'], data['bins'])
+        epochs = np.full(sketch.n_buckets, -1, dtype=np.int64)
+        counts = np.zeros((sketch.n_buckets, sketch.bins), dtype=np.int64)
+        for i, (epoch, idx, values) in enumerate(data['buckets'][-sketch.n_buckets:]):
+            epochs[i] = epoch
+            counts[i, idx] = values
+        sketch._merge_buckets(epochs, counts)
+        return sketch
@@ -6,13 +6,24 @@ from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 from utils.logger import StructuredLogger
 from utils.config import config
+from .score_cache import ScoreCache
+from .feature_store import FeatureStore
 
 class FraudScorer:
     def __init__(self):
         self.logger = StructuredLogger(name="FraudScorer")
         self.feature_weights = self._load_feature_weights()
+        self.feature_names = [
+            'amount', 'merchant_risk', 'geo_velocity', 'device_trust', 'behavior_anomaly',
+            'user_history', 'time_of_day', 'network_analysis', 'bin_analysis'
+        ]
+        self.weight_vector = np.array([self.feature_weights[k] for k in self.feature_names], dtype=np.float64)
         self.models = self._load_models()
-        self.score_cache = {}
+        self.feature_store = self._load_feature_store()
+        self.score_cache = ScoreCache(
+            max_size=int(config.get('fraud_scoring', {}).get('score_cache_size', 100000)),
+            ttl=float(config.get('fraud_scoring', {}).get('score_cache_ttl', 300))
+        )
         self.last_score_time = datetime.min
         self.ensemble_strategy = "weighted_average"
 
@@ -40,23 +51,97 @@ class FraudScorer:
             'neural_net': self._load_onnx_model()
         }
 
+    def _load_feature_store(self) -> FeatureStore:
+        # Seed tables reproduce the previous hardcoded heuristics until real tables are loaded
+        store_config = config.get('fraud_scoring', {}).get('feature_store', {})
+        return FeatureStore(
+            table_dir=store_config.get('path'),
+            reload_interval=float(store_config.get('reload_interval', 30)),
+            defaults={
+                'bin_risk': {'4111': 0.7, '5110': 0.7, '3714': 0.7},
+                'ip_risk': {'10.0.0.0/8': 0.9, '192.0.0.0/8': 0.9}
+            }
+        )
+
     def calculate_score(self, transaction: Dict[str, Any]) -> Dict[str, Any]:
         try:
             if not self._precheck(transaction):
                 return {'error': 'Invalid transaction data'}
 
+            cache_key = ScoreCache.make_key(transaction)
+            if cached := self.score_cache.get(cache_key):
+                return cached
+
             features = self._extract_features(transaction)
             rule_based_score = self._rule_based_score(features)
             ml_score = self._ml_based_score(features)
             final_score = self._combine_scores(rule_based_score, ml_score)
 
-            self._post_score_actions(transaction, final_score)
-            return self._format_output(features, final_score, rule_based_score, ml_score)
+            result = self._format_output(features, final_score, rule_based_score, ml_score)
+            self._post_score_actions(transaction, final_score, result, cache_key)
+            return result
 
         except Exception as e:
             self.logger.error(f"Scoring failed: {str(e)}")
             return {'error': 'Scoring system error'}
 
+    def calculate_scores(self, transactions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Score a batch of transactions with one feature matrix and one model call.
+
+        Results match calling calculate_score on each transaction in order.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(transactions)
+        valid_idx, keys, duplicates = [], [], []
+        first_seen: Dict[str, int] = {}
+        for i, tx in enumerate(transactions):
+            # Same guards as calculate_score: a bad transaction gets its own error, not the batch's
+            try:
+                if not self._precheck(tx):
+                    results[i] = {'error': 'Invalid transaction data'}
+                    continue
+                key = ScoreCache.make_key(tx)
+            except Exception as e:
+                self.logger.error(f"Scoring failed: {str(e)}")
+                results[i] = {'error': 'Scoring system error'}
+                continue
+            if key in first_seen:
+                duplicates.append((i, first_seen[key]))
+            elif cached := self.score_cache.get(key):
+                results[i] = cached
+            else:
+                first_seen[key] = i
+                valid_idx.append(i)
+                keys.append(key)
+        if not valid_idx:
+            return self._fill_duplicates(results, duplicates)
+
+        batch = [transactions[i] for i in valid_idx]
+        try:
+            matrix = self._extract_feature_matrix(batch)
+            rule_scores = matrix @ self.weight_vector
+            ml_scores = self._ml_based_scores(matrix)
+            final_scores = self._combine_scores_batch(rule_scores, ml_scores)
+        except Exception as e:
+            # One malformed field poisons a whole column; fall back to per-transaction scoring
+            self.logger.warning(f"Batch scoring failed, falling back to single scoring: {str(e)}")
+            for i, tx in zip(valid_idx, batch):
+                results[i] = self.calculate_score(tx)
+            return self._fill_duplicates(results, duplicates)
+
+        rows = matrix.tolist()
+        for pos, (i, tx) in enumerate(zip(valid_idx, batch)):
+            features = dict(zip(self.feature_names, rows[pos]))
+            final_score = float(final_scores[pos])
+            results[i] = self._format_output(features, final_score, float(rule_scores[pos]), float(ml_scores[pos]))
+            self._post_score_actions(tx, final_score, results[i], keys[pos])
+        return self._fill_duplicates(results, duplicates)
+
+    def _fill_duplicates(self, results: List[Optional[Dict[str, Any]]], duplicates: List[tuple]) -> List[Dict[str, Any]]:
+        # Repeats of a key within one batch are served from the first occurrence, as the cache would
+        for i, first in duplicates:
+            results[i] = dict(results[first])
+        return results
+
     def _precheck(self, tx: Dict) -> bool:
         required_fields = ['amount', 'user_id', 'merchant', 'timestamp']
         if not all(field in tx for field in required_fields):
@@ -81,6 +166,21 @@ class FraudScorer:
             'bin_analysis': self._bin_analysis_score(tx.get('card_bin', ''))
         }
 
+    def _extract_feature_matrix(self, txs: List[Dict]) -> np.ndarray:
+        """Column-major (n, 9) feature matrix in feature_names order."""
+        matrix = np.empty((len(txs), len(self.feature_names)), dtype=np.float64, order='F')
+        amounts = np.fromiter((tx['amount'] for tx in txs), dtype=np.float64, count=len(txs))
+        matrix[:, 0] = np.minimum(np.log10(amounts + 1) / 6, 1.0)
+        matrix[:, 1] = [self._get_merchant_risk(tx['merchant']) for tx in txs]
+        matrix[:, 2] = [self._calculate_geo_velocity(tx.get('location_history', [])) for tx in txs]
+        matrix[:, 3] = [self._device_trust_score(tx.get('device_fingerprint', '')) for tx in txs]
+        matrix[:, 4] = [self._behavior_anomaly_score(tx.get('user_behavior', {})) for tx in txs]
+        matrix[:, 5] = [self._user_history_score(tx.get('user_id', '')) for tx in txs]
+        matrix[:, 6] = [self._time_of_day_score(tx['timestamp']) for tx in txs]
+        matrix[:, 7] = [self._network_analysis_score(tx.get('ip_address', '')) for tx in txs]
+        matrix[:, 8] = [self._bin_analysis_score(tx.get('card_bin', '')) for tx in txs]
+        return matrix
+
     def _rule_based_score(self, features: Dict) -> float:
         # Weighted sum of normalized features
         return sum(features[k] * self.feature_weights[k] for k in features.keys())
@@ -93,6 +193,28 @@ class FraudScorer:
             self.logger.error(f"ML scoring failed: {str(e)}")
             return float(self.models['xgboost'].predict([list(features.values())])[0])
 
+    def _ml_based_scores(self, matrix: np.ndarray) -> np.ndarray:
+        try:
+            model_input = np.ascontiguousarray(matrix, dtype=np.float32)
+            return np.asarray(self.models['neural_net'].predict(model_input), dtype=np.float64)[:, 0]
+        except Exception as e:
+            self.logger.error(f"ML batch scoring failed: {str(e)}")
+            return np.asarray(self.models['xgboost'].predict(np.ascontiguousarray(matrix)), dtype=np.float64)
+
+    def _combine_scores_batch(self, rule_scores: np.ndarray, ml_scores: np.ndarray) -> np.ndarray:
+        if self.ensemble_strategy == "weighted_average":
+            # Sequential scoring resets last_score_time after every transaction, so only
+            # the first item in the batch sees a non-zero recency weight.
+            recency = np.zeros_like(rule_scores)
+            recency[0] = np.tanh((datetime.now() - self.last_score_time).seconds / 3600)
+            return (0.7 * ml_scores) + (0.3 * rule_scores) * (1 + recency)
+        elif self.ensemble_strategy == "max":
+            return np.maximum(rule_scores, ml_scores)
+        elif self.ensemble_strategy == "min":
+            return np.minimum(rule_scores, ml_scores)
+        else:
+            return (ml_scores + rule_scores) / 2
+
     def _combine_scores(self, rule_score: float, ml_score: float) -> float:
         if self.ensemble_strategy == "weighted_average":
             recency_weight = np.tanh((datetime.now() - self.last_score_time).seconds / 3600)
@@ -108,8 +230,8 @@ class FraudScorer:
         return min(np.log10(amount + 1) / 6, 1.0)
 
     def _get_merchant_risk(self, merchant_id: str) -> float:
-        # In production, call merchant risk service or DB
-        return 0.5  # Placeholder
+        score = self.feature_store.merchant_risk(merchant_id)
+        return 0.5 if score is None else score
 
     def _calculate_geo_velocity(self, location_history: List[str]) -> float:
         # In production, compute from user location sequence
@@ -126,7 +248,9 @@ class FraudScorer:
         return float(user_behavior.get('anomaly_score', 0.5))
 
     def _user_history_score(self, user_id: str) -> float:
-        # In production, query user risk profile/history
+        score = self.feature_store.user_history(user_id)
+        if score is not None:
+            return score
         return 0.6 if user_id and user_id.startswith("USER") else 0.3
 
     def _time_of_day_score(self, timestamp: str) -> float:
@@ -137,19 +261,19 @@ class FraudScorer:
             return 0.5
 
     def _network_analysis_score(self, ip_address: str) -> float:
-        # In production, use IP intelligence service
         if not ip_address:
             return 0.5
-        octet = int(ip_address.split('.')[0])
-        return 0.9 if octet in [192, 10] else 0.3
+        score = self.feature_store.ip_risk(ip_address)
+        return 0.3 if score is None else score
 
     def _bin_analysis_score(self, card_bin: str) -> float:
-        # In production, use BIN risk DB
-        risky_bins = {'4111', '5110', '3714'}
-        return 0.7 if card_bin in risky_bins else 0.2
+        if not card_bin:
+            return 0.2
+        score = self.feature_store.bin_risk(card_bin)
+        return 0.2 if score is None else score
 
-    def _post_score_actions(self, tx: Dict, score: float):
-        self.score_cache[tx.get('tx_id', str(hash(str(tx))))] = score
+    def _post_score_actions(self, tx: Dict, score: float, result: Dict, cache_key: str):
+        self.score_cache.put(cache_key, result)
         self.last_score_time = datetime.now()
         if score > 0.8:
             self.logger.metric("high_risk_transaction", 1)
@@ -168,10 +292,9 @@ class FraudScorer:
 
     # --- Mock model loading ---
     def _load_xgboost_model(self):
-        from xgboost import XGBClassifier
         class DummyXGB:
             def predict(self, X):
-                return [float(np.mean(X))]
+                return np.mean(np.asarray(X, dtype=np.float64), axis=1)
         return DummyXGB()
 
     def _load_onnx_model(self):
@@ -196,4 +319,6 @@ if __name__ == "__main__":
     }
     result = scorer.calculate_score(sample_tx)
     print("Fraud score result:", json.dumps(result, indent=2))
+    batch_results = scorer.calculate_scores([sample_tx, {**sample_tx, 'tx_id': 'TX124', 'amount': 9800.0}])
+    print("Batch scores:", [r.get('score') for r in batch_results])
     
\ No newline at end of file
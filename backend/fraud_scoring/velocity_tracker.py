@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+class _RingWindow:
+    """Sliding window of count/amount kept as a ring of time buckets with running totals."""
+
+    __slots__ = ('bucket_seconds', 'n', 'head', 'counts', 'amounts', 'total_count', 'total_amount')
+
+    def __init__(self, window_seconds: float, n_buckets: int):
+        self.bucket_seconds = window_seconds / n_buckets
+        self.n = n_buckets
+        self.head = -1  # epoch of the newest bucket
+        self.counts = [0] * n_buckets
+        self.amounts = [0.0] * n_buckets
+        self.total_count = 0
+        self.total_amount = 0.0
+
+    def advance(self, now: float):
+        epoch = int(now // self.bucket_seconds)
+        if epoch <= self.head:
+            return
+        # Clear at most n buckets no matter how long the user was idle
+        for e in range(max(self.head + 1, epoch - self.n + 1), epoch + 1):
+            slot = e % self.n
+            self.total_count -= self.counts[slot]
+            self.total_amount -= self.amounts[slot]
+            self.counts[slot] = 0
+            self.amounts[slot] = 0.0
+        self.head = epoch
+
+    def add(self, now: float, amount: float):
+        self.advance(now)
+        slot = self.head % self.n
+        self.counts[slot] += 1
+        self.amounts[slot] += amount
+        self.total_count += 1
+        self.total_amount += amount
+
+    def to_list(self) -> list:
+        return [self.head, self.counts, self.amounts]
+
+    def load(self, data: list):
+        self.head, counts, amounts = data
+        self.counts = list(counts)[:self.n] + [0] * (self.n - len(counts))
+        self.amounts = [float(a) for a in amounts][:self.n] + [0.0] * (self.n - len(amounts))
+        self.total_count = sum(self.counts)
+        self.total_amount = sum(self.amounts)
+
+
+class VelocityTracker:
+    """In-process per-user transaction velocity over several sliding windows.
+
+    Each user holds one fixed-size ring per window, so memory per user is
+    bounded and record/check are O(1) amortized. Users idle for longer than
+    the largest window, or beyond max_users, are evicted oldest-first.
+    """
+
+    def __init__(self, windows: Optional[Dict[str, float]] = None, n_buckets: int = 30,
+                 max_users: int = 1000000, idle_ttl: Optional[float] = None):
+        self.windows = windows or {'1m': 60, '5m': 300, '1h': 3600}
+        self.n_buckets = n_buckets
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl or max(self.windows.values())
+        self.users = OrderedDict()  # user_id -> (last_seen, {window: _RingWindow})
+        self.lock = threading.Lock()
+
+    def _new_state(self) -> Dict[str, _RingWindow]:
+        return {name: _RingWindow(seconds, self.n_buckets) for name, seconds in self.windows.items()}
+
+    def record(self, user_id: str, amount: float, now: Optional[float] = None) -> Dict[str, Tuple[int, float]]:
+        """Add a transaction and return (count, amount) per window including it."""
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.users.pop(user_id, None)
+            state = entry[1] if entry else self._new_state()
+            for ring in state.values():
+                ring.add(now, amount)
+            self.users[user_id] = (now, state)
+            self._evict(now)
+            return {name: (ring.total_count, ring.total_amount) for name, ring in state.items()}
+
+    def get(self, user_id: str, now: Optional[float] = None) -> Dict[str, Tuple[int, float]]:
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.users.get(user_id)
+            if not entry:
+                return {name: (0, 0.0) for name in self.windows}
+            for ring in entry[1].values():
+                ring.advance(now)
+            return {name: (ring.total_count, ring.total_amount) for name, ring in entry[1].items()}
+
+    def _evict(self, now: float):
+        # Entries are ordered by last_seen, so only the front needs checking
+        while self.users:
+            user_id, (last_seen, _) = next(iter(self.users.items()))
+            if len(self.users) > self.max_users or now - last_seen > self.idle_ttl:
+                self.users.popitem(last=False)
+            else:
+                break
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def snapshot(self, path: str):
+        """Write counters to disk atomically."""
+        with self.lock:
+            data = {
+                'windows': self.windows,
+                'n_buckets': self.n_buckets,
+                'users': {uid: [last_seen, {name: ring.to_list() for name, ring in state.items()}]
+                          for uid, (last_seen, state) in self.users.items()}
+            }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def restore(self, path: str) -> int:
+        """Load counters from a snapshot; returns the number of users restored."""
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('windows') != self.windows or data.get('n_buckets') != self.n_buckets:
+            raise ValueError("Velocity snapshot geometry does not match tracker configuration")
+        now = time.time()
+        with self.lock:
+            self.users.clear()
+            for uid, (last_seen, rings) in sorted(data['users'].items(), key=lambda kv: kv[1][0]):
+                state = self._new_state()
+                for name, ring_data in rings.items():
+                    state[name].load(ring_data)
+                self.users[uid] = (last_seen, state)
+            self._evict(now)
+            return len(self.users)
@@ -1,9 +1,11 @@
 import os
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
+from concurrent.futures import Future
 from web3 import Web3
 import json
 from utils.logger import StructuredLogger
+from utils.tx_submitter import get_submitter
 
 class AuditLogger:
     def __init__(self):
@@ -22,53 +24,41 @@ class AuditLogger:
             abi=abi
         )
         self.account = self.w3.eth.account.from_key(self.config['private_key'])
+        self.submitter = get_submitter(self.w3, self.account)
 
-    def log_access(self, tx_hash: str, shard_ids: List[str], accessor: str, action: str, purpose: str):
-        try:
-            nonce = self.w3.eth.get_transaction_count(self.account.address)
-            tx = self.contract.functions.logAccessEvent(
-                tx_hash,
-                shard_ids,
-                accessor,
-                action,
-                purpose,
-                int(datetime.utcnow().timestamp())
-            ).buildTransaction({
-                'from': self.account.address,
-                'nonce': nonce,
-                'gas': 180000,
-                'gasPrice': self.w3.toWei('50', 'gwei')
-            })
-            signed_tx = self.account.sign_transaction(tx)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-            self.logger.info(f"Logged access event for {accessor} on {shard_ids} (action: {action}, purpose: {purpose}) tx: {tx_hash.hex()}")
-            return tx_hash.hex()
-        except Exception as e:
-            self.logger.error(f"Failed to log access event: {e}")
-            return ""
+    def log_access(self, tx_hash: str, shard_ids: List[str], accessor: str, action: str, purpose: str,
+                   wait: bool = False) -> Union[Future, str]:
+        """Queue an access event; returns a future of the carrying tx hash, or the hash itself if wait=True"""
+        future = self.submitter.enqueue_event(self.contract, 'logAccessEvent', (
+            tx_hash,
+            shard_ids,
+            accessor,
+            action,
+            purpose,
+            int(datetime.utcnow().timestamp())
+        ), gas=180000)
+        self.logger.info(f"Queued access event for {accessor} on {shard_ids} (action: {action}, purpose: {purpose})")
+        return self._result(future, "access") if wait else future
+
+    def log_reconstruction(self, tx_hash: str, accessor: str, status: str, reason: str, shard_ids: List[str],
+                           wait: bool = False) -> Union[Future, str]:
+        """Queue a reconstruction event; same return convention as log_access"""
+        future = self.submitter.enqueue_event(self.contract, 'logReconstructionEvent', (
+            tx_hash,
+            accessor,
+            status,
+            reason,
+            shard_ids,
+            int(datetime.utcnow().timestamp())
+        ), gas=180000)
+        self.logger.info(f"Queued reconstruction event for {accessor} (status: {status}, reason: {reason})")
+        return self._result(future, "reconstruction") if wait else future
 
-    def log_reconstruction(self, tx_hash: str, accessor: str, status: str, reason: str, shard_ids: List[str]):
+    def _result(self, future: Future, kind: str, timeout: float = 30.0) -> str:
         try:
-            nonce = self.w3.eth.get_transaction_count(self.account.address)
-            tx = self.contract.functions.logReconstructionEvent(
-                tx_hash,
-                accessor,
-                status,
-                reason,
-                shard_ids,
-                int(datetime.utcnow().timestamp())
-            ).buildTransaction({
-                'from': self.account.address,
-                'nonce': nonce,
-                'gas': 180000,
-                'gasPrice': self.w3.toWei('50', 'gwei')
-            })
-            signed_tx = self.account.sign_transaction(tx)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-            self.logger.info(f"Logged reconstruction event for {accessor} (status: {status}, reason: {reason}) tx: {tx_hash.hex()}")
-            return tx_hash.hex()
+            return future.result(timeout=timeout)
         except Exception as e:
-            self.logger.error(f"Failed to log reconstruction event: {e}")
+            self.logger.error(f"Failed to log {kind} event: {e}")
             return ""
 
     def get_access_logs(self, tx_hash: str) -> List[Dict[str, Any]]:
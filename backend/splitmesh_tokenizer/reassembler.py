@@ -2,71 +2,153 @@ import os
 import json
 import hashlib
 import zlib
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union, Callable, BinaryIO, Tuple, Iterable
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding, hashes, hmac
 from cryptography.hazmat.backends import default_backend
 from base64 import urlsafe_b64decode
 from utils.blockchain import BlockchainUtility
 from utils.logger import StructuredLogger
+from utils.erasure_coding import ReedSolomonCodec
+from utils.permission_verifier import PermissionVerifier
 
 class Reassembler:
     def __init__(self, contract_config: Dict[str, str], min_shards: int = 2):
         self.min_shards = min_shards
         self.backend = default_backend()
         self.logger = StructuredLogger(name="Reassembler")
+        self._codecs: Dict[tuple, ReedSolomonCodec] = {}
         self.blockchain = BlockchainUtility(
             contract_config['rpc_url'],
             contract_config['contract_address'],
             contract_config['abi_path'],
             contract_config['private_key']
         )
+        self.permissions = PermissionVerifier(
+            self.blockchain.w3,
+            self.blockchain.contract,
+            settings=contract_config.get('permissions')
+        )
 
-    def reassemble(self, tx_id: str, shards: List[bytes], keys_metadata: Dict, requestor: str) -> Optional[Dict]:
+    def reassemble(self, tx_id: str, shards: Union[List[Optional[bytes]], Dict[str, bytes]],
+                   keys_metadata: Dict, requestor: str) -> Optional[Dict]:
+        """
+        Rebuild a record from any min_shards of its shards.
+        shards is either a dict keyed by shard_id or a list aligned with keys_metadata
+        (None for shards that could not be fetched).
+        """
         if not self._verify_permission_onchain(tx_id, requestor):
             self.logger.error(f"Permission denied for {requestor} to reassemble tx {tx_id}")
             return None
 
-        if len(shards) < self.min_shards:
-            self.logger.error(f"Insufficient shards ({len(shards)}) for reassembly (min required: {self.min_shards})")
+        if isinstance(shards, dict):
+            pairs = [(shards.get(shard_id), shard_id, meta) for shard_id, meta in keys_metadata.items()]
+        else:
+            pairs = [(shard, shard_id, meta) for shard, (shard_id, meta) in zip(shards, keys_metadata.items())]
+        pairs = [p for p in pairs if p[0] is not None]
+
+        min_shards = next((p[2].get('data_shards') for p in pairs if p[2].get('data_shards')), self.min_shards)
+        if len(pairs) < min_shards:
+            self.logger.error(f"Insufficient shards ({len(pairs)}) for reassembly (min required: {min_shards})")
             return None
 
-        decrypted_chunks = []
-        for shard, (shard_id, meta) in zip(shards, keys_metadata.items()):
+        decrypted_chunks = {}
+        for shard, shard_id, meta in pairs:
             key = urlsafe_b64decode(meta['key'])
             iv = urlsafe_b64decode(meta['iv'])
             hmac_val = bytes.fromhex(meta['hmac'])
-            salt = urlsafe_b64decode(meta['salt']) if meta.get('salt') else None
 
-            # Integrity check
-            if not self._verify_hmac(key, shard, hmac_val):
+            # Integrity check (tag covers iv + ciphertext)
+            if not self._verify_hmac(key, memoryview(shard)[:-32], hmac_val):
                 self.logger.error(f"HMAC validation failed for shard {shard_id}")
-                return None
+                continue
 
-            # Decrypt
-            decrypted = self._decrypt_shard(shard, key, iv)
-            decrypted_chunks.append(decrypted)
+            decrypted_chunks[meta['index']] = self._decrypt_shard(shard, key, iv)
+            if len(decrypted_chunks) == min_shards:
+                break
+
+        if len(decrypted_chunks) < min_shards:
+            self.logger.error(f"Only {len(decrypted_chunks)} valid shards for tx {tx_id} (min required: {min_shards})")
+            return None
 
-        # Erasure decode (strip parity, join, decompress, deserialize)
-        data_bytes = self._combine_chunks(decrypted_chunks)
+        # Erasure decode, decompress, deserialize
         try:
+            data_bytes = self._combine_chunks(decrypted_chunks, pairs[0][2])
             decompressed = zlib.decompress(data_bytes)
             data = json.loads(decompressed.decode('utf-8'))
             self.logger.info(f"Successfully reassembled transaction {tx_id}")
             return data
         except Exception as e:
-            self.logger.error(f"Failed to decompress or decode data: {e}")
+            self.logger.error(f"Failed to decode, decompress or deserialize data: {e}")
+            return None
+
+    def reassemble_stream(self, tx_id: str, fetch: Callable[[str, int], Optional[bytes]],
+                          keys_metadata: Dict, requestor: str, out: BinaryIO) -> Optional[int]:
+        """
+        Counterpart of ShardEngine.shard_stream: rebuild a striped payload one stripe
+        at a time and write the serialized bytes to out. fetch(shard_id, stripe_index)
+        returns the stored blob or None, e.g.
+            fetch=lambda sid, stripe: router.retrieve_shard(ShardEngine.stripe_key(sid, stripe), backend)
+        Only min_shards blobs of one stripe are held at a time and they are sliced
+        through memoryviews, so memory stays O(stripe size). Returns bytes written.
+        """
+        if not self._verify_permission_onchain(tx_id, requestor):
+            self.logger.error(f"Permission denied for {requestor} to reassemble tx {tx_id}")
             return None
 
+        entries = sorted(keys_metadata.items(), key=lambda kv: kv[1]['index'])
+        meta = entries[0][1]
+        codec = self._codec(meta)
+        stripe_size, data_length = meta['stripe_size'], meta['data_length']
+        keys = {shard_id: urlsafe_b64decode(m['key']) for shard_id, m in entries}
+        bad = set()  # shards that failed once are not fetched again
+        decompressor = zlib.decompressobj()
+        written = 0
+
+        for stripe_index in range(meta['stripe_count']):
+            aad = stripe_index.to_bytes(8, 'big')
+            chunks = {}
+            for shard_id, m in entries:
+                if shard_id in bad:
+                    continue
+                blob = fetch(shard_id, stripe_index)
+                view = memoryview(blob) if blob is not None else None
+                if view is None or not self._verify_hmac(keys[shard_id], view[:-32], bytes(view[-32:]), aad):
+                    self.logger.warning(f"Stripe {stripe_index} of shard {shard_id} missing or corrupt")
+                    bad.add(shard_id)
+                    continue
+                chunks[m['index']] = self._decrypt_shard(view, keys[shard_id], view[:16])
+                if len(chunks) == codec.data_shards:
+                    break
+            if len(chunks) < codec.data_shards:
+                self.logger.error(f"Stripe {stripe_index} of tx {tx_id} has only {len(chunks)} valid shards")
+                return None
+            stripe_length = min(stripe_size, data_length - stripe_index * stripe_size)
+            try:
+                piece = decompressor.decompress(codec.decode(chunks, stripe_length))
+            except zlib.error as e:
+                self.logger.error(f"Failed to decompress stripe {stripe_index} of tx {tx_id}: {e}")
+                return None
+            out.write(piece)
+            written += len(piece)
+        tail = decompressor.flush()
+        out.write(tail)
+        written += len(tail)
+        self.logger.info(f"Successfully reassembled {written} bytes for transaction {tx_id}")
+        return written
+
     def _decrypt_shard(self, encrypted: bytes, key: bytes, iv: bytes) -> bytes:
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=self.backend)
+        cipher = Cipher(algorithms.AES(key), modes.CBC(bytes(iv)), backend=self.backend)
         decryptor = cipher.decryptor()
-        padded = decryptor.update(encrypted[16:-32]) + decryptor.finalize()
+        # memoryview slice: the ciphertext is not copied out of the shard buffer
+        padded = decryptor.update(memoryview(encrypted)[16:-32]) + decryptor.finalize()
         unpadder = padding.PKCS7(128).unpadder()
         return unpadder.update(padded) + unpadder.finalize()
 
-    def _verify_hmac(self, key: bytes, data: bytes, expected_hmac: bytes) -> bool:
+    def _verify_hmac(self, key: bytes, data: bytes, expected_hmac: bytes, aad: bytes = b'') -> bool:
         h = hmac.HMAC(key, hashes.SHA256(), backend=self.backend)
+        if aad:
+            h.update(aad)
         h.update(data)
         try:
             h.verify(expected_hmac)
@@ -74,18 +156,24 @@ class Reassembler:
         except Exception:
             return False
 
-    def _combine_chunks(self, chunks: List[bytes]) -> bytes:
-        # Remove parity (last chunk), join the rest
-        if len(chunks) > self.min_shards:
-            chunks = chunks[:self.min_shards]
-        return b''.join(chunks)
+    def _combine_chunks(self, chunks: Dict[int, bytes], meta: Dict) -> bytes:
+        """Reed-Solomon decode from shard index -> plaintext chunk"""
+        return self._codec(meta).decode(chunks, meta.get('data_length'))
+
+    def _codec(self, meta: Dict) -> ReedSolomonCodec:
+        data_shards = meta.get('data_shards', self.min_shards)
+        total_shards = meta.get('total_shards', data_shards)
+        codec = self._codecs.get((data_shards, total_shards))
+        if codec is None:
+            codec = self._codecs[(data_shards, total_shards)] = ReedSolomonCodec(data_shards, total_shards)
+        return codec
+
+    def verify_permissions(self, pairs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], bool]:
+        """Batch-check (tx_id, requestor) pairs in one multicall; later reassemble() calls hit the cache"""
+        return self.permissions.verify_many(pairs)
 
     def _verify_permission_onchain(self, tx_id: str, requestor: str) -> bool:
-        try:
-            return self.blockchain.call_function("verifyRecombinationPermission", tx_id, requestor)
-        except Exception as e:
-            self.logger.error(f"Blockchain permission check failed: {e}")
-            return False
+        return self.permissions.verify(tx_id, requestor)
 
 if __name__ == "__main__":
     # Example usage with mock data
@@ -3,29 +3,70 @@ import json
 import uuid
 import hashlib
 import zlib
-from typing import Dict, List, Tuple
+import time
+import threading
+from itertools import islice
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Optional, Iterable, Iterator, Callable, Union, BinaryIO
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives import padding, hashes, hmac
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF, HKDFExpand
 from base64 import urlsafe_b64encode, urlsafe_b64decode
+from utils.erasure_coding import ReedSolomonCodec
+from utils.logger import StructuredLogger
+
+# Per-process state for shard_many workers
+_worker_engine = None
+_worker_args = None
+
+
+def _init_shard_worker(engine_params: Dict, master_key: Optional[bytes], salt: Optional[bytes]):
+    global _worker_engine, _worker_args
+    _worker_engine = ShardEngine(**engine_params)
+    _worker_args = (master_key, salt)
+
+
+def _shard_chunk(records: List[Dict]) -> List[Tuple[List[bytes], Dict]]:
+    master_key, salt = _worker_args
+    return [_worker_engine.shard_data(record, master_key, salt) for record in records]
 
 class ShardEngine:
-    def __init__(self, shard_count: int = 3, min_shards: int = 2):
+    KEY_MODES = ('record', 'per_shard')
+
+    def __init__(self, shard_count: int = 3, min_shards: int = 2, key_mode: str = 'record',
+                 kdf_iterations: int = 100000, key_cache_size: int = 0):
         """
         Advanced data sharding engine with erasure coding and authenticated encryption
         Args:
             shard_count: Total number of shards to create
             min_shards: Minimum shards required for reconstruction
+            key_mode: 'record' stretches the master key once per record (PBKDF2) and expands
+                per-shard subkeys with HKDF; 'per_shard' runs PBKDF2 for every shard
+            kdf_iterations: PBKDF2-SHA512 iterations for the master key stretch
+            key_cache_size: Max stretched master keys cached by salt (0 disables the cache)
         """
+        if key_mode not in self.KEY_MODES:
+            raise ValueError(f"key_mode must be one of {self.KEY_MODES}")
         self.shard_count = shard_count
         self.min_shards = min_shards
+        self.key_mode = key_mode
+        self.kdf_iterations = kdf_iterations
+        self.key_cache_size = key_cache_size
+        self.key_cache = OrderedDict()
+        self.key_cache_lock = threading.Lock()
+        self.key_cache_stats = {'hits': 0, 'misses': 0}
         self.backend = default_backend()
+        self.logger = StructuredLogger(name="ShardEngine")
+        self.pipeline_stats = {'records': 0, 'seconds': 0.0, 'records_per_sec': 0.0}
         
         if min_shards > shard_count:
             raise ValueError("min_shards cannot exceed total shard_count")
+        self.codec = ReedSolomonCodec(min_shards, shard_count)
 
-    def shard_data(self, data: Dict, master_key: bytes = None) -> Tuple[List[bytes], Dict]:
+    def shard_data(self, data: Dict, master_key: bytes = None, salt: bytes = None) -> Tuple[List[bytes], Dict]:
         """
         Processes data through full sharding pipeline:
         1. Serialization
@@ -33,6 +74,9 @@ class ShardEngine:
         3. Erasure coding
         4. Shard encryption
         5. Metadata generation
+
+        In 'record' key mode a caller-supplied salt (e.g. per tenant or key epoch) lets the
+        stretched master key come from the cache; each record still gets unique subkeys.
         """
         # Phase 1: Data Preparation
         serialized = self._serialize_data(data)
@@ -40,7 +84,14 @@ class ShardEngine:
         
         # Phase 2: Cryptographic Sharding
         shards = self._erasure_code_data(compressed)
-        encrypted_shards, keys_metadata = self._encrypt_shards(shards, master_key)
+        encrypted_shards, keys_metadata = self._encrypt_shards(shards, master_key, salt)
+        for meta in keys_metadata.values():
+            # Each shard carries what the decoder needs, so any min_shards of them suffice
+            meta.update({
+                'data_length': len(compressed),
+                'data_shards': self.min_shards,
+                'total_shards': self.shard_count
+            })
         
         # Phase 3: Integrity Protection
         merkle_tree = self._generate_merkle_tree(encrypted_shards)
@@ -50,6 +101,178 @@ class ShardEngine:
             'shard_map': self._generate_shard_map(encrypted_shards)
         }
 
+    def shard_many(self, records: Iterable[Dict], master_key: bytes = None, salt: bytes = None,
+                   workers: Optional[int] = None, chunk_size: int = 64, max_in_flight: Optional[int] = None,
+                   report_every: float = 10.0) -> Iterator[Tuple[List[bytes], Dict]]:
+        """
+        Streaming batch version of shard_data for large backlogs.
+        Records are sent to a process pool in chunks; at most max_in_flight chunks
+        (default 2 per worker) are outstanding, so memory stays bounded however long
+        the input is. Results are yielded in input order. Throughput is logged every
+        report_every seconds and kept in pipeline_stats.
+        """
+        workers = workers or os.cpu_count() or 1
+        max_in_flight = max_in_flight or workers * 2
+        engine_params = {
+            'shard_count': self.shard_count,
+            'min_shards': self.min_shards,
+            'key_mode': self.key_mode,
+            'kdf_iterations': self.kdf_iterations,
+            'key_cache_size': self.key_cache_size
+        }
+        records = iter(records)
+        done = 0
+        start = last_report = time.time()
+
+        def progress(n: int):
+            nonlocal done, last_report
+            done += n
+            now = time.time()
+            elapsed = now - start
+            self.pipeline_stats = {
+                'records': done,
+                'seconds': round(elapsed, 3),
+                'records_per_sec': round(done / elapsed, 1) if elapsed > 0 else 0.0
+            }
+            if report_every and now - last_report >= report_every:
+                last_report = now
+                self.logger.info(f"shard_many: {done} records, {self.pipeline_stats['records_per_sec']} records/s")
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_shard_worker,
+                                 initargs=(engine_params, master_key, salt)) as executor:
+            pending = deque()
+            while True:
+                chunk = list(islice(records, chunk_size))
+                if chunk:
+                    pending.append(executor.submit(_shard_chunk, chunk))
+                if pending and (len(pending) >= max_in_flight or not chunk):
+                    results = pending.popleft().result()
+                    progress(len(results))
+                    yield from results
+                elif not chunk:
+                    break
+
+        self.logger.info(f"shard_many finished: {done} records in {self.pipeline_stats['seconds']}s "
+                         f"({self.pipeline_stats['records_per_sec']} records/s)")
+
+    def shard_stream(self, source: Union[Dict, bytes, BinaryIO, Iterable[bytes]],
+                     sink: Callable[[str, int, int, bytes], None], master_key: bytes = None,
+                     salt: bytes = None, stripe_size: int = 4 * 1024 * 1024) -> Dict:
+        """
+        Chunked mode for large payloads (e.g. KYC document bundles).
+        The payload is compressed incrementally and cut into stripes of stripe_size
+        compressed bytes; each stripe is erasure-coded, encrypted and handed to
+        sink(shard_id, shard_index, stripe_index, blob) before the next one is read,
+        so peak memory is O(stripe_size) rather than O(payload). A sink usually
+        writes straight to storage, e.g.
+            sink=lambda sid, idx, stripe, blob: router.store_shard(
+                ShardEngine.stripe_key(sid, stripe), blob, backends[idx])
+        Each blob is iv + ciphertext + HMAC, with the stripe index bound into the HMAC.
+        Returns the same metadata layout as shard_data, with per-shard stripe info.
+        """
+        n = self.shard_count
+        if master_key and self.key_mode == 'record':
+            keys, record_salt, nonce = self._derive_shard_keys(master_key, n, salt)
+            salts = [record_salt] * n
+        elif master_key:
+            salts = [os.urandom(16) for _ in range(n)]
+            keys = [self._stretch_master_key(master_key, s) for s in salts]
+            nonce = None
+        else:
+            keys = [os.urandom(32) for _ in range(n)]
+            salts, nonce = [None] * n, None
+        shard_ids = [f"shard_{uuid.uuid4().hex}" for _ in range(n)]
+        digests = [hashlib.sha3_256() for _ in range(n)]
+
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS)
+        pending = bytearray()
+        stripe_index = 0
+        data_length = 0
+
+        def emit(stripe: memoryview):
+            nonlocal stripe_index
+            for idx, shard in enumerate(self.codec.encode(stripe)):
+                blob = self._encrypt_stripe(keys[idx], shard, stripe_index)
+                digests[idx].update(blob)
+                sink(shard_ids[idx], idx, stripe_index, blob)
+            stripe_index += 1
+
+        for piece in self._iter_source(source):
+            pending += compressor.compress(piece)
+            while len(pending) >= stripe_size:
+                emit(memoryview(pending)[:stripe_size])
+                del pending[:stripe_size]
+                data_length += stripe_size
+        pending += compressor.flush()
+        while pending:
+            take = min(stripe_size, len(pending))
+            emit(memoryview(pending)[:take])
+            del pending[:take]
+            data_length += take
+
+        keys_metadata = {}
+        for idx, shard_id in enumerate(shard_ids):
+            keys_metadata[shard_id] = {
+                'key': urlsafe_b64encode(keys[idx]).decode(),
+                'iv': None,
+                'hmac': None,
+                'salt': urlsafe_b64encode(salts[idx]).decode() if salts[idx] else None,
+                'index': idx,
+                'data_length': data_length,
+                'data_shards': self.min_shards,
+                'total_shards': n,
+                'stripe_size': stripe_size,
+                'stripe_count': stripe_index
+            }
+            if nonce:
+                keys_metadata[shard_id].update({
+                    'kdf': 'pbkdf2-sha512+hkdf-sha256',
+                    'nonce': urlsafe_b64encode(nonce).decode()
+                })
+        column_digests = [d.digest() for d in digests]
+        merkle_tree = self._generate_merkle_tree(column_digests)
+        return {
+            'merkle_root': merkle_tree[-1],
+            'shard_keys': keys_metadata,
+            'shard_map': {
+                'shard_ids': [d.hex() for d in column_digests],
+                'merkle_indices': list(range(n))
+            }
+        }
+
+    @staticmethod
+    def stripe_key(shard_id: str, stripe_index: int) -> str:
+        """Storage key of one stripe of a streamed shard"""
+        return f"{shard_id}.{stripe_index:08d}"
+
+    def _iter_source(self, source, read_size: int = 1024 * 1024) -> Iterator[bytes]:
+        if isinstance(source, dict):
+            # iterencode streams the JSON text, so the serialized payload is never materialized
+            encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+            for piece in encoder.iterencode(source):
+                yield piece.encode('utf-8')
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            view = memoryview(source)
+            for i in range(0, len(view), read_size):
+                yield view[i:i + read_size]
+        elif hasattr(source, 'read'):
+            while True:
+                piece = source.read(read_size)
+                if not piece:
+                    break
+                yield piece
+        else:
+            yield from source
+
+    def _encrypt_stripe(self, key: bytes, data: bytes, stripe_index: int) -> bytes:
+        """AES-256-CBC one stripe of one shard; the HMAC also covers the stripe index"""
+        iv = os.urandom(16)
+        encryptor = Cipher(algorithms.AES(key), modes.CBC(iv), backend=self.backend).encryptor()
+        padder = padding.PKCS7(128).padder()
+        encrypted = encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize()
+        tag = self._generate_hmac(key, stripe_index.to_bytes(8, 'big') + iv + encrypted)
+        return iv + encrypted + tag
+
     def _serialize_data(self, data: Dict) -> bytes:
         """Safe JSON serialization with sorted keys"""
         return json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
@@ -61,38 +284,78 @@ class ShardEngine:
         return compressed
 
     def _erasure_code_data(self, data: bytes) -> List[bytes]:
-        """Reed-Solomon inspired erasure coding with parity shards"""
-        chunk_size = (len(data) + self.min_shards - 1) // self.min_shards
-        chunks = [data[i*chunk_size:(i+1)*chunk_size] for i in range(self.min_shards)]
-        
-        # Pad last chunk if needed
-        chunks[-1] = chunks[-1].ljust(chunk_size, b'\0')
-        
-        # Generate parity shards
-        parity_shards = []
-        for i in range(self.shard_count - self.min_shards):
-            parity = bytes([sum(chunk[j] for chunk in chunks) % 256 for j in range(chunk_size)])
-            parity_shards.append(parity)
-        
-        return chunks + parity_shards
+        """Systematic Reed-Solomon over GF(2^8): min_shards data stripes plus independent parity"""
+        return self.codec.encode(data)
+
+    def _stretch_master_key(self, master_key: bytes, salt: bytes) -> bytes:
+        """PBKDF2-SHA512 stretch of the master key, optionally served from the bounded cache"""
+        cache_key = (salt, hashlib.sha256(master_key).digest()) if self.key_cache_size else None
+        if cache_key:
+            with self.key_cache_lock:
+                stretched = self.key_cache.get(cache_key)
+                if stretched is not None:
+                    self.key_cache.move_to_end(cache_key)
+                    self.key_cache_stats['hits'] += 1
+                    return stretched
+                self.key_cache_stats['misses'] += 1
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA512(),
+            length=32,
+            salt=salt,
+            iterations=self.kdf_iterations,
+            backend=self.backend
+        )
+        stretched = kdf.derive(master_key)
+        if cache_key:
+            with self.key_cache_lock:
+                self.key_cache[cache_key] = stretched
+                while len(self.key_cache) > self.key_cache_size:
+                    self.key_cache.popitem(last=False)
+        return stretched
+
+    def _derive_shard_keys(self, master_key: bytes, count: int, salt: bytes = None) -> Tuple[List[bytes], bytes, bytes]:
+        """One master-key stretch per record, then HKDF subkeys per shard. Returns (keys, salt, nonce)."""
+        salt = salt or os.urandom(16)
+        nonce = os.urandom(16)
+        record_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=nonce,
+            info=b'splitmesh-record',
+            backend=self.backend
+        ).derive(self._stretch_master_key(master_key, salt))
+        keys = [
+            HKDFExpand(
+                algorithm=hashes.SHA256(),
+                length=32,
+                info=b'splitmesh-shard:' + str(idx).encode(),
+                backend=self.backend
+            ).derive(record_key)
+            for idx in range(count)
+        ]
+        return keys, salt, nonce
+
+    def get_key_cache_stats(self) -> Dict:
+        with self.key_cache_lock:
+            return {**self.key_cache_stats, 'size': len(self.key_cache), 'max_size': self.key_cache_size}
 
-    def _encrypt_shards(self, shards: List[bytes], master_key: bytes = None) -> Tuple[List[bytes], Dict]:
+    def _encrypt_shards(self, shards: List[bytes], master_key: bytes = None,
+                        salt: Optional[bytes] = None) -> Tuple[List[bytes], Dict]:
         """Encrypts each shard with unique key derived from master key"""
         keys_metadata = {}
         encrypted_shards = []
+        record_keys, record_salt, nonce = None, None, None
+        if master_key and self.key_mode == 'record':
+            record_keys, record_salt, nonce = self._derive_shard_keys(master_key, len(shards), salt)
         
         for idx, shard in enumerate(shards):
             # Key derivation
-            if master_key:
+            if record_keys:
+                key = record_keys[idx]
+                salt = record_salt
+            elif master_key:
                 salt = os.urandom(16)
-                kdf = PBKDF2HMAC(
-                    algorithm=hashes.SHA512(),
-                    length=32,
-                    salt=salt,
-                    iterations=100000,
-                    backend=self.backend
-                )
-                key = kdf.derive(master_key)
+                key = self._stretch_master_key(master_key, salt)
             else:
                 key = os.urandom(32)
                 salt = None
@@ -121,6 +384,11 @@ class ShardEngine:
                 'salt': urlsafe_b64encode(salt).decode() if salt else None,
                 'index': idx
             }
+            if record_keys:
+                keys_metadata[shard_id].update({
+                    'kdf': 'pbkdf2-sha512+hkdf-sha256',
+                    'nonce': urlsafe_b64encode(nonce).decode()
+                })
             
             encrypted_shards.append(iv + encrypted + hmac)
         
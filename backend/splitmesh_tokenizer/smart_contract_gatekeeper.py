@@ -1,8 +1,9 @@
 import os
 import json
 from web3 import Web3
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Iterable
 from utils.logger import StructuredLogger
+from utils.permission_verifier import PermissionVerifier
 
 class SmartContractGatekeeper:
     def __init__(self, contract_config: Dict[str, Any]):
@@ -12,17 +13,17 @@ class SmartContractGatekeeper:
             abi = json.load(f)
         self.contract = self.w3.eth.contract(address=contract_config['contract_address'], abi=abi)
         self.account = self.w3.eth.account.from_key(contract_config['private_key'])
+        self.permissions = PermissionVerifier(self.w3, self.contract, call_from=self.account.address,
+                                              settings=contract_config.get('permissions'))
 
     def verify_recombination_permission(self, tx_id: str, accessor: str) -> bool:
-        try:
-            allowed = self.contract.functions.verifyRecombinationPermission(tx_id, accessor).call({
-                'from': self.account.address
-            })
-            self.logger.info(f"Permission check for {accessor} on tx {tx_id}: {allowed}")
-            return allowed
-        except Exception as e:
-            self.logger.error(f"Permission check failed: {e}")
-            return False
+        allowed = self.permissions.verify(tx_id, accessor)
+        self.logger.info(f"Permission check for {accessor} on tx {tx_id}: {allowed}")
+        return allowed
+
+    def verify_recombination_permissions(self, pairs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], bool]:
+        """Check many (tx_id, accessor) pairs with one multicall (cache misses only)"""
+        return self.permissions.verify_many(pairs)
 
     def log_recombination_event(self, tx_id: str, shard_ids: List[str], accessor: str) -> str:
         try:
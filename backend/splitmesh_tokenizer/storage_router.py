@@ -1,30 +1,147 @@
+import io
 import os
+import time
+import queue
+import threading
+import sqlite3
 import boto3
 import pymongo
 import psycopg2
+from psycopg2 import pool as pg_pool
 from psycopg2.extras import execute_values
-from typing import Dict, Any, List, Optional
-from utils.config import get_storage_config
+from botocore.config import Config as BotoConfig
+from boto3.s3.transfer import TransferConfig
+from contextlib import contextmanager
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, Any, List, Optional, Tuple
+from utils.config import config
 from utils.logger import StructuredLogger
 
+
+def get_storage_config() -> Dict[str, Any]:
+    return config['splitmesh']['storage']
+
+
+class PostgresShardPool:
+    """Thread-safe Postgres connection pool for the data_shards table"""
+    placeholder = '%s'
+    now_sql = 'NOW()'
+
+    def __init__(self, pg_config: Dict[str, Any], min_conn: int = 1, max_conn: int = 10):
+        self.pool = pg_pool.ThreadedConnectionPool(
+            min_conn, max_conn,
+            host=pg_config['host'],
+            user=pg_config['user'],
+            password=pg_config['password'],
+            dbname=pg_config['database']
+        )
+
+    @contextmanager
+    def connection(self):
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def upsert_many(self, cur, rows: List[Tuple[str, bytes]]):
+        """Multi-row upsert in one statement per page"""
+        execute_values(cur, """
+            INSERT INTO data_shards (shard_id, data, created_at)
+            VALUES %s
+            ON CONFLICT (shard_id) DO UPDATE SET data = EXCLUDED.data, created_at = NOW()
+        """, [(sid, psycopg2.Binary(data)) for sid, data in rows], template="(%s, %s, NOW())", page_size=1000)
+
+    def close(self):
+        self.pool.closeall()
+
+
+class SQLiteShardPool:
+    """Local stand-in for PostgresShardPool backed by SQLite (offline tests, dev)"""
+    placeholder = '?'
+    now_sql = 'CURRENT_TIMESTAMP'
+
+    def __init__(self, path: str = ':memory:', max_conn: int = 10):
+        # Shared-cache URI so every pooled connection sees the same in-memory database
+        self.uri = f"file:fortifi_shards_{id(self)}?mode=memory&cache=shared" if path == ':memory:' else f"file:{path}"
+        self.conns = queue.Queue()
+        self._keepalive = self._connect()
+        for _ in range(max_conn):
+            self.conns.put(self._connect())
+        self._keepalive.execute("""
+            CREATE TABLE IF NOT EXISTS data_shards (
+                shard_id TEXT PRIMARY KEY, data BLOB, created_at TIMESTAMP
+            )
+        """)
+        self._keepalive.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self.conns.get()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.conns.put(conn)
+
+    def upsert_many(self, cur, rows: List[Tuple[str, bytes]]):
+        cur.executemany("""
+            INSERT INTO data_shards (shard_id, data, created_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (shard_id) DO UPDATE SET data = excluded.data, created_at = CURRENT_TIMESTAMP
+        """, rows)
+
+    def close(self):
+        while not self.conns.empty():
+            self.conns.get_nowait().close()
+        self._keepalive.close()
+
+
 class StorageRouter:
-    def __init__(self):
-        config = get_storage_config()
+    def __init__(self, pg=None, mongo_db=None, s3=None, max_workers: Optional[int] = None):
+        """
+        Routes shards to Postgres, MongoDB and S3.
+        Args:
+            pg: Shard pool (PostgresShardPool or SQLiteShardPool); built from config if omitted
+            mongo_db: pymongo (or mongomock) database; built from config if omitted
+            s3: boto3 S3 client (moto works); built from config if omitted
+            max_workers: Threads used for concurrent fan-out/fan-in
+        """
+        storage_config = get_storage_config()
+        pool_config = storage_config.get('pool', {})
         self.logger = StructuredLogger(name="StorageRouter")
-        self.pg_conn = self._init_postgres(config['postgres'])
-        self.mongo_db = self._init_mongodb(config['mongodb'])
-        self.s3 = self._init_s3(config['s3'])
+        self.pool_size = int(pool_config.get('size', os.getenv('STORAGE_POOL_SIZE', 10)))
+        self.pg = pg or self._init_postgres(storage_config['postgres'])
+        self.mongo_db = mongo_db if mongo_db is not None else self._init_mongodb(storage_config['mongodb'])
+        self.s3 = s3 or self._init_s3(storage_config['s3'])
+        self.bucket = os.getenv('S3_BUCKET', 'fortifi-shards')
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or self.pool_size * 3,
+            thread_name_prefix='ShardIO'
+        )
+        # Separate pool for bulk S3 puts: bulk flushes run on self.executor and wait on these
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=max_workers or self.pool_size * 3,
+            thread_name_prefix='ShardUpload'
+        )
 
     def _init_postgres(self, pg_config: Dict[str, Any]):
         try:
-            conn = psycopg2.connect(
-                host=pg_config['host'],
-                user=pg_config['user'],
-                password=pg_config['password'],
-                dbname=pg_config['database']
-            )
+            pool = PostgresShardPool(pg_config, max_conn=self.pool_size)
             self.logger.info("Connected to PostgreSQL")
-            return conn
+            return pool
         except Exception as e:
             self.logger.error(f"Failed to connect to PostgreSQL: {e}")
             raise
@@ -35,7 +152,8 @@ class StorageRouter:
                 host=mongo_config['host'],
                 username=mongo_config['username'],
                 password=mongo_config['password'],
-                authSource=mongo_config.get('authSource', 'admin')
+                authSource=mongo_config.get('authSource', 'admin'),
+                maxPoolSize=self.pool_size
             )
             db = client.get_database()
             self.logger.info("Connected to MongoDB")
@@ -50,7 +168,8 @@ class StorageRouter:
                 's3',
                 aws_access_key_id=s3_config['aws_access_key_id'],
                 aws_secret_access_key=s3_config['aws_secret_access_key'],
-                region_name=s3_config.get('region_name', 'ap-south-1')
+                region_name=s3_config.get('region_name', 'ap-south-1'),
+                config=BotoConfig(max_pool_connections=self.pool_size)
             )
             self.logger.info("Connected to S3")
             return s3
@@ -73,27 +192,48 @@ class StorageRouter:
             self.logger.error(f"Storage failed for {shard_id} in {storage_type}: {e}")
             raise
 
+    def store_shards(self, shards: List[Tuple[str, bytes, str]], timeout: Optional[float] = None) -> Dict[str, bool]:
+        """
+        Write (shard_id, data, storage_type) entries to all backends in parallel.
+        Returns per-shard success; latency is the slowest backend, not the sum.
+        """
+        futures = {
+            self.executor.submit(self.store_shard, shard_id, data, storage_type): shard_id
+            for shard_id, data, storage_type in shards
+        }
+        results = {shard_id: False for shard_id, _, _ in shards}
+        done, not_done = wait(futures, timeout=timeout)
+        for future in done:
+            results[futures[future]] = future.exception() is None
+        for future in not_done:
+            self.logger.error(f"Storage timed out for {futures[future]}")
+        return results
+
     def _pg_store(self, shard_id: str, data: bytes):
-        with self.pg_conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO data_shards (shard_id, data, created_at)
-                VALUES (%s, %s, NOW())
-                ON CONFLICT (shard_id) DO UPDATE SET data = EXCLUDED.data, created_at = NOW()
-            """, (shard_id, data))
-            self.pg_conn.commit()
+        p = self.pg.placeholder
+        with self.pg.connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(f"""
+                    INSERT INTO data_shards (shard_id, data, created_at)
+                    VALUES ({p}, {p}, {self.pg.now_sql})
+                    ON CONFLICT (shard_id) DO UPDATE SET data = EXCLUDED.data, created_at = {self.pg.now_sql}
+                """, (shard_id, data))
+                conn.commit()
+            finally:
+                cur.close()
 
     def _mongo_store(self, shard_id: str, data: bytes):
         coll = self.mongo_db.shards
         coll.replace_one(
             {'_id': shard_id},
-            {'_id': shard_id, 'data': data, 'created_at': pymongo.datetime.datetime.utcnow()},
+            {'_id': shard_id, 'data': data, 'created_at': datetime.utcnow()},
             upsert=True
         )
 
     def _s3_store(self, shard_id: str, data: bytes):
-        bucket = os.getenv('S3_BUCKET', 'fortifi-shards')
         self.s3.put_object(
-            Bucket=bucket,
+            Bucket=self.bucket,
             Key=shard_id,
             Body=data,
             Metadata={'shard_id': shard_id}
@@ -113,11 +253,44 @@ class StorageRouter:
             self.logger.error(f"Retrieval failed for {shard_id} in {storage_type}: {e}")
             return None
 
+    def retrieve_shards(self, locations: List[Tuple[str, str]], min_shards: Optional[int] = None,
+                        timeout: Optional[float] = None) -> Dict[str, bytes]:
+        """
+        Fetch (shard_id, storage_type) entries from all backends in parallel.
+        Returns as soon as min_shards reads have succeeded (all of them if None);
+        reads still in flight are cancelled or left to finish in the background.
+        """
+        target = len(locations) if min_shards is None else min(min_shards, len(locations))
+        futures = {
+            self.executor.submit(self.retrieve_shard, shard_id, storage_type): shard_id
+            for shard_id, storage_type in locations
+        }
+        results: Dict[str, bytes] = {}
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                data = future.result()
+                if data is not None:
+                    results[futures[future]] = data
+                    if len(results) >= target:
+                        break
+        except FutureTimeoutError:
+            self.logger.warning(f"Shard retrieval timed out with {len(results)}/{target} shards")
+        for future in futures:
+            future.cancel()
+        if len(results) < target:
+            self.logger.error(f"Only {len(results)} of {target} required shards retrieved")
+        return results
+
     def _pg_retrieve(self, shard_id: str) -> Optional[bytes]:
-        with self.pg_conn.cursor() as cur:
-            cur.execute("SELECT data FROM data_shards WHERE shard_id = %s", (shard_id,))
-            row = cur.fetchone()
-            return row[0] if row else None
+        with self.pg.connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(f"SELECT data FROM data_shards WHERE shard_id = {self.pg.placeholder}", (shard_id,))
+                row = cur.fetchone()
+                conn.commit()
+                return bytes(row[0]) if row else None
+            finally:
+                cur.close()
 
     def _mongo_retrieve(self, shard_id: str) -> Optional[bytes]:
         coll = self.mongo_db.shards
@@ -125,16 +298,198 @@ class StorageRouter:
         return doc['data'] if doc else None
 
     def _s3_retrieve(self, shard_id: str) -> Optional[bytes]:
-        bucket = os.getenv('S3_BUCKET', 'fortifi-shards')
         try:
-            obj = self.s3.get_object(Bucket=bucket, Key=shard_id)
+            obj = self.s3.get_object(Bucket=self.bucket, Key=shard_id)
             return obj['Body'].read()
         except Exception:
             return None
 
+    def bulk_writer(self, batch_size: int = 1000, flush_interval: float = 1.0,
+                    multipart_threshold: int = 8 * 1024 * 1024) -> 'BulkShardWriter':
+        """Buffered writer for bulk (re-)tokenization jobs; see BulkShardWriter."""
+        return BulkShardWriter(self, batch_size, flush_interval, multipart_threshold)
+
+    def _pg_store_many(self, rows: List[Tuple[str, bytes]]):
+        with self.pg.connection() as conn:
+            cur = conn.cursor()
+            try:
+                self.pg.upsert_many(cur, rows)
+                conn.commit()
+            finally:
+                cur.close()
+
+    def _mongo_store_many(self, rows: List[Tuple[str, bytes]]):
+        now = datetime.utcnow()
+        self.mongo_db.shards.bulk_write([
+            pymongo.ReplaceOne({'_id': sid}, {'_id': sid, 'data': data, 'created_at': now}, upsert=True)
+            for sid, data in rows
+        ], ordered=False)
+
+    def _s3_store_many(self, rows: List[Tuple[str, bytes]], multipart_threshold: int):
+        transfer_config = TransferConfig(multipart_threshold=multipart_threshold)
+
+        def put(sid: str, data: bytes):
+            if len(data) >= multipart_threshold:
+                self.s3.upload_fileobj(io.BytesIO(data), self.bucket, sid,
+                                       ExtraArgs={'Metadata': {'shard_id': sid}}, Config=transfer_config)
+            else:
+                self._s3_store(sid, data)
+
+        futures = [self.upload_executor.submit(put, sid, data) for sid, data in rows]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.upload_executor.shutdown(wait=True)
+        self.pg.close()
+
+
+class BulkShardWriter:
+    """
+    Buffers shards per backend and flushes them as one bulk operation:
+    a multi-row execute_values upsert in a single Postgres transaction, a
+    Mongo bulk_write, and parallel (multipart for large objects) S3 puts.
+    A buffer is flushed when it reaches batch_size or when its oldest entry
+    is older than flush_interval seconds.
+    """
+
+    BACKENDS = ('postgres', 'mongodb', 's3')
+
+    def __init__(self, router: StorageRouter, batch_size: int = 1000, flush_interval: float = 1.0,
+                 multipart_threshold: int = 8 * 1024 * 1024):
+        self.router = router
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.multipart_threshold = multipart_threshold
+        self.logger = router.logger
+        # dict per backend: a shard_id repeated within a batch keeps its latest data
+        self.buffers: Dict[str, Dict[str, bytes]] = {b: {} for b in self.BACKENDS}
+        self.buffer_started: Dict[str, Optional[float]] = {b: None for b in self.BACKENDS}
+        self.locks = {b: threading.Lock() for b in self.BACKENDS}
+        self.stats = {b: {'shards': 0, 'bytes': 0, 'flushes': 0, 'failed_flushes': 0, 'seconds': 0.0}
+                      for b in self.BACKENDS}
+        self.stats_lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.stop_event = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+    def add(self, shard_id: str, data: bytes, storage_type: str):
+        if storage_type not in self.buffers:
+            raise ValueError(f"Unknown storage type: {storage_type}")
+        with self.locks[storage_type]:
+            buffer = self.buffers[storage_type]
+            if not buffer:
+                self.buffer_started[storage_type] = time.monotonic()
+            buffer[shard_id] = data
+            full = len(buffer) >= self.batch_size
+        if full:
+            self.flush(storage_type)
+
+    def _take(self, backend: str) -> Tuple[List[Tuple[str, bytes]], Optional[float]]:
+        with self.locks[backend]:
+            rows = list(self.buffers[backend].items())
+            started = self.buffer_started[backend]
+            self.buffers[backend] = {}
+            self.buffer_started[backend] = None
+        return rows, started
+
+    def _restore(self, backend: str, rows: List[Tuple[str, bytes]], started: Optional[float]):
+        """Put rows from a failed flush back at the front; data added since the take wins per shard_id"""
+        with self.locks[backend]:
+            restored = dict(rows)
+            restored.update(self.buffers[backend])
+            self.buffers[backend] = restored
+            self.buffer_started[backend] = started  # restored rows are the oldest in the buffer
+
+    def flush(self, backend: Optional[str] = None):
+        """Flush one backend's buffer, or all of them concurrently."""
+        if backend is None:
+            futures = [self.router.executor.submit(self.flush, b) for b in self.BACKENDS]
+            for f in futures:
+                f.result()
+            return
+        rows, started = self._take(backend)
+        if not rows:
+            return
+        start = time.monotonic()
+        try:
+            if backend == 'postgres':
+                self.router._pg_store_many(rows)
+            elif backend == 'mongodb':
+                self.router._mongo_store_many(rows)
+            else:
+                self.router._s3_store_many(rows, self.multipart_threshold)
+        except Exception as e:
+            self._restore(backend, rows, started)
+            with self.stats_lock:
+                self.stats[backend]['failed_flushes'] += 1
+            self.logger.error(f"Bulk flush of {len(rows)} shards to {backend} failed, kept for retry: {e}")
+            raise
+        with self.stats_lock:
+            stats = self.stats[backend]
+            stats['shards'] += len(rows)
+            stats['bytes'] += sum(len(data) for _, data in rows)
+            stats['flushes'] += 1
+            stats['seconds'] += time.monotonic() - start
+
+    def _flush_loop(self):
+        while not self.stop_event.wait(min(self.flush_interval, 0.5)):
+            now = time.monotonic()
+            for backend in self.BACKENDS:
+                started = self.buffer_started[backend]
+                if started is not None and now - started >= self.flush_interval:
+                    try:
+                        self.flush(backend)
+                    except Exception:
+                        # Rows were put back into the buffer; the next tick retries them
+                        continue
+
+    def report(self) -> Dict[str, Any]:
+        """Throughput per backend: shards/s and MB/s over time spent flushing and over wall time."""
+        wall = time.monotonic() - self.started_at
+        report = {'wall_seconds': round(wall, 3), 'backends': {}}
+        for backend, s in self.stats.items():
+            report['backends'][backend] = {
+                **s,
+                'seconds': round(s['seconds'], 3),
+                'shards_per_sec': round(s['shards'] / s['seconds'], 1) if s['seconds'] else 0.0,
+                'mb_per_sec': round(s['bytes'] / s['seconds'] / 1e6, 2) if s['seconds'] else 0.0,
+                'avg_batch': round(s['shards'] / s['flushes'], 1) if s['flushes'] else 0.0
+            }
+        total = sum(s['shards'] for s in self.stats.values())
+        report['total_shards'] = total
+        report['wall_shards_per_sec'] = round(total / wall, 1) if wall else 0.0
+        return report
+
+    def close(self) -> Dict[str, Any]:
+        self.stop_event.set()
+        self.flusher.join(timeout=2)
+        self.flush()
+        report = self.report()
+        self.logger.info("Bulk shard writer closed", extra=report)
+        return report
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
 if __name__ == "__main__":
     router = StorageRouter()
     router.store_shard("test_shard_001", b"test_data", "mongodb")
     data = router.retrieve_shard("test_shard_001", "mongodb")
     print("Retrieved data:", data)
-#     router.store_shard("test_shard_001", b"test_data", "postgres")    
\ No newline at end of file
+    stored = router.store_shards([
+        ("test_shard_002", b"part_a", "postgres"),
+        ("test_shard_003", b"part_b", "mongodb"),
+        ("test_shard_004", b"part_c", "s3")
+    ])
+    print("Stored:", stored)
+    print("Fan-in:", router.retrieve_shards([(sid, st) for sid, st in [
+        ("test_shard_002", "postgres"), ("test_shard_003", "mongodb"), ("test_shard_004", "s3")
+    ]], min_shards=2))
+#     router.store_shard("test_shard_001", b"test_data", "postgres")
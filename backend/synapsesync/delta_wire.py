@@ -0,0 +1,173 @@
+import json
+import struct
+import numpy as np
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+MAGIC = b'FFDW'
+VERSION = 1
+ALIGN = 64
+# magic, version, flags, header length
+PREAMBLE = struct.Struct('<4sBBI')
+QUANT_MODES = (None, 'fp16', 'int8')
+NUMERIC_KINDS = 'biufc'
+# Default cap on elements per decoded tensor (1 GiB of float32); densifying allocates this much
+MAX_ELEMENTS = 1 << 28
+
+
+def _pad(n: int) -> int:
+    return (-n) % ALIGN
+
+
+def _quantize(values: np.ndarray, mode: Optional[str]) -> Tuple[np.ndarray, Optional[float]]:
+    if mode is None or values.dtype.kind != 'f':
+        return values, None
+    if mode == 'fp16':
+        return values.astype('<f2'), None
+    if mode == 'int8':
+        peak = float(np.max(np.abs(values))) if values.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        return np.clip(np.rint(values / scale), -127, 127).astype('i1'), scale
+    raise ValueError(f"Unknown quantization mode: {mode}")
+
+
+def encode_delta(delta: Dict[str, np.ndarray], metadata: Dict[str, Any], quantize: Optional[str] = None,
+                 top_k: Optional[Union[int, float]] = None) -> List[memoryview]:
+    """
+    Encode named arrays into the versioned delta wire format.
+
+    Layout: preamble | JSON header (names, dtypes, shapes, offsets) | padding |
+    64-byte aligned raw buffers. Returns the pieces as a list of buffers, so
+    unquantized dense tensors go out without being copied. quantize is None,
+    'fp16' or 'int8' (symmetric, per tensor). top_k keeps only the largest-
+    magnitude entries of each tensor, either a count or a fraction in (0, 1].
+    """
+    if quantize not in QUANT_MODES:
+        raise ValueError(f"quantize must be one of {QUANT_MODES}")
+    entries, buffers = [], []
+    offset = 0
+
+    def add(array: np.ndarray) -> Dict[str, Any]:
+        nonlocal offset
+        array = np.ascontiguousarray(array)
+        if array.dtype.byteorder == '>':
+            array = array.astype(array.dtype.newbyteorder('<'))
+        buffers.append(memoryview(array.reshape(-1).view(np.uint8)))
+        pad = _pad(array.nbytes)
+        if pad:
+            buffers.append(memoryview(bytes(pad)))
+        desc = {'dtype': array.dtype.str, 'offset': offset, 'nbytes': array.nbytes}
+        offset += array.nbytes + pad
+        return desc
+
+    for name in sorted(delta):
+        array = np.asarray(delta[name])
+        entry = {'name': name, 'shape': list(array.shape), 'orig_dtype': array.dtype.str, 'quant': None}
+        flat = array.reshape(-1)
+        k = None
+        if top_k is not None and flat.size:
+            k = int(top_k) if top_k >= 1 else max(1, int(round(flat.size * top_k)))
+        if k is not None and k < flat.size:
+            indices = np.argpartition(np.abs(flat), flat.size - k)[flat.size - k:]
+            indices.sort()
+            indices = indices.astype('<u4' if flat.size <= np.iinfo(np.uint32).max else '<u8')
+            values, scale = _quantize(flat[indices], quantize)
+            entry.update({'encoding': 'sparse', 'indices': add(indices), 'values': add(values)})
+        else:
+            values, scale = _quantize(flat, quantize)
+            entry.update({'encoding': 'dense', 'values': add(values)})
+        if values.dtype != flat.dtype:
+            entry.update({'quant': quantize, 'scale': scale})
+        entries.append(entry)
+
+    header = json.dumps({'metadata': metadata, 'tensors': entries}, separators=(',', ':'), default=str).encode('utf-8')
+    preamble = PREAMBLE.pack(MAGIC, VERSION, 0, len(header))
+    head = preamble + header + bytes(_pad(len(preamble) + len(header)))
+    return [memoryview(head)] + buffers
+
+
+def encoded_size(pieces: List[memoryview]) -> int:
+    return sum(p.nbytes for p in pieces)
+
+
+def _element_count(shape: Any, max_elements: int) -> int:
+    if not isinstance(shape, list) or not all(isinstance(d, int) and not isinstance(d, bool) and d >= 0
+                                               for d in shape):
+        raise ValueError(f"Invalid tensor shape {shape!r}")
+    count = 1
+    for dim in shape:
+        count *= dim  # Python ints, so a hostile shape cannot overflow the check
+    if count > max_elements:
+        raise ValueError(f"Tensor of {count} elements exceeds the {max_elements} element limit")
+    return count
+
+
+def decode_delta(buf, dequantize: bool = True, densify: bool = True,
+                 max_elements: int = MAX_ELEMENTS) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Decode a delta from any bytes-like object. Dense unquantized tensors are
+    read-only np.frombuffer views into buf (no copy). Quantized tensors are
+    widened back to their original dtype when dequantize is set. Sparse tensors
+    are scattered into dense arrays when densify is set; otherwise they come
+    back as {'indices', 'values', 'shape'} dicts.
+
+    Payloads come from peers and are untrusted: every tensor's shape must hold
+    at most max_elements, buffer lengths must match the shape and dtype, and
+    sparse indices must be in range, before anything is allocated. Violations
+    raise ValueError.
+    """
+    view = memoryview(buf).cast('B')
+    magic, version, _, header_len = PREAMBLE.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a delta wire payload")
+    if version != VERSION:
+        raise ValueError(f"Unsupported delta wire version {version}")
+    header_end = PREAMBLE.size + header_len
+    header = json.loads(bytes(view[PREAMBLE.size:header_end]).decode('utf-8'))
+    base = header_end + _pad(header_end)
+
+    def read(desc: Dict[str, Any]) -> np.ndarray:
+        dtype = np.dtype(desc['dtype'])
+        if dtype.kind not in NUMERIC_KINDS:
+            raise ValueError(f"Refusing non-numeric dtype {dtype}")
+        offset, nbytes = desc['offset'], desc['nbytes']
+        if not (isinstance(offset, int) and isinstance(nbytes, int) and offset >= 0 and nbytes >= 0):
+            raise ValueError("Invalid buffer descriptor")
+        if nbytes % dtype.itemsize:
+            raise ValueError(f"Buffer of {nbytes} bytes is not a whole number of {dtype} items")
+        start = base + offset
+        if start + nbytes > view.nbytes:
+            raise ValueError("Truncated delta payload")
+        return np.frombuffer(view, dtype=dtype, count=nbytes // dtype.itemsize, offset=start)
+
+    tensors: Dict[str, Any] = {}
+    for entry in header['tensors']:
+        size = _element_count(entry['shape'], max_elements)
+        shape = tuple(entry['shape'])
+        orig_dtype = np.dtype(entry['orig_dtype'])
+        if orig_dtype.kind not in NUMERIC_KINDS:
+            raise ValueError(f"Refusing non-numeric dtype {orig_dtype}")
+        values = read(entry['values'])
+        if entry['encoding'] == 'dense':
+            if values.size != size:
+                raise ValueError(f"Tensor {entry['name']!r} has {values.size} values for shape {shape}")
+        elif entry['encoding'] == 'sparse':
+            indices = read(entry['indices'])
+            if indices.dtype.kind not in 'iu' or indices.size != values.size or values.size > size:
+                raise ValueError(f"Sparse tensor {entry['name']!r} has mismatched indices and values")
+            if indices.size and (indices.min() < 0 or indices.max() >= size):
+                raise ValueError(f"Sparse tensor {entry['name']!r} has indices outside [0, {size})")
+        else:
+            raise ValueError(f"Unknown tensor encoding {entry['encoding']!r}")
+        if dequantize and entry.get('quant'):
+            values = values.astype(orig_dtype)
+            if entry['quant'] == 'int8':
+                values *= orig_dtype.type(entry['scale'])
+        if entry['encoding'] == 'dense':
+            tensors[entry['name']] = values.reshape(shape)
+        elif densify:
+            dense = np.zeros(size, dtype=values.dtype)
+            dense[indices] = values
+            tensors[entry['name']] = dense.reshape(shape)
+        else:
+            tensors[entry['name']] = {'indices': indices, 'values': values, 'shape': shape}
+    return tensors, header['metadata']
@@ -2,23 +2,213 @@ import grpc
 import threading
 import time
 import torch
-import pickle
-from typing import Dict, Any, List
+import numpy as np
+from collections import deque
+from typing import Dict, Any, List, Optional, Union, Callable
 from concurrent import futures
-from utils.encryption import encrypt_payload, decrypt_payload
+from utils.config import config
+from utils.encryption import encrypt_stream, decrypt_stream
 from utils.logger import StructuredLogger
+from .delta_wire import encode_delta, decode_delta, MAX_ELEMENTS
 
 # Placeholder for generated gRPC code (use grpcio-tools to generate these)
 # import federated_pb2
 # import federated_pb2_grpc
 
+class PeerLink:
+    """Outbound queue and sender thread for one peer.
+
+    Deltas are additive, so when a peer lags (several deltas pending, or the
+    queue is full) they are summed into one aggregated delta instead of being
+    sent one by one or dropped. Failed sends are retried with exponential
+    backoff; anything queued meanwhile is folded into the retry.
+
+    Deltas whose metadata carries something the receiver verifies against the
+    arrays (VERIFIED_KEYS, e.g. the integrity ``proof``) are never coalesced:
+    a sum would no longer match the proof, so they are always sent alone and
+    in order. Only unverified deltas are summed; under backpressure one may be
+    folded into an earlier unverified delta, ahead of verified ones queued in
+    between. If the queue is full of verified deltas, new ones are dropped
+    and counted.
+    """
+
+    VERIFIED_KEYS = ('proof', 'signature')
+
+    def __init__(self, peer: str, send: Callable[[str, bytes], None],
+                 encode: Callable[[Dict[str, np.ndarray], Dict[str, Any]], bytes], logger: StructuredLogger,
+                 max_queue: int = 16, max_retries: int = 5, backoff_base: float = 0.5, backoff_max: float = 30.0):
+        self.peer = peer
+        self.send = send
+        self.encode = encode
+        self.logger = logger
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pending = deque()  # items: {'arrays', 'metadata', 'payload', 'count', 'enqueued_at'}
+        self.cond = threading.Condition()
+        self.in_flight = False
+        self.stats = {'enqueued': 0, 'sent': 0, 'deltas_sent': 0, 'coalesced': 0, 'retries': 0,
+                      'failed': 0, 'dropped': 0, 'bytes_sent': 0, 'last_send_latency': None, 'last_success_at': None}
+        self.started_at = time.time()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"Peer-{peer}", daemon=True)
+        self.thread.start()
+
+    def enqueue(self, arrays: Dict[str, np.ndarray], metadata: Dict[str, Any], payload: bytes):
+        item = {'arrays': arrays, 'metadata': metadata, 'payload': payload, 'count': 1, 'enqueued_at': time.time()}
+        with self.cond:
+            self.stats['enqueued'] += 1
+            if len(self.pending) >= self.max_queue and not self._make_room(item):
+                self.stats['dropped'] += 1
+                self.logger.error(f"Queue full for {self.peer}; dropping a delta that cannot be coalesced")
+                return
+            if len(self.pending) < self.max_queue:
+                self.pending.append(item)
+            self.cond.notify()
+
+    def _make_room(self, item: Dict[str, Any]) -> bool:
+        """Backpressure on a full queue: fold unverified deltas together rather than block or drop; caller holds cond."""
+        unverified = [i for i, queued in enumerate(self.pending) if self._coalescible(queued)]
+        if self._coalescible(item) and unverified:
+            self.pending[unverified[-1]] = self._merge([self.pending[unverified[-1]], item])
+            return True
+        for i, j in zip(unverified, unverified[1:]):
+            if j == i + 1:
+                self.pending[i] = self._merge([self.pending[i], self.pending[j]])
+                del self.pending[j]
+                return True
+        return False
+
+    def _coalescible(self, item: Dict[str, Any]) -> bool:
+        return not any(key in item['metadata'] for key in self.VERIFIED_KEYS)
+
+    def _pop_run(self, head: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Pop the leading pending deltas that may be summed with ``head``; caller holds cond."""
+        items = [head] if head is not None else [self.pending.popleft()]
+        if not self._coalescible(items[0]):
+            return items
+        while self.pending and self._coalescible(self.pending[0]):
+            items.append(self.pending.popleft())
+        return items
+
+    def _merge(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        if len(items) == 1:
+            return items[0]
+        arrays: Dict[str, np.ndarray] = {}
+        for item in items:
+            for k, v in item['arrays'].items():
+                arrays[k] = arrays[k] + v if k in arrays else np.array(v, copy=True)
+        self.stats['coalesced'] += len(items) - 1
+        parts = []
+        for item in items:
+            parts.extend(item['metadata'].get('coalesced', [item['metadata']]))
+        return {
+            'arrays': arrays,
+            'metadata': {'coalesced': parts, 'timestamp': time.time()},
+            'payload': None,
+            'count': sum(item['count'] for item in items),
+            'enqueued_at': items[0]['enqueued_at']
+        }
+
+    def _take(self) -> Optional[Dict[str, Any]]:
+        """The leading verified delta, or the leading run of unverified deltas coalesced into one."""
+        with self.cond:
+            while not self.pending and not self.stop_event.is_set():
+                self.cond.wait(timeout=0.5)
+            if not self.pending:
+                return None
+            self.in_flight = True
+            return self._merge(self._pop_run())
+
+    def _run(self):
+        while True:
+            item = self._take()
+            if item is None:
+                return
+            attempt = 0
+            while True:
+                if item['payload'] is None:
+                    item['payload'] = self.encode(item['arrays'], item['metadata'])
+                start = time.time()
+                try:
+                    self.send(self.peer, item['payload'])
+                except Exception as e:
+                    attempt += 1
+                    if attempt > self.max_retries or self.stop_event.is_set():
+                        with self.cond:
+                            self.stats['failed'] += item['count']
+                        self.logger.error(f"Dropping {item['count']} delta(s) for {self.peer} after {attempt} attempts: {e}")
+                        break
+                    with self.cond:
+                        self.stats['retries'] += 1
+                    self.stop_event.wait(min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+                    with self.cond:
+                        item = self._merge(self._pop_run(item))
+                    continue
+                now = time.time()
+                with self.cond:
+                    self.stats['sent'] += 1
+                    self.stats['deltas_sent'] += item['count']
+                    self.stats['bytes_sent'] += len(item['payload'])
+                    self.stats['last_send_latency'] = round(now - start, 4)
+                    self.stats['last_success_at'] = now
+                break
+            with self.cond:
+                self.in_flight = False
+                self.cond.notify_all()
+
+    def metrics(self) -> Dict[str, Any]:
+        now = time.time()
+        with self.cond:
+            stats = dict(self.stats)
+            stats['queue_depth'] = len(self.pending)
+            stats['lag_seconds'] = round(now - self.pending[0]['enqueued_at'], 3) if self.pending else 0.0
+        elapsed = max(now - self.started_at, 1e-9)
+        stats['deltas_per_sec'] = round(stats['deltas_sent'] / elapsed, 2)
+        stats['bytes_per_sec'] = round(stats['bytes_sent'] / elapsed, 1)
+        return stats
+
+    def idle(self) -> bool:
+        with self.cond:
+            return not self.pending and not self.in_flight
+
+    def close(self, timeout: float = 5.0):
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+
 class FederatedBroadcaster:
-    def __init__(self, node_id: str, peer_nodes: List[str], encryption_key: bytes):
+    def __init__(self, node_id: str, peer_nodes: List[str], encryption_key: bytes,
+                 quantize: Optional[str] = None, top_k: Optional[Union[int, float]] = None,
+                 transport: Optional[Callable[[str, str, bytes], None]] = None):
+        """
+        quantize ('fp16' / 'int8') and top_k (count or fraction) make deltas lossy
+        but much smaller; defaults come from config['federation'] and are off.
+        transport(peer, node_id, encrypted_delta) replaces the gRPC send, e.g. for
+        the in-process peer harness; it must raise on failure.
+        """
+        federation_config = config.get('federation', {})
         self.node_id = node_id
         self.peers = peer_nodes
         self.encryption_key = encryption_key
-        self.channels = self._init_grpc_channels()
+        self.quantize = quantize if quantize is not None else federation_config.get('delta_quantization')
+        self.top_k = top_k if top_k is not None else federation_config.get('delta_top_k')
         self.logger = StructuredLogger(name="FederatedBroadcaster")
+        self.transport = transport
+        self.channels = self._init_grpc_channels() if transport is None else {}
+        self.links = {
+            peer: PeerLink(
+                peer, self._send_to_peer, self._encode_encrypted, self.logger,
+                max_queue=federation_config.get('peer_queue_size', 16),
+                max_retries=federation_config.get('peer_max_retries', 5),
+                backoff_base=federation_config.get('peer_backoff_base', 0.5),
+                backoff_max=federation_config.get('peer_backoff_max', 30.0)
+            )
+            for peer in self.peers if peer != self.node_id
+        }
 
     def _init_grpc_channels(self) -> Dict[str, grpc.Channel]:
         channels = {}
@@ -29,23 +219,64 @@ class FederatedBroadcaster:
         return channels
 
     def broadcast_update(self, delta: Dict[str, torch.Tensor], metadata: Dict[str, Any]):
-        serialized = self._serialize_delta(delta, metadata)
-        encrypted = encrypt_payload(serialized, self.encryption_key)
-        for peer, channel in self.channels.items():
-            try:
-                # stub = federated_pb2_grpc.FederatedNodeStub(channel)
-                # response = stub.ReceiveDelta(federated_pb2.DeltaMessage(
-                #     node_id=self.node_id,
-                #     encrypted_delta=encrypted
-                # ), timeout=5)
-                # For demonstration, we just log the action
-                self.logger.info(f"Broadcasted encrypted delta to {peer}")
-            except Exception as e:
-                self.logger.error(f"Failed to broadcast to {peer}: {str(e)}")
-
-    def _serialize_delta(self, delta: Dict[str, torch.Tensor], metadata: Dict[str, Any]) -> bytes:
-        payload = {'delta': {k: v.cpu().numpy() for k, v in delta.items()}, 'metadata': metadata}
-        return pickle.dumps(payload)
+        """
+        Encode and encrypt once, then hand to every peer's queue; never waits on a peer.
+        Delta tensors must not be modified afterwards: lagging peers may sum them later.
+        """
+        arrays = {k: self._to_numpy(v) for k, v in delta.items()}
+        encrypted = self._encode_encrypted(arrays, metadata)
+        for link in self.links.values():
+            link.enqueue(arrays, metadata, encrypted)
+        self.logger.info(f"Queued encrypted delta ({len(encrypted)} bytes) for {len(self.links)} peers")
+
+    def _encode_encrypted(self, arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]) -> bytes:
+        pieces = self._serialize_delta(arrays, metadata)
+        # Frames are encrypted straight from the tensor buffers; only the ciphertext is joined
+        return b''.join(encrypt_stream(pieces, self.encryption_key))
+
+    def _send_to_peer(self, peer: str, encrypted: bytes):
+        if self.transport is not None:
+            self.transport(peer, self.node_id, encrypted)
+            return
+        channel = self.channels[peer]
+        # stub = federated_pb2_grpc.FederatedNodeStub(channel)
+        # response = stub.ReceiveDelta(federated_pb2.DeltaMessage(
+        #     node_id=self.node_id,
+        #     encrypted_delta=encrypted
+        # ), timeout=5)
+        # if not response.success: raise RuntimeError(f"{peer} rejected delta")
+        # For demonstration, we just log the action
+        self.logger.info(f"Broadcasted encrypted delta to {peer}")
+
+    def get_peer_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Per-peer queue depth, lag (age of the oldest pending delta), throughput and failures"""
+        return {peer: link.metrics() for peer, link in self.links.items()}
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if all(link.idle() for link in self.links.values()):
+                return True
+            time.sleep(0.01)
+        return False
+
+    def shutdown(self, timeout: float = 5.0):
+        self.flush(timeout)
+        for link in self.links.values():
+            link.close()
+
+    def _serialize_delta(self, delta: Dict[str, Any], metadata: Dict[str, Any]) -> List[memoryview]:
+        arrays = {k: self._to_numpy(v) for k, v in delta.items()}
+        if self.quantize or self.top_k:
+            metadata = {**metadata, 'wire_encoding': {'quantize': self.quantize, 'top_k': self.top_k}}
+        return encode_delta(arrays, metadata, quantize=self.quantize, top_k=self.top_k)
+
+    @staticmethod
+    def _to_numpy(value) -> np.ndarray:
+        # CPU tensors share memory with the returned array
+        if isinstance(value, torch.Tensor):
+            return value.detach().cpu().numpy()
+        return np.asarray(value)
 
     def start_server(self, handler):
         def serve():
@@ -64,20 +295,26 @@ class FederatedHandler:  # Would inherit from federated_pb2_grpc.FederatedNodeSe
     def __init__(self, encryption_key: bytes):
         self.encryption_key = encryption_key
         self.logger = StructuredLogger(name="FederatedHandler")
+        self.max_elements = config.get('federation', {}).get('max_delta_elements', MAX_ELEMENTS)
 
     def ReceiveDelta(self, request, context):
         try:
-            encrypted = request.encrypted_delta
-            payload = decrypt_payload(encrypted, self.encryption_key)
-            # Here, payload would be a dict with 'delta' and 'metadata'
-            self.logger.info(f"Received delta with metadata: {payload['metadata']}")
-            # Pass to model updater, e.g., ModelUpdater().apply_update(payload['delta'], payload['metadata'])
+            delta, metadata = self.decode(request.encrypted_delta)
+            self.logger.info(f"Received delta with metadata: {metadata}")
+            # Pass to model updater, e.g., ModelUpdater().apply_update(delta, metadata)
             # Return acknowledgment
             # return federated_pb2.Ack(success=True)
         except Exception as e:
             self.logger.error(f"Failed to process received delta: {str(e)}")
             # return federated_pb2.Ack(success=False)
 
+    def decode(self, encrypted: bytes):
+        """Decrypt and decode a delta; tensors are NumPy views into the decrypted buffer (no unpickling)"""
+        plaintext = bytearray()
+        for frame in decrypt_stream(encrypted, self.encryption_key):
+            plaintext += frame
+        return decode_delta(plaintext, max_elements=self.max_elements)
+
 if __name__ == "__main__":
     node_id = "bank1.fortifi.net"
     peers = ["bank2.fortifi.net", "bank3.fortifi.net"]
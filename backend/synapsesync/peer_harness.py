@@ -0,0 +1,104 @@
+import time
+import random
+import threading
+import numpy as np
+from typing import Dict, Any, Optional
+from .federated_broadcast import FederatedBroadcaster, FederatedHandler
+from utils.logger import StructuredLogger
+
+
+class LocalFederation:
+    """In-process federation of simulated bank nodes.
+
+    Every node gets a real FederatedBroadcaster whose transport delivers
+    straight into the other nodes' FederatedHandler.decode, with configurable
+    per-node latency, outages and random send failures. Each node keeps the
+    running sum of the deltas it has applied, so tests can check that all
+    nodes converge regardless of retries and coalescing.
+    """
+
+    def __init__(self, n_nodes: int, encryption_key: bytes, latency: float = 0.0,
+                 failure_rate: float = 0.0, seed: int = 0, **broadcaster_kwargs):
+        self.logger = StructuredLogger(name="LocalFederation")
+        self.node_ids = [f"node{i:03d}" for i in range(n_nodes)]
+        self.latency = {node: latency for node in self.node_ids}
+        self.down = set()
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.handlers = {node: FederatedHandler(encryption_key) for node in self.node_ids}
+        self.state: Dict[str, Dict[str, np.ndarray]] = {node: {} for node in self.node_ids}
+        self.received = {node: {'messages': 0, 'deltas': 0} for node in self.node_ids}
+        self.broadcasters = {
+            node: FederatedBroadcaster(node, self.node_ids, encryption_key, transport=self._deliver,
+                                       **broadcaster_kwargs)
+            for node in self.node_ids
+        }
+
+    def _deliver(self, peer: str, sender: str, encrypted: bytes):
+        if self.latency[peer]:
+            time.sleep(self.latency[peer])
+        with self.lock:
+            fail = peer in self.down or self.rng.random() < self.failure_rate
+        if fail:
+            raise ConnectionError(f"{peer} unreachable")
+        delta, metadata = self.handlers[peer].decode(encrypted)
+        with self.lock:
+            state = self.state[peer]
+            for k, v in delta.items():
+                state[k] = state[k] + v if k in state else np.array(v, copy=True)
+            self.received[peer]['messages'] += 1
+            self.received[peer]['deltas'] += len(metadata.get('coalesced', [metadata]))
+
+    def set_latency(self, node: str, seconds: float):
+        self.latency[node] = seconds
+
+    def set_down(self, node: str, down: bool = True):
+        with self.lock:
+            (self.down.add if down else self.down.discard)(node)
+
+    def broadcast(self, node: str, delta: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None):
+        """Broadcast from node and apply the delta locally, as SyncOrchestrator does."""
+        with self.lock:
+            state = self.state[node]
+            for k, v in delta.items():
+                v = np.asarray(v)
+                state[k] = state[k] + v if k in state else np.array(v, copy=True)
+        self.broadcasters[node].broadcast_update(delta, metadata or {'timestamp': time.time()})
+
+    def wait_idle(self, timeout: float = 30.0) -> bool:
+        deadline = time.time() + timeout
+        return all(b.flush(max(0.0, deadline - time.time())) for b in self.broadcasters.values())
+
+    def converged(self, rtol: float = 1e-4, atol: float = 1e-4) -> bool:
+        reference = self.state[self.node_ids[0]]
+        return all(
+            state.keys() == reference.keys() and
+            all(np.allclose(state[k], reference[k], rtol=rtol, atol=atol) for k in reference)
+            for state in self.state.values()
+        )
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'received': {node: dict(r) for node, r in self.received.items()},
+            'links': {node: b.get_peer_metrics() for node, b in self.broadcasters.items()}
+        }
+
+    def shutdown(self):
+        for broadcaster in self.broadcasters.values():
+            broadcaster.shutdown(timeout=1.0)
+
+
+if __name__ == "__main__":
+    federation = LocalFederation(20, b"fortifi_federation_secret_key_32", latency=0.001, failure_rate=0.05)
+    federation.set_latency("node007", 0.2)  # one slow bank
+    rng = np.random.default_rng(0)
+    start = time.time()
+    for i in range(50):
+        sender = federation.node_ids[i % 5]
+        federation.broadcast(sender, {"layer1.weight": rng.standard_normal((64, 32)).astype(np.float32)})
+    federation.wait_idle(60)
+    print(f"Propagated 50 deltas across 20 nodes in {time.time() - start:.2f}s, converged={federation.converged()}")
+    slow = federation.metrics()['links']['node000']['node007']
+    print("node000 -> node007:", slow)
+    federation.shutdown()
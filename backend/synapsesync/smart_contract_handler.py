@@ -3,6 +3,8 @@ import json
 import os
 from datetime import datetime
 from typing import Dict, Any
+from concurrent.futures import Future
+from utils.tx_submitter import get_submitter
 
 class SmartContractHandler:
     def __init__(self, rpc_url: str, contract_address: str, abi_path: str, private_key: str):
@@ -11,40 +13,25 @@ class SmartContractHandler:
             abi = json.load(f)
         self.contract = self.w3.eth.contract(address=contract_address, abi=abi)
         self.account = self.w3.eth.account.from_key(private_key)
+        # Shared per account: nonces are allocated locally, sends and receipts happen in the background
+        self.submitter = get_submitter(self.w3, self.account)
 
     def initiate_time_lock(self, tx_id: str, user_id: str, lock_minutes: int, trust_score: float, risk_score: float) -> str:
-        nonce = self.w3.eth.get_transaction_count(self.account.address)
-        tx = self.contract.functions.initiateTimeLock(
+        """Signed locally and sent in the background; the hash is returned immediately"""
+        return self.submitter.send(self.contract, 'initiateTimeLock', (
             tx_id,
             user_id,
             int(lock_minutes),
             int(trust_score * 10000),
             int(risk_score * 10000),
             int(datetime.utcnow().timestamp())
-        ).buildTransaction({
-            'from': self.account.address,
-            'nonce': nonce,
-            'gas': 250000,
-            'gasPrice': self.w3.toWei('50', 'gwei')
-        })
-        signed_tx = self.account.sign_transaction(tx)
-        tx_hash = self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-        return tx_hash.hex()
+        ), gas=250000)
 
     def release_time_lock(self, tx_id: str) -> str:
-        nonce = self.w3.eth.get_transaction_count(self.account.address)
-        tx = self.contract.functions.releaseTimeLock(
+        return self.submitter.send(self.contract, 'releaseTimeLock', (
             tx_id,
             int(datetime.utcnow().timestamp())
-        ).buildTransaction({
-            'from': self.account.address,
-            'nonce': nonce,
-            'gas': 120000,
-            'gasPrice': self.w3.toWei('50', 'gwei')
-        })
-        signed_tx = self.account.sign_transaction(tx)
-        tx_hash = self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-        return tx_hash.hex()
+        ), gas=120000)
 
     def get_lock_status(self, tx_id: str) -> Dict[str, Any]:
         status = self.contract.functions.getLockStatus(tx_id).call()
@@ -57,23 +44,15 @@ class SmartContractHandler:
             "last_update": datetime.utcfromtimestamp(status[5])
         }
 
-    def log_event(self, event_type: str, tx_id: str, user_id: str, extra: Dict[str, Any]):
-        nonce = self.w3.eth.get_transaction_count(self.account.address)
-        tx = self.contract.functions.logTimeLockEvent(
+    def log_event(self, event_type: str, tx_id: str, user_id: str, extra: Dict[str, Any]) -> Future:
+        """Fire-and-forget; batched with other events. The future resolves to the carrying tx hash"""
+        return self.submitter.enqueue_event(self.contract, 'logTimeLockEvent', (
             event_type,
             tx_id,
             user_id,
             json.dumps(extra),
             int(datetime.utcnow().timestamp())
-        ).buildTransaction({
-            'from': self.account.address,
-            'nonce': nonce,
-            'gas': 80000,
-            'gasPrice': self.w3.toWei('50', 'gwei')
-        })
-        signed_tx = self.account.sign_transaction(tx)
-        tx_hash = self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-        return tx_hash.hex()
+        ), gas=80000)
 
 if __name__ == "__main__":
     import dotenv
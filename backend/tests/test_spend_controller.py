@@ -0,0 +1,158 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.config import config
+from dynamic_spend_control.controller import SpendController
+
+PROFILE_RESPONSES = {
+    'current': {'anomaly_score': 0.2, 'session_risk': 0.1, 'device_trust': 0.9},
+    'latest': {'current_score': 0.1, '30d_average': 0.1, 'last_incident': None},
+    'patterns': {'daily_average': 200.0, 'weekly_max': 1400.0, 'common_categories': ['retail']}
+}
+
+
+class ProfileServiceHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(PROFILE_RESPONSES[self.path.rsplit('/', 1)[-1]]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def controller(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ProfileServiceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    for key, value in {
+        'behavior_service': f"{base}/behavior",
+        'fraud_service': f"{base}/fraud",
+        'spending_service': f"{base}/spending",
+        'policy_rules_path': str(tmp_path / 'policy_rules.json'),
+        'risk_model_path': str(tmp_path / 'risk_model.onnx'),
+        'limit_log_dir': str(tmp_path / 'limit_logs'),
+        'limit_sync_status_dir': str(tmp_path / 'limit_sync'),
+        'queue_dump_path': str(tmp_path / 'queue_dump.json'),
+        'log_secret': 'test-secret',
+        'sync_endpoints': [],
+        'sync_retry_policy': {'max_retries': 1, 'backoff': 0.01},
+        'controller_workers': 4
+    }.items():
+        monkeypatch.setitem(config, key, value)
+    controller = SpendController()
+    yield controller
+    server.shutdown()
+
+
+def make_tx(i, **extra):
+    return {'id': f"tx_{i}", 'user_id': f"user_{i % 5}", 'amount': 50.0 * (i % 4 + 1),
+            'category': 'retail', 'location': 'US', **extra}
+
+
+def test_shutdown_drains_queued_transactions(controller, tmp_path):
+    for i in range(40):
+        controller.process_transaction(make_tx(i), priority=i % 3)
+    controller.shutdown()
+
+    metrics = controller.get_dispatch_metrics()
+    assert metrics['total_processed'] == 40
+    assert metrics['total_failed'] == 0
+    assert metrics['queue_depth'] == 0
+    assert metrics['active_users'] == 0
+    assert metrics['stage_latency_ms']['queue_wait']['count'] == 40
+    assert not (tmp_path / 'queue_dump.json').exists()
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def record_emergencies(controller):
+    handled = []
+    controller._execute_emergency_protocols = lambda user_id, limits: handled.append(user_id)
+    return handled
+
+
+def test_emergency_transactions_bypass_priority_queue(controller):
+    controller.dispatch_stop.set()
+    controller.dispatcher.join()
+    handled = record_emergencies(controller)
+
+    controller.process_transaction(make_tx(0, type='card_compromised'))
+    controller.process_transaction(make_tx(1))
+
+    assert controller.transaction_queue.qsize() == 1
+    assert controller.transaction_queue.queue[0][-1]['id'] == 'tx_1'
+    assert wait_for(lambda: handled == ['user_0'])
+    assert controller.get_dispatch_metrics()['total_processed'] == 1
+    controller.workers.shutdown(wait=True)
+
+
+def test_emergency_for_an_active_user_runs_after_the_owning_worker(controller):
+    controller.dispatch_stop.set()
+    controller.dispatcher.join()
+    handled = record_emergencies(controller)
+    with controller.dispatch_lock:
+        controller.active_users.add('user_0')
+        controller.pending_by_user['user_0'] = [(time.monotonic(), make_tx(5))]
+
+    controller.process_transaction(make_tx(0, type='card_compromised'))
+    assert wait_for(lambda: len(controller.pending_by_user.get('user_0', [])) == 2)
+    assert handled == []
+    assert controller.pending_by_user['user_0'][0][1]['id'] == 'tx_0'
+
+    # The owner finishing hands the user's pending work, emergency first, to one worker
+    controller._release_user('user_0')
+    assert wait_for(lambda: 'user_0' not in controller.active_users)
+    controller.workers.shutdown(wait=True)
+    assert handled == ['user_0']
+    assert controller.get_dispatch_metrics()['total_processed'] == 2
+
+
+def test_queue_overflow_trips_circuit_breaker(controller):
+    controller.dispatch_stop.set()
+    controller.dispatcher.join()
+    controller.transaction_queue.maxsize = 1
+    controller.process_transaction(make_tx(0))
+    controller.process_transaction(make_tx(1))
+    assert controller.circuit_breakers['queue_overflow']['tripped']
+    controller.workers.shutdown(wait=True)
+    controller._dump_queue_state()
+
+
+def test_limit_updates_are_calculated_synced_and_logged(controller):
+    for i in range(10):
+        controller.process_transaction(make_tx(i))
+    controller.shutdown()
+
+    for user in range(5):
+        state = controller.limit_engine.get_user_state(f"user_{user}")
+        assert state is not None
+        assert len(state['history']) == 2
+        assert set(state['current_limits']) == {'daily', 'transaction', 'weekly'}
+    assert len(controller.limit_sync.sync_queue) + len(list(controller.limit_sync.status_dir.iterdir())) >= 10
+    assert controller.limit_logger.get_stats()['entries'] == 10
+
+
+def test_calculate_limits_starts_from_the_limits_in_force(controller):
+    profile = controller.profile_fetcher.get_full_profile('user_x')
+    risk = controller.risk_evaluator.evaluate(profile, make_tx(0, user_id='user_x'))
+    first = controller._calculate_limits(profile, risk)
+    assert first is not None
+    assert controller.limit_engine.get_current_limits('user_x') == first
+    second = controller._calculate_limits(profile, risk)
+    # Each step moves from the previous limits toward the same risk-adjusted target
+    assert abs(second['daily'] - first['daily']) < abs(first['daily'] - controller.limit_engine.base_limits['daily'])
+    controller.shutdown()
@@ -1,9 +1,13 @@
 import base64
 import os
+import struct
+from typing import Iterable, Iterator
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import hmac
 import hashlib
 
+STREAM_FRAME_SIZE = 1024 * 1024
+
 def generate_key(length: int = 32) -> bytes:
     return os.urandom(length)
 
@@ -19,6 +23,50 @@ def decrypt_payload(encrypted: bytes, secret: bytes) -> bytes:
     aesgcm = AESGCM(secret[:32])
     return aesgcm.decrypt(nonce, ciphertext, None)
 
+def encrypt_stream(chunks: Iterable[bytes], secret: bytes, frame_size: int = STREAM_FRAME_SIZE) -> Iterator[bytes]:
+    """
+    AES-GCM over a stream of buffers, one frame at a time, so the plaintext is
+    never joined into a single blob. Each frame is length-prefixed; its nonce is
+    a random 8-byte stream prefix plus the frame counter, and the AAD marks the
+    final frame, so reordered or truncated streams fail to decrypt.
+    """
+    aesgcm = AESGCM(secret[:32])
+    prefix = os.urandom(8)
+    yield prefix
+    counter = 0
+    pending = None
+    for chunk in chunks:
+        view = memoryview(chunk).cast('B')
+        for i in range(0, len(view), frame_size):
+            if pending is not None:
+                yield _seal_frame(aesgcm, prefix, counter, pending, False)
+                counter += 1
+            pending = view[i:i + frame_size]
+    yield _seal_frame(aesgcm, prefix, counter, pending if pending is not None else b'', True)
+
+
+def _seal_frame(aesgcm: AESGCM, prefix: bytes, counter: int, data, final: bool) -> bytes:
+    ciphertext = aesgcm.encrypt(prefix + struct.pack('>I', counter), data, b'\x01' if final else b'\x00')
+    return struct.pack('>I', len(ciphertext)) + ciphertext
+
+
+def decrypt_stream(data, secret: bytes) -> Iterator[memoryview]:
+    """Inverse of encrypt_stream over the concatenated frames; yields plaintext frames."""
+    aesgcm = AESGCM(secret[:32])
+    view = memoryview(data).cast('B')
+    prefix, pos, counter = bytes(view[:8]), 8, 0
+    while pos < len(view):
+        (length,) = struct.unpack_from('>I', view, pos)
+        pos += 4
+        final = pos + length == len(view)
+        yield memoryview(aesgcm.decrypt(prefix + struct.pack('>I', counter), view[pos:pos + length],
+                                        b'\x01' if final else b'\x00'))
+        pos += length
+        counter += 1
+    if counter == 0:
+        raise ValueError("Empty encrypted stream")
+
+
 def generate_zk_proof(data: dict, secret: str) -> str:
     # Deterministic hash for zero-knowledge proof
     serialized = str(sorted(data.items())).encode()
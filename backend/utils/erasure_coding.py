@@ -0,0 +1,149 @@
+import numpy as np
+from typing import Dict, List, Optional
+
+# GF(2^8) with the primitive polynomial x^8 + x^4 + x^3 + x^2 + 1 (0x11d)
+_GF_EXP = [0] * 512
+_GF_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    _GF_EXP[_i] = _x
+    _GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+for _i in range(255, 512):
+    _GF_EXP[_i] = _GF_EXP[_i - 255]
+
+
+def gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _GF_EXP[_GF_LOG[a] + _GF_LOG[b]]
+
+
+def gf_inv(a: int) -> int:
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return _GF_EXP[255 - _GF_LOG[a]]
+
+
+def _build_mul_table() -> np.ndarray:
+    log = np.array(_GF_LOG, dtype=np.int32)
+    exp = np.array(_GF_EXP, dtype=np.uint8)
+    table = exp[(log[:, None] + log[None, :])]
+    table[0, :] = 0
+    table[:, 0] = 0
+    return table.astype(np.uint8)
+
+
+# MUL_TABLE[c] is the 256-entry lookup for "multiply by c"; 64 KiB in total
+MUL_TABLE = _build_mul_table()
+
+# Per-coefficient 65536-entry tables that multiply two packed bytes per lookup (128 KiB each, built lazily)
+_PAIR_TABLES: Dict[int, np.ndarray] = {}
+_WORDS = np.arange(65536, dtype=np.uint32)
+
+
+def _pair_table(c: int) -> np.ndarray:
+    table = _PAIR_TABLES.get(c)
+    if table is None:
+        row = MUL_TABLE[c].astype(np.uint16)
+        table = _PAIR_TABLES.setdefault(c, row[_WORDS & 0xff] | (row[_WORDS >> 8] << 8))
+    return table
+
+
+def gf_invert_matrix(matrix: List[List[int]]) -> List[List[int]]:
+    """Gauss-Jordan inversion over GF(256). Raises ValueError if singular."""
+    n = len(matrix)
+    aug = [list(row) + [1 if i == j else 0 for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next((r for r in range(col, n) if aug[r][col]), None)
+        if pivot is None:
+            raise ValueError("Singular matrix")
+        aug[col], aug[pivot] = aug[pivot], aug[col]
+        inv = gf_inv(aug[col][col])
+        aug[col] = [gf_mul(v, inv) for v in aug[col]]
+        for r in range(n):
+            if r != col and aug[r][col]:
+                factor = aug[r][col]
+                aug[r] = [v ^ gf_mul(factor, p) for v, p in zip(aug[r], aug[col])]
+    return [row[n:] for row in aug]
+
+
+class ReedSolomonCodec:
+    """
+    Systematic Reed-Solomon erasure code over GF(2^8).
+
+    The first data_shards outputs are the input split into equal stripes; the
+    remaining parity shards come from a Cauchy matrix, so any data_shards of
+    the total_shards outputs reconstruct the input. Encode and decode are
+    table-driven NumPy (a two-bytes-at-a-time lookup plus XOR per coefficient,
+    in cache-sized blocks), so cost scales with bytes, not Python loop speed.
+    """
+
+    BLOCK_WORDS = 1 << 16
+
+    def __init__(self, data_shards: int, total_shards: int):
+        if not 0 < data_shards <= total_shards <= 256:
+            raise ValueError("Require 0 < data_shards <= total_shards <= 256")
+        self.data_shards = data_shards
+        self.total_shards = total_shards
+        self.parity_shards = total_shards - data_shards
+        k = data_shards
+        # Cauchy rows: 1 / (x_i + y_j), x_i = k + i, y_j = j; disjoint sets keep every minor invertible
+        self.parity_matrix = [[gf_inv((k + i) ^ j) for j in range(k)] for i in range(self.parity_shards)]
+        self.matrix = [[1 if i == j else 0 for j in range(k)] for i in range(k)] + self.parity_matrix
+        self._decode_cache: Dict[tuple, List[List[int]]] = {}
+
+    def shard_size(self, data_length: int) -> int:
+        return max(1, -(-data_length // self.data_shards))
+
+    def encode(self, data: bytes) -> List[bytes]:
+        size = self.shard_size(len(data))
+        buf = np.zeros(self.data_shards * size, dtype=np.uint8)
+        buf[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+        stripes = buf.reshape(self.data_shards, size)
+        return [stripes[i].tobytes() for i in range(self.data_shards)] + \
+            [row.tobytes() for row in self._combine(self.parity_matrix, stripes)]
+
+    @classmethod
+    def _combine(cls, coeff_rows: List[List[int]], inputs: np.ndarray) -> np.ndarray:
+        """out[r] = XOR_j coeff_rows[r][j] * inputs[j] over GF(256)."""
+        width = inputs.shape[1]
+        if width % 2:
+            inputs = np.pad(inputs, ((0, 0), (0, 1)))
+        words = np.ascontiguousarray(inputs).view(np.uint16)
+        out = np.zeros((len(coeff_rows), words.shape[1]), dtype=np.uint16)
+        scratch = np.empty(min(cls.BLOCK_WORDS, words.shape[1]), dtype=np.uint16)
+        for start in range(0, words.shape[1], cls.BLOCK_WORDS):
+            end = min(start + cls.BLOCK_WORDS, words.shape[1])
+            tmp = scratch[:end - start]
+            for r, coeffs in enumerate(coeff_rows):
+                acc = out[r, start:end]
+                for c, src in zip(coeffs, words[:, start:end]):
+                    if c == 0:
+                        continue
+                    if c == 1:
+                        np.bitwise_xor(acc, src, out=acc)
+                    else:
+                        np.take(_pair_table(c), src, out=tmp)
+                        np.bitwise_xor(acc, tmp, out=acc)
+        return out.view(np.uint8)[:, :width]
+
+    def decode(self, shards: Dict[int, bytes], data_length: Optional[int] = None) -> bytes:
+        """Rebuild the original bytes from any data_shards shards keyed by shard index."""
+        available = sorted(i for i, s in shards.items() if s is not None and 0 <= i < self.total_shards)
+        if len(available) < self.data_shards:
+            raise ValueError(f"Need {self.data_shards} shards to decode, got {len(available)}")
+        # Prefer data shards: if all are present this is a plain concatenation
+        chosen = tuple(sorted(available, key=lambda i: (i >= self.data_shards, i))[:self.data_shards])
+        if chosen == tuple(range(self.data_shards)):
+            data = b''.join(bytes(shards[i]) for i in chosen)
+        else:
+            inverse = self._decode_cache.get(chosen)
+            if inverse is None:
+                inverse = gf_invert_matrix([self.matrix[i] for i in chosen])
+                self._decode_cache[chosen] = inverse
+            inputs = np.stack([np.frombuffer(shards[i], dtype=np.uint8) for i in chosen])
+            data = self._combine(inverse, inputs).tobytes()
+        return data if data_length is None else data[:data_length]
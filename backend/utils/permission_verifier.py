@@ -0,0 +1,245 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+from utils.config import config
+from utils.logger import StructuredLogger
+
+try:
+    from eth_abi import decode as abi_decode
+except ImportError:  # eth-abi < 4
+    from eth_abi import decode_abi as abi_decode
+
+MULTICALL3_ABI = [{
+    'name': 'aggregate3',
+    'type': 'function',
+    'stateMutability': 'payable',
+    'inputs': [{
+        'name': 'calls',
+        'type': 'tuple[]',
+        'components': [
+            {'name': 'target', 'type': 'address'},
+            {'name': 'allowFailure', 'type': 'bool'},
+            {'name': 'callData', 'type': 'bytes'}
+        ]
+    }],
+    'outputs': [{
+        'name': 'returnData',
+        'type': 'tuple[]',
+        'components': [
+            {'name': 'success', 'type': 'bool'},
+            {'name': 'returnData', 'type': 'bytes'}
+        ]
+    }]
+}]
+
+TX_ID_ARGS = ('txId', 'tx_id', 'transactionId')
+ACCESSOR_ARGS = ('accessor', 'requestor', 'grantee', 'user')
+
+
+class PermissionVerifier:
+    """
+    Cached, batched verifyRecombinationPermission checks.
+
+    Results are cached per (tx_id, requestor) with a TTL (shorter for denials)
+    and an LRU bound. A daemon thread polls the contract's logs and drops cached
+    entries named by permission events, so revocations apply before the TTL
+    runs out. verify_many() resolves cache misses in one Multicall3 aggregate3
+    call when multicall_address is set, otherwise with concurrent eth_calls.
+    w3 and contract are plain web3 objects, so an eth-tester / anvil backed
+    instance works the same way as a live node.
+    """
+
+    def __init__(self, w3, contract, call_from: Optional[str] = None, function_name: str = 'verifyRecombinationPermission',
+                 settings: Optional[Dict[str, Any]] = None):
+        settings = {**config.get('splitmesh', {}).get('permissions', {}), **(settings or {})}
+        self.logger = StructuredLogger(name="PermissionVerifier")
+        self.w3 = w3
+        self.contract = contract
+        self.call_from = call_from
+        self.function_name = function_name
+        self.ttl = settings.get('ttl', 300.0)
+        self.negative_ttl = settings.get('negative_ttl', 10.0)
+        self.max_entries = settings.get('max_entries', 100000)
+        self.batch_size = settings.get('multicall_batch_size', 200)
+        self.invalidation_events = settings.get('invalidation_events',
+                                                ['PermissionGranted', 'PermissionRevoked', 'RecombinationPermissionUpdated'])
+        self.multicall = None
+        if settings.get('multicall_address'):
+            self.multicall = w3.eth.contract(address=settings['multicall_address'], abi=MULTICALL3_ABI)
+        self.executor = ThreadPoolExecutor(max_workers=settings.get('max_workers', 8),
+                                           thread_name_prefix="permission-check")
+
+        self.cache = OrderedDict()  # (tx_id, requestor) -> (expires_at, allowed)
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'rpc_calls': 0, 'invalidations': 0}
+        self.generation = 0  # bumped by invalidate(); results fetched across a bump are not cached
+        # Start the event cursor before anything is cached, so no revocation can fall before it
+        self.last_block = w3.eth.block_number
+        self.stop_event = threading.Event()
+        poll_interval = settings.get('event_poll_interval', 5.0)
+        if poll_interval:
+            self.poll_thread = threading.Thread(target=self._poll_loop, args=(poll_interval,), daemon=True)
+            self.poll_thread.start()
+
+    @staticmethod
+    def _key(tx_id: str, requestor: str) -> Tuple[str, str]:
+        return str(tx_id), str(requestor).lower()
+
+    def _lookup(self, key: Tuple[str, str], now: float) -> Optional[bool]:
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return entry[1]
+
+    def _store(self, key: Tuple[str, str], allowed: bool, generation: int):
+        expires = time.time() + (self.ttl if allowed else self.negative_ttl)
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.cache[key] = (expires, allowed)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def verify(self, tx_id: str, requestor: str) -> bool:
+        key = self._key(tx_id, requestor)
+        with self.lock:
+            cached = self._lookup(key, time.time())
+            self.stats['hits' if cached is not None else 'misses'] += 1
+            generation = self.generation
+        if cached is not None:
+            return cached
+        allowed = self._call_single(tx_id, requestor)
+        if allowed is None:
+            return False
+        self._store(key, allowed, generation)
+        return allowed
+
+    def verify_many(self, pairs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], bool]:
+        """Check many (tx_id, requestor) pairs; returns {(tx_id, requestor): allowed}."""
+        pairs = list(dict.fromkeys(pairs))
+        results: Dict[Tuple[str, str], bool] = {}
+        misses = []
+        now = time.time()
+        with self.lock:
+            for pair in pairs:
+                cached = self._lookup(self._key(*pair), now)
+                if cached is None:
+                    misses.append(pair)
+                else:
+                    results[pair] = cached
+            self.stats['hits'] += len(pairs) - len(misses)
+            self.stats['misses'] += len(misses)
+            generation = self.generation
+        if misses:
+            fetched = self._call_multicall(misses) if self.multicall else self._call_concurrent(misses)
+            for pair, allowed in fetched.items():
+                if allowed is not None:
+                    self._store(self._key(*pair), allowed, generation)
+                results[pair] = bool(allowed)
+        return results
+
+    def _call_single(self, tx_id: str, requestor: str) -> Optional[bool]:
+        try:
+            fn = getattr(self.contract.functions, self.function_name)(tx_id, requestor)
+            with self.lock:
+                self.stats['rpc_calls'] += 1
+            return bool(fn.call({'from': self.call_from} if self.call_from else {}))
+        except Exception as e:
+            self.logger.error(f"Permission check failed for {requestor} on tx {tx_id}: {e}")
+            return None
+
+    def _call_concurrent(self, pairs: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Optional[bool]]:
+        return dict(zip(pairs, self.executor.map(lambda p: self._call_single(*p), pairs)))
+
+    def _call_multicall(self, pairs: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Optional[bool]]:
+        """Note: inside aggregate3 msg.sender is the Multicall contract, not call_from."""
+        results: Dict[Tuple[str, str], Optional[bool]] = {}
+        fn = getattr(self.contract.functions, self.function_name)
+        for i in range(0, len(pairs), self.batch_size):
+            batch = pairs[i:i + self.batch_size]
+            calls = [(self.contract.address, True, self._hex_bytes(fn(*pair)._encode_transaction_data())) for pair in batch]
+            try:
+                with self.lock:
+                    self.stats['rpc_calls'] += 1
+                returned = self.multicall.functions.aggregate3(calls).call()
+            except Exception as e:
+                self.logger.error(f"Multicall permission check failed, falling back to single calls: {e}")
+                results.update(self._call_concurrent(batch))
+                continue
+            for pair, (success, data) in zip(batch, returned):
+                results[pair] = bool(abi_decode(['bool'], data)[0]) if success else None
+        return results
+
+    @staticmethod
+    def _hex_bytes(data) -> bytes:
+        if isinstance(data, str):
+            return bytes.fromhex(data[2:] if data.startswith('0x') else data)
+        return bytes(data)
+
+    def invalidate(self, tx_id: Optional[str] = None, requestor: Optional[str] = None):
+        """Drop cached entries matching tx_id and/or requestor; no arguments clears everything."""
+        requestor = requestor.lower() if requestor else None
+        with self.lock:
+            if tx_id is None and requestor is None:
+                self.cache.clear()
+            else:
+                for key in [k for k in self.cache
+                            if (tx_id is None or k[0] == str(tx_id)) and (requestor is None or k[1] == requestor)]:
+                    del self.cache[key]
+            self.generation += 1
+            self.stats['invalidations'] += 1
+
+    def poll_events(self) -> int:
+        """Apply permission events emitted since the last poll; returns the number handled."""
+        latest = self.w3.eth.block_number
+        if latest <= self.last_block:
+            return 0
+        logs = self.w3.eth.get_logs({'address': self.contract.address,
+                                     'fromBlock': self.last_block + 1, 'toBlock': latest})
+        self.last_block = latest
+        events = [getattr(self.contract.events, name)() for name in self.invalidation_events
+                  if self._has_event(name)]
+        handled = 0
+        for log in logs:
+            if not events:
+                # No known permission events in the ABI: any contract log invalidates
+                self.invalidate()
+                return len(logs)
+            for event in events:
+                try:
+                    args = (getattr(event, 'process_log', None) or event.processLog)(log)['args']
+                except Exception:
+                    continue
+                tx_id = next((args[a] for a in TX_ID_ARGS if a in args), None)
+                requestor = next((args[a] for a in ACCESSOR_ARGS if a in args), None)
+                self.invalidate(tx_id, requestor)
+                handled += 1
+                break
+        return handled
+
+    def _has_event(self, name: str) -> bool:
+        return any(item.get('type') == 'event' and item.get('name') == name for item in self.contract.abi)
+
+    def _poll_loop(self, interval: float):
+        while not self.stop_event.wait(interval):
+            try:
+                self.poll_events()
+            except Exception as e:
+                # Cannot see revocations: fail safe by dropping cached grants
+                self.logger.warning(f"Permission event poll failed, clearing cache: {e}")
+                self.invalidate()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {**self.stats, 'size': len(self.cache)}
+
+    def shutdown(self):
+        self.stop_event.set()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,331 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Callable, Tuple
+from utils.config import config
+from utils.logger import StructuredLogger
+
+_submitters: Dict[str, 'TransactionSubmitter'] = {}
+_submitters_lock = threading.Lock()
+
+
+def get_submitter(w3, account, settings: Optional[Dict[str, Any]] = None) -> 'TransactionSubmitter':
+    """Process-wide submitter per signing account, so every caller shares one nonce sequence."""
+    key = account.address.lower()
+    with _submitters_lock:
+        submitter = _submitters.get(key)
+        if submitter is None:
+            submitter = _submitters[key] = TransactionSubmitter(w3, account, settings)
+        return submitter
+
+
+class _PendingTx:
+    """A signed transaction in the outbox; the unsigned dict is kept so it can be re-signed with another nonce."""
+    __slots__ = ('tx', 'tx_hash', 'raw', 'origin_hash', 'on_receipt', 'futures', 'resigns')
+
+    def __init__(self, tx: dict, on_receipt: Optional[Callable], futures: List[Future]):
+        self.tx = tx
+        self.tx_hash = None
+        self.raw = None
+        self.origin_hash = None
+        self.on_receipt = on_receipt
+        self.futures = futures
+        self.resigns = 0
+
+
+class TransactionSubmitter:
+    """
+    Asynchronous contract transaction writer with a local nonce allocator.
+
+    send() signs on the caller's thread with the next local nonce and returns
+    the transaction hash straight away; the raw transaction goes out on a
+    background thread. enqueue_event() is for fire-and-forget audit events:
+    events are buffered for up to flush_interval or batch_size, and events for
+    the same function are packed into a single transaction when the contract
+    exposes a batch variant (configured in batch_functions, called with one
+    array per argument). Event futures resolve once the node has accepted the
+    carrying transaction. A second thread polls receipts and logs reverts and
+    transactions that are not mined within receipt_timeout.
+
+    If a transaction cannot be sent, the ones signed after it are re-signed
+    onto the freed nonces so no gap is left; on "nonce too low" the failed
+    transaction is re-signed too, starting from the node's pending count.
+    A re-signed transaction gets a new hash: on_receipt is still called with
+    the hash send() returned, and resolve_hash() maps it to the current one.
+    on_receipt(tx_hash, receipt, error) gets error set when the transaction
+    failed to send, reverted or was never mined.
+    """
+
+    def __init__(self, w3, account, settings: Optional[Dict[str, Any]] = None):
+        settings = {**config.get('blockchain', {}).get('submitter', {}), **(settings or {})}
+        self.logger = StructuredLogger(name="TransactionSubmitter")
+        self.w3 = w3
+        self.account = account
+        self.gas_price = int(settings.get('gas_price_gwei', 50) * 10 ** 9)
+        self.batch_size = settings.get('batch_size', 50)
+        self.flush_interval = settings.get('flush_interval', 0.5)
+        self.batch_functions: Dict[str, str] = settings.get('batch_functions', {})
+        self.send_retries = settings.get('send_retries', 3)
+        self.receipt_poll_interval = settings.get('receipt_poll_interval', 2.0)
+        self.receipt_timeout = settings.get('receipt_timeout', 300.0)
+        self._chain_id = None
+
+        self.nonce_lock = threading.Lock()
+        self.next_nonce = None
+        self.outbox = queue.Queue()  # _PendingTx, in nonce order
+        self.events = queue.Queue(maxsize=settings.get('max_pending_events', 100000))
+        self.pending_receipts: Dict[str, Tuple[float, _PendingTx]] = {}
+        self.receipts_lock = threading.Lock()
+        self.replacements: Dict[str, str] = {}  # hash handed to the caller -> hash of the re-signed tx
+        self.stats = {'sent': 0, 'events': 0, 'batched_txs': 0, 'mined': 0, 'reverted': 0,
+                      'send_failed': 0, 'resigned': 0, 'unconfirmed': 0, 'dropped_events': 0}
+        self.stats_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads = [
+            threading.Thread(target=self._send_loop, daemon=True),
+            threading.Thread(target=self._batch_loop, daemon=True),
+            threading.Thread(target=self._receipt_loop, daemon=True)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def _count(self, key: str, n: int = 1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    @property
+    def chain_id(self) -> int:
+        if self._chain_id is None:
+            self._chain_id = self.w3.eth.chain_id
+        return self._chain_id
+
+    def _sync_nonce(self):
+        self.next_nonce = self.w3.eth.get_transaction_count(self.account.address, 'pending')
+
+    def _sign(self, pending: _PendingTx, nonce: int):
+        pending.tx = {**pending.tx, 'nonce': nonce}
+        signed = self.account.sign_transaction(pending.tx)
+        pending.tx_hash = signed.hash.hex()
+        pending.raw = getattr(signed, 'raw_transaction', None) or signed.rawTransaction
+        if pending.origin_hash is None:
+            pending.origin_hash = pending.tx_hash
+
+    def _sign_and_queue(self, fn, gas: int, on_receipt: Optional[Callable] = None,
+                        futures: Optional[List[Future]] = None) -> str:
+        """Allocate a nonce, sign and hand off to the sender; nonce order equals queue order."""
+        build = getattr(fn, 'build_transaction', None) or fn.buildTransaction
+        with self.nonce_lock:
+            if self.next_nonce is None:
+                self._sync_nonce()
+            pending = _PendingTx(build({
+                'from': self.account.address,
+                'nonce': self.next_nonce,
+                'gas': gas,
+                'gasPrice': self.gas_price,
+                'chainId': self.chain_id
+            }), on_receipt, futures or [])
+            self._sign(pending, self.next_nonce)
+            self.next_nonce += 1
+            self.outbox.put(pending)
+        return pending.tx_hash
+
+    def resolve_hash(self, tx_hash: str) -> str:
+        """Current hash for a hash returned by send(); differs only if the transaction was re-signed."""
+        return self.replacements.get(tx_hash, tx_hash)
+
+    def send(self, contract, function_name: str, args: tuple, gas: int,
+             on_receipt: Optional[Callable[[str, Optional[dict], Optional[Exception]], None]] = None) -> str:
+        """Sign now, send in the background; returns the transaction hash without any RPC round trip."""
+        return self._sign_and_queue(getattr(contract.functions, function_name)(*args), gas, on_receipt)
+
+    def enqueue_event(self, contract, function_name: str, args: tuple, gas: int) -> Future:
+        """Fire-and-forget event write; the future resolves to the hash of the transaction carrying it."""
+        future = Future()
+        try:
+            self.events.put_nowait((contract, function_name, tuple(args), gas, future))
+            self._count('events')
+        except queue.Full:
+            self._count('dropped_events')
+            self.logger.error(f"Event queue full, dropping {function_name} event")
+            future.set_exception(RuntimeError("event queue full"))
+        return future
+
+    def _batch_loop(self):
+        while not self.stop_event.is_set() or not self.events.empty():
+            try:
+                batch = [self.events.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.events.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush_events(batch)
+            for _ in batch:
+                self.events.task_done()
+
+    def _flush_events(self, batch: List[tuple]):
+        groups: Dict[Tuple[str, str], List[tuple]] = {}
+        for item in batch:
+            groups.setdefault((item[0].address, item[1]), []).append(item)
+        for (_, function_name), items in groups.items():
+            contract = items[0][0]
+            batch_name = self.batch_functions.get(function_name)
+            try:
+                if batch_name and len(items) > 1 and hasattr(contract.functions, batch_name):
+                    columns = [list(col) for col in zip(*(item[2] for item in items))]
+                    fn = getattr(contract.functions, batch_name)(*columns)
+                    self._sign_and_queue(fn, sum(item[3] for item in items), futures=[item[4] for item in items])
+                    self._count('batched_txs')
+                else:
+                    for item in items:
+                        fn = getattr(contract.functions, function_name)(*item[2])
+                        self._sign_and_queue(fn, item[3], futures=[item[4]])
+            except Exception as e:
+                self.logger.error(f"Failed to build {function_name} transaction for {len(items)} events: {e}")
+                for item in items:
+                    if not item[4].done():
+                        item[4].set_exception(e)
+
+    def _send_loop(self):
+        while not self.stop_event.is_set() or not self.outbox.empty():
+            try:
+                pending = self.outbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            error = self._send_raw(pending)
+            if error is None:
+                self._count('sent')
+                with self.receipts_lock:
+                    self.pending_receipts[pending.tx_hash] = (time.time(), pending)
+                for future in pending.futures:
+                    future.set_result(pending.tx_hash)
+            else:
+                self._recover_nonces(pending, error)
+            self.outbox.task_done()
+
+    def _send_raw(self, pending: _PendingTx) -> Optional[Exception]:
+        """Send with retries; returns the final error, or None once the node has the transaction."""
+        for attempt in range(self.send_retries + 1):
+            try:
+                self.w3.eth.send_raw_transaction(pending.raw)
+                return None
+            except Exception as e:
+                if 'already known' in str(e).lower():
+                    return None
+                if 'nonce too low' in str(e).lower() or attempt == self.send_retries:
+                    return e
+                time.sleep(0.2 * 2 ** attempt)
+
+    def _recover_nonces(self, failed: _PendingTx, error: Exception):
+        """
+        Re-sign everything queued behind a failed transaction so the nonce
+        sequence stays contiguous. The sender is the only consumer of the
+        outbox and signing holds nonce_lock, so nothing moves while this runs.
+        """
+        nonce_too_low = 'nonce too low' in str(error).lower()
+        with self.nonce_lock:
+            queued = []
+            while True:
+                try:
+                    queued.append(self.outbox.get_nowait())
+                except queue.Empty:
+                    break
+            next_nonce = failed.tx['nonce']
+            if nonce_too_low:
+                # The nonce was used elsewhere: continue from the node's view of the account
+                try:
+                    next_nonce = max(next_nonce, self.w3.eth.get_transaction_count(self.account.address, 'pending'))
+                except Exception as e:
+                    self.logger.error(f"Could not read pending nonce, reusing {next_nonce}: {e}")
+            if nonce_too_low and failed.resigns < self.send_retries:
+                retry = [failed] + queued
+            else:
+                self._fail(failed, error)
+                retry = queued
+            for pending in retry:
+                self._sign(pending, next_nonce)
+                pending.resigns += 1
+                self.replacements[pending.origin_hash] = pending.tx_hash
+                next_nonce += 1
+                self.outbox.put(pending)
+            self.next_nonce = next_nonce
+            for _ in queued:
+                self.outbox.task_done()
+        if retry:
+            self._count('resigned', len(retry))
+            self.logger.warning(f"Re-signed {len(retry)} queued transactions from nonce {retry[0].tx['nonce']} "
+                                f"after {failed.origin_hash} failed to send")
+
+    def _fail(self, pending: _PendingTx, error: Exception):
+        self._count('send_failed')
+        self.logger.error(f"Failed to send transaction {pending.origin_hash}: {error}")
+        for future in pending.futures:
+            if not future.done():
+                future.set_exception(error)
+        self._notify(pending, None, error)
+
+    def _notify(self, pending: _PendingTx, receipt: Optional[dict], error: Optional[Exception]):
+        if pending.on_receipt:
+            try:
+                pending.on_receipt(pending.origin_hash, receipt, error)
+            except Exception as e:
+                self.logger.error(f"Receipt callback failed for {pending.origin_hash}: {e}")
+
+    def _receipt_loop(self):
+        while not self.stop_event.wait(self.receipt_poll_interval):
+            with self.receipts_lock:
+                pending_items = list(self.pending_receipts.items())
+            for tx_hash, (sent_at, pending) in pending_items:
+                try:
+                    receipt = self.w3.eth.get_transaction_receipt(tx_hash)
+                except Exception:
+                    receipt = None  # not mined yet (TransactionNotFound)
+                if receipt is None and time.time() - sent_at < self.receipt_timeout:
+                    continue
+                with self.receipts_lock:
+                    self.pending_receipts.pop(tx_hash, None)
+                error = None
+                if receipt is None:
+                    self._count('unconfirmed')
+                    error = TimeoutError(f"Transaction {tx_hash} not mined after {self.receipt_timeout}s")
+                    self.logger.warning(str(error))
+                elif receipt.get('status', 1) == 0:
+                    self._count('reverted')
+                    error = RuntimeError(f"Transaction {tx_hash} reverted")
+                    self.logger.error(str(error))
+                else:
+                    self._count('mined')
+                self._notify(pending, receipt, error)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until queued events and transactions have been sent."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.events.unfinished_tasks == 0 and self.outbox.unfinished_tasks == 0:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats.update({
+            'queued_events': self.events.qsize(),
+            'queued_txs': self.outbox.qsize(),
+            'awaiting_receipt': len(self.pending_receipts),
+            'next_nonce': self.next_nonce
+        })
+        return stats
+
+    def shutdown(self, timeout: float = 10.0):
+        self.flush(timeout)
+        self.stop_event.set()
+        for t in self.threads:
+            t.join(timeout=1.0)